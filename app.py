@@ -1,72 +1,173 @@
+import html
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 import streamlit as st
-import google.generativeai as genai
-import plotly.graph_objects as go
 
+from soul_animal_analytics import (
+    ANALYTICS_BATCH_SIZE,
+    ANALYTICS_DB,
+    ANALYTICS_FLUSH_INTERVAL_SECONDS,
+    ANALYTICS_QUEUE_SIZE,
+    AnalyticsLog,
+    classify_generation,
+    encode_answers_code,
+)
+from soul_animal_cache import (
+    RESULT_CACHE_MAX_KEYS,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_VARIETY,
+    ResultCache,
+)
+from soul_animal_charts import DEFAULT_RADAR_RENDERER, render_radar_chart
 from soul_animal_helpers import (
     DEFAULT_TEXT_MODEL_ID,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_RETRY_TOTAL,
+    IMAGE_WAIT_TIMEOUT_SECONDS,
+    SECRET_NAMES,
     TEXT_MODEL_OPTIONS,
     build_seedance_video_prompt,
+    configure_http_session,
     escape_profile_for_html,
-    extract_json_payload,
-    generate_openai_compatible_chat_text,
-    generate_siliconflow_image_url,
+    get_provider_name,
+    get_repair_counters,
     get_text_model_option,
-    validate_soul_profile,
+    normalize_answers,
+)
+from soul_animal_health import (
+    ADAPTIVE_TIMEOUT_MULTIPLIER,
+    ADAPTIVE_TIMEOUT_PERCENTILE,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_OPEN_SECONDS,
+    configure_provider_health,
 )
+from soul_animal_images import IMAGE_STORE_DIR, IMAGE_STORE_QUOTA_BYTES, ImageStore
+from soul_animal_metrics import collect_spans, configure_json_logging, get_metrics_registry, span
+from soul_animal_prefetch import (
+    DEFAULT_PREFETCH_MODE,
+    PREFETCH_BUDGET_PER_SESSION,
+    SpeculativePrefetcher,
+    get_prefetch_stats,
+    get_prefetcher_registry,
+    iter_prefetch_candidates,
+)
+from soul_animal_prompts import PROMPT_AB_WEIGHTS, choose_prompt_version, get_prompt_stats
+from soul_animal_routing import CASCADE_FAST_TIMEOUT_SECONDS, HEDGE_AFTER_SECONDS, get_cascade_stats
+from soul_animal_scheduler import (
+    ADMISSION_DEADLINE_SECONDS,
+    MAX_IN_FLIGHT_PER_PROVIDER,
+    PROVIDER_RATE_LIMITS,
+    configure_provider_scheduler,
+)
+from soul_animal_service import IMAGE_CIRCUIT_OPEN_NOTICE, SoulResultService
+from soul_animal_sessions import RESULT_ARTIFACT_MAX_BYTES, ResultArtifactStore, build_result_id
+from soul_animal_startup import prewarm_modules
+from soul_animal_store import PRECOMPUTED_RESULT_DB, SHARE_RESULT_DB, ShareStore, open_precomputed_store
+from soul_animal_themes import DEFAULT_THEME_ID, get_theme_pack
+
+# 分享链接的查询参数：?r=<分享 ID>
+SHARE_QUERY_PARAM = "r"
+
+# 主题包决定题目、Prompt、雷达图维度、图片风格和 CSS。soul-animal-dark 通过 THEME_ID 运行同一份页面；
+# 直接运行 app.py 时读取 secrets 中的 THEME
+theme = get_theme_pack(globals().get("THEME_ID") or st.secrets.get("THEME", DEFAULT_THEME_ID))
 
 # --- 页面配置 ---
-st.set_page_config(page_title="灵魂潜行", page_icon="✨", layout="centered")
+st.set_page_config(page_title=theme.copy["page_title"], page_icon=theme.copy["page_icon"], layout="centered")
 
 # --- 移动端优化 CSS ---
-st.markdown("""
-<style>
-    /* 全局背景与字体 - 偏向深邃空灵 */
-    .stApp { background-color: #080b12; color: #e6e9f0; font-family: -apple-system, BlinkMacSystemFont, sans-serif; }
-    h1, h2, h3 { color: #E5C07B; text-align: center; font-weight: 300; letter-spacing: 2px; }
-    
-    /* 进度条样式 */
-    .stProgress > div > div > div > div { background-color: #E5C07B; }
-    
-    /* 单选题优化：扩大点击热区，适合手机盲按 */
-    .stRadio > label { font-size: 1.1rem !important; color: #abb2bf; margin-bottom: 10px; }
-    div[role="radiogroup"] > label {
-        padding: 15px; 
-        background: rgba(255,255,255,0.03); 
-        border-radius: 10px; 
-        border: 1px solid rgba(255,255,255,0.05);
-        margin-bottom: 10px;
-    }
-    div[role="radiogroup"] > label > div:first-of-type { background-color: #E5C07B !important; }
-
-    /* 按钮样式：大圆角，防误触 */
-    .stButton > button { 
-        width: 100%; background: linear-gradient(135deg, #E5C07B, #D4AF37); 
-        color: #1e1e1e; font-weight: bold; border: none; padding: 15px; 
-        border-radius: 25px; font-size: 1.1em; letter-spacing: 1px;
-        box-shadow: 0 4px 15px rgba(229, 192, 123, 0.2);
-        margin-top: 20px;
-    }
-    
-    /* 结果卡片 */
-    .result-container {
-        background: linear-gradient(180deg, rgba(30,34,42,0.8) 0%, rgba(15,17,21,0.9) 100%);
-        padding: 25px; border-radius: 20px; text-align: center;
-        margin-top: 20px; border: 1px solid rgba(229,192,123,0.2);
-        box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-    }
-    .tag {
-        background: rgba(229, 192, 123, 0.1); border: 1px solid #E5C07B;
-        color: #E5C07B; padding: 5px 15px; border-radius: 20px;
-        font-size: 0.85rem; margin: 4px; display: inline-block;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(theme.css, unsafe_allow_html=True)
 
 # --- 状态管理 (用于分页) ---
 if 'page' not in st.session_state:
     st.session_state.page = 1
+# session_state 只放小对象：页码、答案下标 {"q1": 0, ...} 和结果 ID；侧写、雷达图等大对象在进程级结果库里共用
 if 'answers' not in st.session_state:
     st.session_state.answers = {}
+if 'result_id' not in st.session_state:
+    st.session_state.result_id = None
+    st.session_state.result_notice = None
+    st.session_state.result_error = None
+    st.session_state.image_error = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+    # 上一次记过浏览事件的页码，页码变化时才记一次 page_view
+    st.session_state.viewed_page = None
+
+# --- Provider 连接池 (进程内只初始化一次) ---
+@st.cache_resource
+def init_http_session():
+    return configure_http_session(
+        pool_connections=st.secrets.get("HTTP_POOL_CONNECTIONS", HTTP_POOL_CONNECTIONS),
+        pool_maxsize=st.secrets.get("HTTP_POOL_MAXSIZE", HTTP_POOL_MAXSIZE),
+        retry_total=st.secrets.get("HTTP_RETRY_TOTAL", HTTP_RETRY_TOTAL),
+    )
+
+
+@st.cache_resource
+def init_provider_scheduler():
+    # secrets 中的 [PROVIDER_RATE_LIMITS.<provider>] 覆盖默认限速
+    limits = {provider: dict(provider_limits) for provider, provider_limits in PROVIDER_RATE_LIMITS.items()}
+    for provider, provider_limits in st.secrets.get("PROVIDER_RATE_LIMITS", {}).items():
+        limits.setdefault(provider, {}).update(provider_limits)
+    return configure_provider_scheduler(
+        limits=limits,
+        max_in_flight=st.secrets.get("MAX_IN_FLIGHT_PER_PROVIDER", MAX_IN_FLIGHT_PER_PROVIDER),
+        deadline_seconds=st.secrets.get("ADMISSION_DEADLINE_SECONDS", ADMISSION_DEADLINE_SECONDS),
+    )
+
+
+@st.cache_resource
+def init_provider_health():
+    # 自适应超时和熔断参数；固定超时仍是上限
+    return configure_provider_health(
+        percentile=st.secrets.get("ADAPTIVE_TIMEOUT_PERCENTILE", ADAPTIVE_TIMEOUT_PERCENTILE),
+        multiplier=st.secrets.get("ADAPTIVE_TIMEOUT_MULTIPLIER", ADAPTIVE_TIMEOUT_MULTIPLIER),
+        failure_threshold=st.secrets.get("BREAKER_FAILURE_THRESHOLD", BREAKER_FAILURE_THRESHOLD),
+        open_seconds=st.secrets.get("BREAKER_OPEN_SECONDS", BREAKER_OPEN_SECONDS),
+    )
+
+
+@st.cache_resource
+def init_metrics_logging():
+    # METRICS_JSON_LOG = true 时每个耗时 span 输出一行 JSON 日志到标准错误
+    if st.secrets.get("METRICS_JSON_LOG", False):
+        configure_json_logging()
+
+
+def export_metrics():
+    # METRICS_FILE 指向 node_exporter textfile collector 目录下的 .prom 文件
+    metrics_file = st.secrets.get("METRICS_FILE")
+    if metrics_file:
+        get_metrics_registry().write_prometheus(metrics_file)
+
+
+@st.cache_resource
+def init_analytics_log():
+    # ANALYTICS_ENABLED = false 时不记录事件；写入在后台线程批量完成，页面只入队
+    if not st.secrets.get("ANALYTICS_ENABLED", True):
+        return None
+    return AnalyticsLog(
+        st.secrets.get("ANALYTICS_DB", ANALYTICS_DB),
+        queue_size=st.secrets.get("ANALYTICS_QUEUE_SIZE", ANALYTICS_QUEUE_SIZE),
+        batch_size=st.secrets.get("ANALYTICS_BATCH_SIZE", ANALYTICS_BATCH_SIZE),
+        flush_interval_seconds=st.secrets.get("ANALYTICS_FLUSH_INTERVAL_SECONDS", ANALYTICS_FLUSH_INTERVAL_SECONDS),
+    )
+
+
+def track_event(event, **fields):
+    # 非阻塞：队列满时事件被丢弃，不影响页面
+    if analytics_log is not None:
+        analytics_log.record(event, session_id=st.session_state.session_id, theme=theme.theme_id, **fields)
+
+
+init_http_session()
+provider_scheduler = init_provider_scheduler()
+provider_health = init_provider_health()
+init_metrics_logging()
+analytics_log = init_analytics_log()
 
 # --- 模型选择 ---
 text_model_ids = list(TEXT_MODEL_OPTIONS.keys())
@@ -88,186 +189,523 @@ selected_visual_output = st.sidebar.selectbox(
     format_func=lambda output_id: visual_output_options[output_id],
 )
 
+routing_mode_options = {
+    "single": "仅使用所选模型",
+    "hedged": "对冲请求 + 故障转移",
+    "cascade": "快速模型优先，校验失败再升级",
+}
+selected_routing_mode = st.sidebar.selectbox(
+    "路由模式",
+    list(routing_mode_options.keys()),
+    format_func=lambda mode: routing_mode_options[mode],
+    help=(
+        "对冲模式下，所选模型超过阈值未返回时会同时请求备用模型，取先通过校验的结果；请求失败时自动切换。"
+        "级联模式先用快速模型，超时或校验失败时才升级到所选的强模型。"
+    ),
+)
+
+stream_text_output = st.sidebar.checkbox("流式生成", value=True, help="边生成边展示动物名、引言和关键词")
+
+show_timing_breakdown = st.sidebar.checkbox("显示耗时分解", value=False, help="运维排查用：展示本次生成各阶段的耗时")
+timing_slot = st.sidebar.empty()
+
+if selected_routing_mode == "cascade":
+    with st.sidebar.expander("级联统计"):
+        # escalation_rate：没有由第一档快速模型返回的请求比例；tiers：每档的尝试结果和平均耗时
+        st.json(get_cascade_stats().summary())
+
+with st.sidebar.expander("Provider 健康"):
+    # state：closed 正常 / open 熔断中 / half_open 等待探测；timeout_seconds 是按耗时分位数算出的当前超时
+    st.json(provider_health.summary())
+
+with st.sidebar.expander("JSON 修复统计"):
+    # strict: 直接通过校验；local_repair: 本地修复；followup_repair: 追加修复请求；failed: 全部失败
+    st.json(get_repair_counters())
+
+if analytics_log is not None:
+    with st.sidebar.expander("事件日志"):
+        # dropped：队列满时丢弃的事件数；queued：还在内存队列里等待批量写入的事件数
+        st.json(analytics_log.stats())
+
+# Prompt A/B：按 session 稳定分流，同一个用户重新生成时仍使用同一版本。secrets 中的权重只覆盖默认主题
+default_prompt_weights = dict(st.secrets.get("PROMPT_AB_WEIGHTS", PROMPT_AB_WEIGHTS))
+prompt_weights = default_prompt_weights if theme.theme_id == DEFAULT_THEME_ID else theme.prompt_weights
+session_prompt_version = choose_prompt_version(st.session_state.session_id, prompt_weights)
+
+# 投机预取：用户还在看最后一题时就在后台生成结果，结果页直接命中缓存或等待进行中的请求
+prefetch_mode = st.secrets.get("SPECULATIVE_PREFETCH", DEFAULT_PREFETCH_MODE)
+
+with st.sidebar.expander("预取统计"):
+    # adoption_rate：预取结果被结果页用上的比例；unused 的结果仍留在共享缓存里
+    st.json(get_prefetch_stats().summary())
+
+with st.sidebar.expander("Prompt A/B 统计"):
+    # 每个版本的请求数、严格通过率、最终通过率、平均耗时和平均 token 用量
+    st.json(get_prompt_stats().summary())
+
 missing_text_secret = selected_text_model["secret_name"] not in st.secrets
 if missing_text_secret:
     st.sidebar.warning(f"缺少 {selected_text_model['secret_name']}，生成结果前请先配置。")
+elif not provider_health.is_available(get_provider_name(selected_text_model), selected_text_model["model"]):
+    st.sidebar.warning(f"{selected_text_model['label']} 暂时熔断，没有缓存结果时会自动改用其他已配置的模型。")
 if selected_visual_output == "siliconflow_flux" and "SILICONFLOW_API_KEY" not in st.secrets:
     st.sidebar.info("未配置 SILICONFLOW_API_KEY 时会跳过图片生成。")
 
-# --- 题库 ---
-questions = [
-    {"id": "q1", "q": "1. 暴风雨夜，全世界电力切断。作为幸存者，你的第一反应是？", 
-     "options": ["A. 建立绝对防御圈（生存优先）", "B. 组建互助联盟（社交优先）", "C. 记录这一切混乱（观察者）"]},
-    {"id": "q2", "q": "2. 在名利场晚宴上，最让你感到不适的是？", 
-     "options": ["A. 低效的寒暄与客套", "B. 满场的虚伪与面具", "C. 无人关注到你的存在"]},
-    {"id": "q3", "q": "3. 如果必须获得一种能力，你会选择？", 
-     "options": ["A. 读心术：洞察一切谎言", "B. 预知未来：掌握绝对因果", "C. 隐形：获得纯粹的自由"]},
-    {"id": "q4", "q": "4. 面对愚蠢权威的发号施令，你的本能反应是？", 
-     "options": ["A. 当面指出逻辑漏洞", "B. 表面顺从，幕后按自己方式办", "C. 转身离开，不浪费时间"]},
-    {"id": "q5", "q": "5. 你认为这个世界的底层运行逻辑更像是？", 
-     "options": ["A. 弱肉强食的黑暗森林", "B. 精密冰冷的因果程序", "C. 一场没有意义但有趣的戏剧"]}
-]
-
 # --- 绘图函数 ---
-def plot_radar_chart(stats):
-    categories = list(stats.keys())
-    values = list(stats.values())
-    categories += [categories[0]]
-    values += [values[0]]
-    fig = go.Figure()
-    fig.add_trace(go.Scatterpolar(
-        r=values, theta=categories, fill='toself',
-        fillcolor='rgba(229, 192, 123, 0.2)', line=dict(color='#E5C07B', width=2), marker=dict(size=4)
-    ))
-    fig.update_layout(
-        polar=dict(radialaxis=dict(visible=False, range=[0, 100]), bgcolor='rgba(0,0,0,0)'),
-        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='#abb2bf', size=14), margin=dict(l=30, r=30, t=20, b=20), height=280
+# 雷达图默认在服务端渲染成内联 SVG，移动端不用下载 Plotly 的前端脚本；RADAR_RENDERER = "plotly" 时恢复交互图表
+radar_renderer = st.secrets.get("RADAR_RENDERER", DEFAULT_RADAR_RENDERER)
+
+# --- 结果生成与渲染 ---
+@st.cache_resource
+def get_service():
+    # 进程级生成服务：所有 session 共享同一份结果缓存、预计算结果库和图片库
+    return SoulResultService(
+        {name: st.secrets[name] for name in SECRET_NAMES if name in st.secrets},
+        result_cache=ResultCache(
+            ttl_seconds=st.secrets.get("RESULT_CACHE_TTL_SECONDS", RESULT_CACHE_TTL_SECONDS),
+            max_keys=st.secrets.get("RESULT_CACHE_MAX_KEYS", RESULT_CACHE_MAX_KEYS),
+            variety=st.secrets.get("RESULT_CACHE_VARIETY", RESULT_CACHE_VARIETY),
+        ),
+        precomputed_store=open_precomputed_store(st.secrets.get("PRECOMPUTED_RESULT_DB", PRECOMPUTED_RESULT_DB)),
+        image_store=ImageStore(
+            st.secrets.get("IMAGE_STORE_DIR", IMAGE_STORE_DIR),
+            quota_bytes=st.secrets.get("IMAGE_STORE_QUOTA_BYTES", IMAGE_STORE_QUOTA_BYTES),
+        ),
+        hedge_after_seconds=st.secrets.get("HEDGE_AFTER_SECONDS", HEDGE_AFTER_SECONDS),
+        prompt_weights=default_prompt_weights,
+        cascade_fast_timeout_seconds=st.secrets.get("CASCADE_FAST_TIMEOUT_SECONDS", CASCADE_FAST_TIMEOUT_SECONDS),
+        share_store=ShareStore(st.secrets.get("SHARE_RESULT_DB", SHARE_RESULT_DB)),
+    )
+
+
+@st.cache_resource
+def get_artifact_store():
+    # 进程级结果库：相同结果只存一份，按估算字节数限制容量
+    return ResultArtifactStore(max_bytes=st.secrets.get("RESULT_ARTIFACT_MAX_BYTES", RESULT_ARTIFACT_MAX_BYTES))
+
+
+def generate_result(answers_key, text_model_id, use_cache=True, on_field=None, routing_mode="single", prompt_version=None):
+    # 返回 (结果 ID, 共享结果条目, 提示, 结果来源)；同一份侧写已经在结果库里时不再重复渲染雷达图
+    generated = get_service().generate_profile(
+        answers_key,
+        text_model_id,
+        use_cache=use_cache,
+        on_field=on_field,
+        routing_mode=routing_mode,
+        prompt_version=prompt_version,
+        theme_id=theme.theme_id,
     )
-    return fig
+    data = generated["data"]
+    result_id = build_result_id(generated["key"], generated["text_model_id"], generated["prompt_version"], data)
+    artifact = get_artifact_store().get(result_id)
+    if artifact is None:
+        with span("chart"):
+            chart = render_radar_chart(data["stats"], radar_renderer, theme.radar_style)
+        artifact = get_artifact_store().put(
+            result_id,
+            {
+                "key": generated["key"],
+                "text_model_id": generated["text_model_id"],
+                "prompt_version": generated["prompt_version"],
+                "data": data,
+                "chart": chart,
+                "source_image_url": generated["source_image_url"],
+                "image_key": None,
+                # 分享 ID 包含图片 key，按图片 key 分别记录
+                "shares": {},
+            },
+        )
+    return result_id, artifact, generated["notice"], generated["source"]
+
+
+def track_image_event(artifact, outcome, detail=None):
+    track_event(
+        "image",
+        answers=encode_answers_code(artifact["key"], theme.questions),
+        prompt_version=artifact["prompt_version"],
+        outcome=outcome,
+        detail=detail,
+    )
+
+
+def submit_result_image(result_id, artifact):
+    # image_prompt 校验通过后把图片请求交给后台线程，文字部分先渲染；图片先查本地图片库（按模型 + prompt + 尺寸寻址）。
+    # future 不进 session：rerun 时重新调用，服务按图片 key 返回仍在进行的同一个任务，不会重复占用图片线程
+    service = get_service()
+    if not artifact["data"]["image_prompt"] or artifact["image_key"]:
+        return None
+    # 等待超时后图片任务仍在后台进行，晚到的图片写进图片库后，下一次 rerun 先在这里命中
+    image_key = service.find_image(artifact["data"], theme.theme_id)
+    if image_key:
+        get_artifact_store().update(result_id, image_key=image_key)
+        st.session_state.image_error = None
+        return None
+    if st.session_state.image_error:
+        return None
+    # 图片 provider 熔断时不提交请求，直接降级为文字结果 + Seedance 视频 Prompt
+    if not artifact["source_image_url"] and not service.is_image_provider_available():
+        st.session_state.image_error = IMAGE_CIRCUIT_OPEN_NOTICE
+        track_image_event(artifact, "circuit_open")
+        return None
+    return service.submit_image(artifact["data"], artifact["source_image_url"], theme.theme_id)
+
+
+def render_timing_breakdown(spans):
+    # 图片阶段在后台线程完成，等待结束后才会出现在列表里
+    rows = [
+        {
+            "阶段": item.stage,
+            "耗时 (ms)": round(item.duration_seconds * 1000, 1),
+            "provider": item.provider or "",
+            "模型": item.model or "",
+            "状态": item.status,
+        }
+        for item in spans
+    ]
+    with timing_slot.container():
+        st.caption("本次生成耗时分解")
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+
+
+def render_result_preview(preview_slot, fields):
+    # 流式生成时的结果卡片预览：字段到齐一个就刷新一次，校验通过后由 render_result 替换
+    parts = []
+    if isinstance(fields.get("animal"), str):
+        parts.append(f"<h1 style='color: {theme.colors['accent']}; margin-bottom: 5px;'>{html.escape(fields['animal'], quote=True)}</h1>")
+    if isinstance(fields.get("quote"), str):
+        parts.append(f"<p style='font-style: italic; color: {theme.colors['quote']}; margin-bottom: 20px;'>“{html.escape(fields['quote'], quote=True)}”</p>")
+    if isinstance(fields.get("keywords"), list):
+        tags = ' '.join([f'<span class="tag">#{html.escape(str(k), quote=True)}</span>' for k in fields['keywords']])
+        parts.append(f"<div style='margin-bottom: 20px;'>{tags}</div>")
+    if parts:
+        preview_slot.markdown(f"<div class='result-container'>{''.join(parts)}</div>", unsafe_allow_html=True)
+
+
+def show_result_image(image_key, result_theme):
+    image_store = get_service().image_store
+    image_bytes = image_store.get(image_key)
+    if image_bytes is None:
+        st.warning("图腾图片已被清理，可点击“重新生成”再试。")
+        return
+    st.image(image_bytes, caption=result_theme.copy["image_caption"], use_container_width=True)
+    st.download_button("保存高清图腾", image_store.get(image_key, "full") or image_bytes, file_name="soul-totem.webp", mime="image/webp")
+
+
+def show_image_error(message):
+    st.warning(message)
+    # 超时或失败时只重试图片，文字结果保持不变；熔断时不提供重试，直接展示视频 Prompt
+    if message != IMAGE_CIRCUIT_OPEN_NOTICE and st.button("↻ 重试图腾", key="retry_image"):
+        st.session_state.image_error = None
+        st.rerun()
+
+
+def fill_image_slot(result_id, artifact, image_future, image_slot):
+    # 在文字和按钮都渲染完之后再等待图片
+    if image_future is None:
+        return
+    image_key = None
+    with image_slot.container():
+        with st.spinner("正在渲染灵魂图腾..."):
+            try:
+                image_key = image_future.result(timeout=IMAGE_WAIT_TIMEOUT_SECONDS)
+            except FutureTimeoutError:
+                st.session_state.image_error = "图腾渲染超时，本次先展示文字结果，可点击“重试图腾”继续等待。"
+                track_image_event(artifact, "timeout")
+            except RuntimeError as exc:
+                st.session_state.image_error = str(exc)
+                track_image_event(artifact, "failed", str(exc))
+    if image_key:
+        get_artifact_store().update(result_id, image_key=image_key)
+        track_image_event(artifact, "ok")
+    with image_slot.container():
+        if image_key:
+            show_result_image(image_key, theme)
+        else:
+            show_image_error(st.session_state.image_error)
+
+
+def render_result(result, visual_output, result_theme=None):
+    # 分享链接按分享时的主题渲染，其余情况使用当前页面的主题
+    result_theme = result_theme or theme
+    data = result["data"]
+    safe_data = escape_profile_for_html(data)
+    colors = result_theme.colors
+
+    # 展示文字框架
+    st.markdown(f"""
+    <div class='result-container'>
+        <h1 style='color: {colors['accent']}; margin-bottom: 5px;'>{safe_data['animal']}</h1>
+        <p style='font-style: italic; color: {colors['quote']}; margin-bottom: 20px;'>“{safe_data['quote']}”</p>
+        <div style='margin-bottom: 20px;'>
+            {' '.join([f'<span class="tag">#{k}</span>' for k in safe_data['keywords']])}
+        </div>
+    """, unsafe_allow_html=True)
+    if isinstance(result["chart"], str):
+        st.markdown(result["chart"], unsafe_allow_html=True)
+    else:
+        st.plotly_chart(result["chart"], use_container_width=True)
+
+    # 图片占位：若图片仍在后台生成，由 fill_image_slot 在页面其余部分渲染完后填充
+    image_slot = st.empty()
+    if visual_output == "siliconflow_flux":
+        with image_slot.container():
+            if result["image_key"]:
+                show_result_image(result["image_key"], result_theme)
+            elif result["image_error"]:
+                show_image_error(result["image_error"])
+        if result["image_error"] == IMAGE_CIRCUIT_OPEN_NOTICE:
+            st.text_area("Seedance 视频 Prompt", build_seedance_video_prompt(data), height=150)
+    elif visual_output == "seedance_prompt":
+        st.text_area("Seedance 视频 Prompt", build_seedance_video_prompt(data), height=150)
+
+    # 深度分析
+    st.markdown(f"""
+        <p style='text-align: left; line-height: 1.8; color: {colors['body']}; margin-top: 25px; font-size: 1.05rem;'>{safe_data['analysis']}</p>
+        <div style='background: {colors['panel']}; padding: 20px; border-radius: 12px; margin-top: 20px; text-align: left;'>
+            <p style='color: {colors['label']};'>{result_theme.copy['mask']} <span style='color: {colors['value']};'>{safe_data['mask']}</span></p>
+            <p style='color: {colors['label']};'>{result_theme.copy['shadow']} <span style='color: {colors['value']};'>{safe_data['shadow']}</span></p>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+    return image_slot
+
+def show_share_link(result_id, artifact):
+    # 图片落定后再保存：分享 ID 按内容寻址，包含图片 key；同一份结果和图片只保存一次
+    image_key = artifact["image_key"] or ""
+    share_id = artifact["shares"].get(image_key)
+    if share_id is None:
+        share_id = get_service().share_result(
+            artifact["data"], artifact["image_key"], artifact["text_model_id"], artifact["prompt_version"], theme.theme_id
+        )
+        if share_id is None:
+            return
+        get_artifact_store().update(result_id, shares=dict(artifact["shares"], **{image_key: share_id}))
+    st.caption("分享链接：好友打开即可看到这张图腾卡片，无需重新测试")
+    st.code(f"{st.secrets.get('SHARE_BASE_URL', '')}?{SHARE_QUERY_PARAM}={share_id}", language=None)
+
+
+def render_shared_result(share_id):
+    # 分享链接只读分享结果库和图片库，不调用任何 provider
+    shared = get_service().get_shared_result(share_id)
+    track_event("share_view", outcome="ok" if shared else "expired", detail=share_id)
+    if shared is None:
+        st.warning("分享链接已失效，来测一测你自己的灵魂图腾吧。")
+    else:
+        # 旧版分享记录没有主题，按当前页面的主题渲染；主题不同时叠加分享主题的 CSS
+        shared_theme = get_theme_pack(shared["theme_id"] or theme.theme_id)
+        if shared_theme.theme_id != theme.theme_id:
+            st.markdown(shared_theme.css, unsafe_allow_html=True)
+        result = {
+            "data": shared["data"],
+            "chart": render_radar_chart(shared["data"]["stats"], radar_renderer, shared_theme.radar_style),
+            "image_key": shared["image_key"],
+            "image_error": None,
+        }
+        render_result(result, "siliconflow_flux" if shared["image_key"] else "none", shared_theme)
+    if st.button("✨ 我也测一测"):
+        del st.query_params[SHARE_QUERY_PARAM]
+        st.rerun()
+
+
+def prewarm_result_page_modules():
+    # 用户开始答题后在后台预先导入结果页的重量级依赖，进入结果页时不再等待导入
+    if not st.secrets.get("PREWARM_IMPORTS", True):
+        return
+    modules = ["plotly.graph_objects"] if radar_renderer == "plotly" else []
+    if "GEMINI_API_KEY" in st.secrets:
+        modules.append("google.generativeai")
+    if selected_visual_output == "siliconflow_flux":
+        modules.append("PIL.Image")
+    prewarm_modules(modules)
+
+def get_prefetcher():
+    # 预取器和它的 future 放在进程级注册表里，按 session ID 取回；session_state 不保存它们
+    return get_prefetcher_registry().get(
+        st.session_state.session_id,
+        lambda: SpeculativePrefetcher(
+            budget=st.secrets.get("PREFETCH_BUDGET_PER_SESSION", PREFETCH_BUDGET_PER_SESSION), theme_id=theme.theme_id
+        ),
+    )
+
+
+def prefetch_results(page_answers):
+    # 最后一页：all 模式进页面就预取最后一题的全部候选（最后一页只有一道题时）；
+    # selected 模式在本页答完后预取该组合，改选时取消还在排队的旧组合
+    if prefetch_mode == "off" or missing_text_secret:
+        return
+    service = get_service()
+    prefetcher = get_prefetcher()
+    options = dict(
+        text_model_id=selected_text_model_id,
+        visual_mode=selected_visual_output,
+        routing_mode=selected_routing_mode,
+        prompt_version=session_prompt_version,
+    )
+    last_questions = [theme.questions[index] for index in theme.pages[-1][1]]
+    if prefetch_mode == "all" and len(last_questions) == 1:
+        for answers in iter_prefetch_candidates(st.session_state.answers, last_questions[0]):
+            prefetcher.prefetch(service, answers, **options)
+    if all(page_answers.values()):
+        answers = dict(st.session_state.answers, **page_answers)
+        prefetcher.prefetch(service, answers, **options)
+        if prefetch_mode == "selected":
+            prefetcher.cancel_others(answers)
 
 # --- 交互界面 ---
-st.title("✨ 灵魂显影测试")
-st.markdown("<p style='text-align: center; color: #7f848e; font-size: 0.9rem; margin-bottom: 20px;'>测一测你内在的真实图腾</p>", unsafe_allow_html=True)
+st.title(theme.copy["title"])
+st.markdown(f"<p style='text-align: center; color: {theme.colors['muted']}; font-size: 0.9rem; margin-bottom: 20px;'>{theme.copy['subtitle']}</p>", unsafe_allow_html=True)
+
+# 通过分享链接进入时只展示分享的结果卡片
+if SHARE_QUERY_PARAM in st.query_params:
+    render_shared_result(st.query_params[SHARE_QUERY_PARAM])
+    st.stop()
+
+def clear_result():
+    st.session_state.result_id = None
+    st.session_state.result_notice = None
+    st.session_state.result_error = None
+    st.session_state.image_error = None
+
 
-# 进度条
 # 进度条 (使用 min 函数，确保进度最大不会超过 1.0 即 100%)
-progress_bar = st.progress(min(st.session_state.page / 3, 1.0))
-
-# ================= 第 1 页 (Q1, Q2) =================
-if st.session_state.page == 1:
-    st.write("### Part 1: 本能与社交")
-    ans1 = st.radio(questions[0]['q'], questions[0]['options'], index=None, key="r1")
-    ans2 = st.radio(questions[1]['q'], questions[1]['options'], index=None, key="r2")
-    
-    if st.button("下一页 ➜"):
-        if ans1 and ans2:
-            st.session_state.answers['q1'] = ans1
-            st.session_state.answers['q2'] = ans2
-            st.session_state.page = 2
-            st.rerun()
-        else:
-            st.warning("请完成本页所有直觉选择。")
+question_page_count = len(theme.pages)
+# 漏斗：每次进入新的一页记一条 page_view，结果页的页码为题目页数 + 1
+if st.session_state.viewed_page != st.session_state.page:
+    track_event("page_view", page=st.session_state.page)
+    st.session_state.viewed_page = st.session_state.page
+progress_bar = st.progress(min(st.session_state.page / question_page_count, 1.0))
 
-# ================= 第 2 页 (Q3, Q4) =================
-elif st.session_state.page == 2:
-    st.write("### Part 2: 欲望与边界")
-    ans3 = st.radio(questions[2]['q'], questions[2]['options'], index=None, key="r3")
-    ans4 = st.radio(questions[3]['q'], questions[3]['options'], index=None, key="r4")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("⬅ 返回"):
-            st.session_state.page = 1
-            st.rerun()
-    with col2:
-        if st.button("下一页 ➜"):
-            if ans3 and ans4:
-                st.session_state.answers['q3'] = ans3
-                st.session_state.answers['q4'] = ans4
-                st.session_state.page = 3
+# ================= 答题页：按主题包的分页逐页作答，最后一页提交后进入结果页 =================
+if st.session_state.page <= question_page_count:
+    page_index = st.session_state.page - 1
+    page_title, question_indexes = theme.pages[page_index]
+    is_last_page = st.session_state.page == question_page_count
+    st.write(f"### {page_title}")
+    if page_index > 0:
+        prewarm_result_page_modules()
+    page_questions = [theme.questions[question_index] for question_index in question_indexes]
+    page_answers = {}
+    for question in page_questions:
+        page_answers[question["id"]] = st.radio(question['q'], question['options'], index=None, key=f"r_{question['id']}")
+    if page_index == 0 and any(page_answers.values()):
+        prewarm_result_page_modules()
+    if is_last_page:
+        prefetch_results(page_answers)
+
+    next_label = theme.copy["submit"] if is_last_page else "下一页 ➜"
+    if page_index == 0:
+        next_clicked = st.button(next_label)
+    else:
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("⬅ 返回"):
+                st.session_state.page -= 1
                 st.rerun()
-            else:
-                st.warning("请完成本页所有直觉选择。")
-
-# ================= 第 3 页 (Q5 + 结果生成) =================
-elif st.session_state.page == 3:
-    st.write("### Part 3: 世界观")
-    ans5 = st.radio(questions[4]['q'], questions[4]['options'], index=None, key="r5")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("⬅ 返回"):
-            st.session_state.page = 2
+        with col2:
+            next_clicked = st.button(next_label)
+    if next_clicked:
+        if all(page_answers.values()):
+            # 只记选项下标，选项文本在需要时由题目表还原
+            st.session_state.answers.update(
+                {question["id"]: question["options"].index(page_answers[question["id"]]) for question in page_questions}
+            )
+            st.session_state.page += 1 # 最后一页提交后跳转到结果页
             st.rerun()
-            
-    with col2:
-        if st.button("🔮 生成图腾"):
-            if not ans5:
-                st.warning("请完成最后一题。")
-            else:
-                st.session_state.answers['q5'] = ans5
-                st.session_state.page = 4 # 跳转到结果页
-                st.rerun()
+        else:
+            st.warning("请完成本页所有直觉选择。")
 
 # ================= 结果加载页 =================
-elif st.session_state.page == 4:
-    with st.spinner("正在通过星界连接你的潜意识..."):
-        try:
-            user_profile = "\n".join(list(st.session_state.answers.values()))
-            
-            # --- Prompt 调整：从暗黑转为空灵/智性/治愈 ---
-            prompt = f"""
-            你是一位洞察人心的神秘学导师。根据用户的选择：{user_profile}
-            请输出纯 JSON 数据，不要Markdown标记。必须包含：
-            1. "animal": 动物名 (如：星光雪豹、水晶琉璃鹿、机械智者猫头鹰，名字要带有神性或空灵感)。
-            2. "keywords": [3个短词，体现智性、空灵或力量]。
-            3. "quote": 一句极具诗意与哲理的引言。
-            4. "analysis": 150字侧写。犀利地指出他的孤独与防备，但最终给予肯定和治愈（例如：你的冷漠其实是保护内心的火种）。
-            5. "mask": 社交面具（他如何应对外界）。
-            6. "shadow": 真实本性（他内心的柔软或高傲）。
-            7. "stats": {{"独立性": int, "洞察力": int, "边界感": int, "精神力": int, "共情力": int, "掌控欲": int}} (数值0-100)。
-            8. "image_prompt": 一段用于 FLUX 模型的英文提示词，描述这只动物。风格要求：Ethereal fantasy, majestic, highly detailed, luminous, glowing crystal elements, cinematic lighting, Studio Ghibli meets Tarot card art, masterpiece, 8k.
-            """
-            if missing_text_secret:
-                st.error(f"请在 Streamlit Secrets 中配置 {selected_text_model['secret_name']}")
-                st.stop()
-
-            if selected_text_model["provider"] == "gemini":
-                genai.configure(api_key=st.secrets[selected_text_model["secret_name"]])
-                model = genai.GenerativeModel(selected_text_model["model"])
-                response_text = model.generate_content(prompt).text
-            else:
-                response_text = generate_openai_compatible_chat_text(
-                    selected_text_model["base_url"],
-                    selected_text_model["model"],
-                    st.secrets[selected_text_model["secret_name"]],
-                    prompt,
+else:
+    # 结果按答案组合生成一次，session 里只记结果 ID；侧边栏切换或按钮点击触发的 rerun 从共享结果库重新渲染。
+    # 结果被结果库淘汰时重新走一遍生成，通常直接命中结果缓存
+    artifact = get_artifact_store().get(st.session_state.result_id) if st.session_state.result_id else None
+    spans = None
+    image_future = None
+    if artifact is None and st.session_state.result_error is None:
+        result_key = normalize_answers(st.session_state.answers, theme.questions)
+        # 用户主动点击“重新生成”时绕过共享缓存，新结果会作为该答案组合的一个新变体写回缓存
+        use_cache = not st.session_state.pop("regenerate", False)
+        get_prefetcher().adopt(st.session_state.answers)
+        preview_slot = st.empty()
+        preview_fields = {}
+
+        def on_field(key, value):
+            preview_fields[key] = value
+            render_result_preview(preview_slot, preview_fields)
+
+        spinner_text = theme.copy["spinner"]
+        queue_status = provider_scheduler.queue_status(get_provider_name(selected_text_model))
+        if queue_status["waiting"]:
+            spinner_text += f"（前方排队 {queue_status['waiting']} 人，预计约 {queue_status['eta_seconds']} 秒）"
+        result_source = None
+        generation_error = None
+        with collect_spans() as spans, st.spinner(spinner_text):
+            try:
+                st.session_state.result_id, artifact, st.session_state.result_notice, result_source = generate_result(
+                    result_key,
+                    selected_text_model_id,
+                    use_cache=use_cache,
+                    on_field=on_field if stream_text_output else None,
+                    routing_mode=selected_routing_mode,
+                    prompt_version=session_prompt_version,
                 )
+            except Exception as e:
+                generation_error = e
+                st.session_state.result_error = str(e)
+            else:
+                # 在 span 收集范围内提交图片请求，图片阶段的耗时也归到本次生成
+                if selected_visual_output == "siliconflow_flux":
+                    image_future = submit_result_image(st.session_state.result_id, artifact)
+        preview_slot.empty()
+        export_metrics()
+        outcome, repair_path = classify_generation(result_source, generation_error, spans)
+        track_event(
+            "result",
+            answers=encode_answers_code(result_key, theme.questions),
+            model_id=artifact["text_model_id"] if artifact else selected_text_model_id,
+            prompt_version=artifact["prompt_version"] if artifact else session_prompt_version,
+            source=result_source,
+            outcome=outcome,
+            detail=st.session_state.result_error or repair_path,
+        )
 
-            data = validate_soul_profile(extract_json_payload(response_text))
-            safe_data = escape_profile_for_html(data)
-            
-            # 展示文字框架
-            st.markdown(f"""
-            <div class='result-container'>
-                <h1 style='color: #E5C07B; margin-bottom: 5px;'>{safe_data['animal']}</h1>
-                <p style='font-style: italic; color: #abb2bf; margin-bottom: 20px;'>“{safe_data['quote']}”</p>
-                <div style='margin-bottom: 20px;'>
-                    {' '.join([f'<span class="tag">#{k}</span>' for k in safe_data['keywords']])}
-                </div>
-            """, unsafe_allow_html=True)
-            st.plotly_chart(plot_radar_chart(data['stats']), use_container_width=True)
-
-            # 调用视觉模型或输出视频 prompt
-            if selected_visual_output == "siliconflow_flux" and "SILICONFLOW_API_KEY" in st.secrets and data["image_prompt"]:
-                try:
-                    image_url = generate_siliconflow_image_url(data["image_prompt"], st.secrets["SILICONFLOW_API_KEY"])
-                    st.image(image_url, caption="你的灵魂图腾 (长按保存)", use_container_width=True)
-                    st.markdown("""<style>.stImage > img {border: 2px solid #E5C07B; border-radius: 15px;}</style>""", unsafe_allow_html=True)
-                except RuntimeError as exc:
-                    st.warning(str(exc))
-            elif selected_visual_output == "seedance_prompt":
-                st.text_area("Seedance 视频 Prompt", build_seedance_video_prompt(data), height=150)
-            
-            # 深度分析
-            st.markdown(f"""
-                <p style='text-align: left; line-height: 1.8; color: #d7dae0; margin-top: 25px; font-size: 1.05rem;'>{safe_data['analysis']}</p>
-                <div style='background: rgba(255,255,255,0.03); padding: 20px; border-radius: 12px; margin-top: 20px; text-align: left;'>
-                    <p style='color: #abb2bf;'>🛡️ <b>表象面具：</b> <span style='color: #e6e9f0;'>{safe_data['mask']}</span></p>
-                    <p style='color: #abb2bf;'>✨ <b>真实内核：</b> <span style='color: #e6e9f0;'>{safe_data['shadow']}</span></p>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            
+    if artifact is None:
+        st.error(f"星界连接波动，请重试：{st.session_state.result_error}")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("↻ 重试"):
+                clear_result()
+                st.rerun()
+        with col2:
+            if st.button("返回首页"):
+                st.session_state.page = 1
+                clear_result()
+                st.rerun()
+    else:
+        result_id = st.session_state.result_id
+        if st.session_state.result_notice:
+            st.info(st.session_state.result_notice)
+        if spans is None and selected_visual_output == "siliconflow_flux":
+            image_future = submit_result_image(result_id, artifact)
+        image_slot = render_result(dict(artifact, image_error=st.session_state.image_error), selected_visual_output)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✦ 重新生成"):
+                clear_result()
+                st.session_state.regenerate = True
+                st.rerun()
+        with col2:
             # 重新测试按钮
             if st.button("↻ 重新探索"):
                 st.session_state.page = 1
                 st.session_state.answers = {}
+                clear_result()
                 st.rerun()
 
-        except Exception as e:
-            st.error(f"星界连接波动，请重试：{str(e)}")
-            if st.button("返回首页"):
-                st.session_state.page = 1
-                st.rerun()
+        fill_image_slot(result_id, artifact, image_future, image_slot)
+        show_share_link(result_id, get_artifact_store().get(result_id) or artifact)
+
+    # 耗时分解只在本次 rerun 真正生成时展示，span 列表不留在 session 里
+    if show_timing_breakdown and spans:
+        render_timing_breakdown(spans)
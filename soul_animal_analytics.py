@@ -0,0 +1,297 @@
+import argparse
+import atexit
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from soul_animal_helpers import ProfileValidationError
+from soul_animal_sessions import encode_answers
+
+ANALYTICS_DB = "analytics_events.sqlite3"
+# 内存队列上限：写入跟不上时丢弃新事件（计入 dropped），不阻塞页面
+ANALYTICS_QUEUE_SIZE = 10_000
+ANALYTICS_BATCH_SIZE = 200
+# 攒批的最长等待时间，流量很小时事件最多延迟这么久落盘
+ANALYTICS_FLUSH_INTERVAL_SECONDS = 2.0
+ANALYTICS_CLOSE_TIMEOUT_SECONDS = 5.0
+ANALYTICS_DETAIL_MAX_CHARS = 200
+# page_view：进入第 page 页（结果页为题目页数 + 1）；share_view：打开分享链接（outcome 为 ok / expired）；
+# result：结果页的生成结果（outcome 为 ok / validation_failed / error）；image：图片生成结果（ok / timeout / failed / circuit_open）
+ANALYTICS_EVENTS = ("page_view", "share_view", "result", "image")
+ANALYTICS_FIELDS = ("session_id", "theme", "page", "answers", "model_id", "prompt_version", "source", "outcome", "detail")
+
+_STOP = object()
+
+
+def encode_answers_code(answers, questions):
+    # 答案组合记成选项下标串，如 "01201"，243 种组合各对应一个短字符串
+    return "".join(str(index) for index in encode_answers(answers, questions))
+
+
+def classify_generation(source, error, spans=()):
+    # 结果看生成调用的返回值：有 source 就是成功，失败时按异常类型区分校验失败。
+    # 缓存命中和请求合并的跟随者都没有 parse span，span 只用来补充本次真正解析时的修复路径
+    if source is None:
+        return ("validation_failed" if isinstance(error, ProfileValidationError) else "error"), None
+    repair_paths = [item.attributes.get("repair_path") for item in spans if item.stage == "parse" and item.status == "ok"]
+    return "ok", repair_paths[-1] if repair_paths else None
+
+
+def connect_analytics_db(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_events (
+            ts REAL NOT NULL,
+            event TEXT NOT NULL,
+            session_id TEXT,
+            theme TEXT,
+            page INTEGER,
+            answers TEXT,
+            model_id TEXT,
+            prompt_version TEXT,
+            source TEXT,
+            outcome TEXT,
+            detail TEXT
+        )
+        """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS analytics_events_event ON analytics_events (event, answers)")
+    connection.commit()
+    return connection
+
+
+# 非阻塞事件日志：页面只把事件放进有界内存队列，后台线程攒批写入 SQLite。
+# 队列满时丢弃新事件并计数；进程退出时把队列里剩下的事件写完。
+class AnalyticsLog:
+    def __init__(
+        self,
+        path=ANALYTICS_DB,
+        queue_size=ANALYTICS_QUEUE_SIZE,
+        batch_size=ANALYTICS_BATCH_SIZE,
+        flush_interval_seconds=ANALYTICS_FLUSH_INTERVAL_SECONDS,
+        clock=time.time,
+    ):
+        if queue_size <= 0 or batch_size <= 0:
+            raise ValueError("事件队列容量和批大小必须大于 0。")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counts = {"enqueued": 0, "written": 0, "dropped": 0, "write_errors": 0}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._connection = connect_analytics_db(path)
+        self._thread = threading.Thread(target=self._run, name="soul-analytics", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def record(self, event, **fields):
+        if event not in ANALYTICS_EVENTS:
+            raise ValueError(f"未知事件类型：{event}")
+        unknown_fields = sorted(set(fields) - set(ANALYTICS_FIELDS))
+        if unknown_fields:
+            raise ValueError(f"未知事件字段：{', '.join(unknown_fields)}")
+        if isinstance(fields.get("detail"), str):
+            fields["detail"] = fields["detail"][:ANALYTICS_DETAIL_MAX_CHARS]
+        row = (self._clock(), event) + tuple(fields.get(name) for name in ANALYTICS_FIELDS)
+        if self._closed:
+            self._count("dropped")
+            return False
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _write(self, batch):
+        try:
+            self._connection.executemany(
+                f"INSERT INTO analytics_events (ts, event, {', '.join(ANALYTICS_FIELDS)}) VALUES ({', '.join('?' * (len(ANALYTICS_FIELDS) + 2))})",
+                batch,
+            )
+            self._connection.commit()
+        except sqlite3.Error:
+            self._count("write_errors", len(batch))
+        else:
+            self._count("written", len(batch))
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval_seconds
+                if len(batch) < self.batch_size:
+                    continue
+            # 批次满、等待超时、flush 或退出：写出当前批次
+            if batch:
+                self._write(batch)
+                batch = []
+            deadline = None
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def flush(self, timeout=ANALYTICS_CLOSE_TIMEOUT_SECONDS):
+        # 等待队列里已有的事件写完；只给测试和离线脚本用，页面不调用
+        if self._closed:
+            return False
+        marker = threading.Event()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.wait(timeout)
+
+    def close(self, timeout=ANALYTICS_CLOSE_TIMEOUT_SECONDS):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._connection.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, queued=self._queue.qsize())
+
+
+# --- 离线聚合查询：只读打开事件库，不经过页面的写入队列 ---
+def open_analytics_reader(path=ANALYTICS_DB):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def query_funnel(path=ANALYTICS_DB, theme=None):
+    # 每页至少进入过一次的 session 数，以及相对第 1 页的转化率
+    with open_analytics_reader(path) as connection:
+        rows = connection.execute(
+            """
+            SELECT page, COUNT(DISTINCT session_id) FROM analytics_events
+            WHERE event = 'page_view' AND (? IS NULL OR theme = ?)
+            GROUP BY page ORDER BY page
+            """,
+            (theme, theme),
+        ).fetchall()
+    first_page_sessions = rows[0][1] if rows and rows[0][0] == 1 else None
+    return [
+        {
+            "page": page,
+            "sessions": sessions,
+            "conversion": round(sessions / first_page_sessions, 3) if first_page_sessions else None,
+        }
+        for page, sessions in rows
+    ]
+
+
+def query_answer_distribution(path=ANALYTICS_DB, theme=None, limit=None):
+    # 成功生成的结果按答案组合计数，按次数从多到少
+    with open_analytics_reader(path) as connection:
+        rows = connection.execute(
+            """
+            SELECT answers, COUNT(*) AS results FROM analytics_events
+            WHERE event = 'result' AND outcome = 'ok' AND (? IS NULL OR theme = ?)
+            GROUP BY answers ORDER BY results DESC, answers LIMIT ?
+            """,
+            (theme, theme, -1 if limit is None else limit),
+        ).fetchall()
+    return [{"answers": answers, "results": results} for answers, results in rows]
+
+
+def query_model_usage(path=ANALYTICS_DB):
+    # 每个实际返回结果的模型：请求数和各结果的次数
+    with open_analytics_reader(path) as connection:
+        rows = connection.execute(
+            """
+            SELECT model_id, outcome, COUNT(*) FROM analytics_events
+            WHERE event = 'result' GROUP BY model_id, outcome ORDER BY model_id, outcome
+            """
+        ).fetchall()
+    usage = {}
+    for model_id, outcome, count in rows:
+        entry = usage.setdefault(model_id, {"requests": 0})
+        entry["requests"] += count
+        entry[outcome] = count
+    return usage
+
+
+def query_failing_answers(path=ANALYTICS_DB, outcome="validation_failed", limit=10):
+    # 指定失败类型最多的答案组合，以及该组合的失败率
+    with open_analytics_reader(path) as connection:
+        rows = connection.execute(
+            """
+            SELECT answers, SUM(outcome = ?) AS failures, COUNT(*) AS requests FROM analytics_events
+            WHERE event = 'result' GROUP BY answers HAVING failures > 0
+            ORDER BY failures DESC, answers LIMIT ?
+            """,
+            (outcome, limit),
+        ).fetchall()
+    return [
+        {"answers": answers, "failures": failures, "requests": requests, "failure_rate": round(failures / requests, 3)}
+        for answers, failures, requests in rows
+    ]
+
+
+def query_image_outcomes(path=ANALYTICS_DB):
+    with open_analytics_reader(path) as connection:
+        rows = connection.execute(
+            "SELECT outcome, COUNT(*) FROM analytics_events WHERE event = 'image' GROUP BY outcome ORDER BY outcome"
+        ).fetchall()
+    outcomes = dict(rows)
+    requests = sum(outcomes.values())
+    failures = requests - outcomes.get("ok", 0)
+    return {"requests": requests, "outcomes": outcomes, "failure_rate": round(failures / requests, 3) if requests else None}
+
+
+def build_analytics_report(path=ANALYTICS_DB, limit=10):
+    return {
+        "funnel": query_funnel(path),
+        "top_answers": query_answer_distribution(path, limit=limit),
+        "models": query_model_usage(path),
+        "validation_failures": query_failing_answers(path, "validation_failed", limit),
+        "images": query_image_outcomes(path),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="汇总答题漏斗、答案分布、模型使用和失败情况，输出 JSON 报告。")
+    parser.add_argument("--db", default=ANALYTICS_DB, help="事件库路径")
+    parser.add_argument("--limit", type=int, default=10, help="答案组合排行的条数")
+    parser.add_argument("--output", default=None, help="报告写入的 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    encoded = json.dumps(build_analytics_report(args.db, args.limit), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(encoded + "\n")
+    else:
+        print(encoded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import argparse
+import json
+import math
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from soul_animal_cache import ResultCache
+from soul_animal_fake_provider import FakeProviderServer
+from soul_animal_helpers import TEXT_MODEL_OPTIONS, configure_http_session
+from soul_animal_images import ImageStore
+from soul_animal_metrics import get_metrics_registry
+from soul_animal_prompts import get_prompt_stats
+from soul_animal_precompute import iter_answer_combinations
+from soul_animal_scheduler import PROVIDER_RATE_LIMITS, configure_provider_scheduler
+from soul_animal_service import VISUAL_OUTPUT_MODES, SoulResultService
+from soul_animal_themes import get_theme_pack
+
+DEFAULT_SESSIONS = 200
+DEFAULT_CONCURRENCY = 32
+# 假 provider 只实现 OpenAI 兼容协议，默认压测模型不能是 Gemini
+BENCH_TEXT_MODEL_ID = "openai_gpt_5_4_mini"
+BENCH_SECRETS = {"OPENAI_API_KEY": "bench", "XAI_API_KEY": "bench", "SILICONFLOW_API_KEY": "bench"}
+
+
+def percentile(values, fraction):
+    # 最近秩法：样本很少时也只返回真实出现过的值
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize_latencies(latencies):
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(latencies, 0.50), 4),
+        "p95": round(percentile(latencies, 0.95), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+        "mean": round(sum(latencies) / len(latencies), 4),
+        "max": round(max(latencies), 4),
+    }
+
+
+def build_bench_service(server, text_model_id, image_dir, cache_ttl_seconds=None):
+    text_model = dict(TEXT_MODEL_OPTIONS[text_model_id], base_url=server.base_url)
+    cache = ResultCache() if cache_ttl_seconds is None else ResultCache(ttl_seconds=cache_ttl_seconds)
+    return SoulResultService(
+        BENCH_SECRETS,
+        result_cache=cache,
+        image_store=ImageStore(image_dir),
+        text_models={text_model_id: text_model},
+        image_endpoint=f"{server.base_url}/images/generations",
+    )
+
+
+# 模拟 sessions 个用户并发答题：每个 session 选一组答案（从前 distinct_answers 种组合中随机取，用来控制缓存命中率），
+# 完整走一遍 SoulResultService.generate，记录端到端耗时。返回可直接写成 JSON 的报告。
+def run_bench(
+    server,
+    sessions=DEFAULT_SESSIONS,
+    concurrency=DEFAULT_CONCURRENCY,
+    text_model_id=BENCH_TEXT_MODEL_ID,
+    visual_mode="siliconflow_flux",
+    distinct_answers=243,
+    use_cache=True,
+    image_dir=None,
+    seed=None,
+    prompt_version=None,
+):
+    if visual_mode not in VISUAL_OUTPUT_MODES:
+        raise ValueError(f"未知视觉输出：{visual_mode}")
+    if sessions <= 0 or concurrency <= 0:
+        raise ValueError("sessions 和 concurrency 必须大于 0。")
+
+    rng = random.Random(seed)
+    combinations = [list(answers) for answers in iter_answer_combinations()][:max(1, distinct_answers)]
+    session_answers = [rng.choice(combinations) for _ in range(sessions)]
+
+    temporary_directory = None
+    if image_dir is None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        image_dir = temporary_directory.name
+    service = build_bench_service(server, text_model_id, image_dir)
+
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def run_session(answers):
+        started_at = time.perf_counter()
+        try:
+            result = service.generate(answers, text_model_id, visual_mode, use_cache=use_cache, prompt_version=prompt_version)
+            error = result["image_error"]
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        elapsed = time.perf_counter() - started_at
+        with lock:
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+            else:
+                latencies.append(elapsed)
+
+    get_metrics_registry().reset()
+    get_prompt_stats().reset()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="soul-bench") as executor:
+            list(executor.map(run_session, session_answers))
+        duration = time.perf_counter() - started_at
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+
+    return {
+        "config": {
+            "sessions": sessions,
+            "concurrency": concurrency,
+            "text_model_id": text_model_id,
+            "visual_mode": visual_mode,
+            "distinct_answers": len(combinations),
+            "use_cache": use_cache,
+            "prompt_version": prompt_version,
+            "latency": server.latency,
+            "error_rate": server.error_rate,
+            "rate_limit_rpm": server.rate_limit_rpm,
+        },
+        "duration_seconds": round(duration, 4),
+        "throughput_per_second": round(sessions / duration, 2) if duration > 0 else None,
+        "succeeded": len(latencies),
+        "failed": sum(errors.values()),
+        "errors": errors,
+        "latency_seconds": summarize_latencies(latencies),
+        "provider_calls": server.call_counts(),
+        "stages": get_metrics_registry().summary(),
+        "prompts": get_prompt_stats().summary(),
+        "result_cache": {"hits": service.result_cache.hits, "misses": service.result_cache.misses},
+        "memory": {"tracemalloc_peak_bytes": peak_bytes, "max_rss_bytes": get_max_rss_bytes()},
+    }
+
+
+def get_max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux 下 ru_maxrss 单位是 KB，macOS 下是字节
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def build_latency_distribution(args):
+    if args.latency == "fixed":
+        return {"kind": "fixed", "seconds": args.latency_median}
+    if args.latency == "uniform":
+        return {"kind": "uniform", "low": args.latency_median / 2, "high": args.latency_median * 1.5}
+    return {"kind": "lognormal", "median": args.latency_median, "sigma": args.latency_sigma}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用本地假 provider 压测灵魂图腾生成链路，输出 JSON 报告。")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS, help="模拟的答题 session 数")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时进行的 session 数")
+    parser.add_argument("--model", default=BENCH_TEXT_MODEL_ID, choices=[model_id for model_id, option in TEXT_MODEL_OPTIONS.items() if option["provider"] == "openai_compatible"])
+    parser.add_argument("--visual", default="siliconflow_flux", choices=VISUAL_OUTPUT_MODES)
+    parser.add_argument("--distinct-answers", type=int, default=243, help="参与抽样的答案组合数，越小缓存命中越多")
+    parser.add_argument("--no-cache", action="store_true", help="跳过结果缓存，每个 session 都调用 provider")
+    parser.add_argument("--latency", default="lognormal", choices=["fixed", "uniform", "lognormal"], help="假 provider 的延迟分布")
+    parser.add_argument("--latency-median", type=float, default=0.5, help="延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 分布的离散度")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假 provider 随机返回 500 的比例")
+    parser.add_argument("--provider-rpm", type=int, default=None, help="假 provider 每分钟放行的请求数，超出返回 429")
+    parser.add_argument("--client-rpm", type=int, default=None, help="本地准入控制对假 provider 的每分钟请求上限")
+    parser.add_argument("--prompt-version", default=None, choices=get_theme_pack().prompt_versions, help="固定使用的 Prompt 版本，默认按 A/B 权重分流")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="报告写入的 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    server = FakeProviderServer(
+        latency=build_latency_distribution(args),
+        error_rate=args.error_rate,
+        rate_limit_rpm=args.provider_rpm,
+        seed=args.seed,
+    ).start()
+    # 连接池要容得下全部并发 session；假 provider 的主机名不在默认限速表里，按 --client-rpm 单独配置
+    configure_http_session(pool_maxsize=max(args.concurrency, 1))
+    limits = dict(PROVIDER_RATE_LIMITS)
+    if args.client_rpm:
+        limits["127.0.0.1"] = {"rpm": args.client_rpm, "tpm": None}
+    configure_provider_scheduler(limits=limits, max_in_flight=max(args.concurrency, 1))
+    try:
+        report = run_bench(
+            server,
+            sessions=args.sessions,
+            concurrency=args.concurrency,
+            text_model_id=args.model,
+            visual_mode=args.visual,
+            distinct_answers=args.distinct_answers,
+            use_cache=not args.no_cache,
+            seed=args.seed,
+            prompt_version=args.prompt_version,
+        )
+    finally:
+        server.stop()
+
+    encoded = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(encoded + "\n")
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
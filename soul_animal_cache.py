@@ -0,0 +1,141 @@
+import copy
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from soul_animal_helpers import SOUL_PROMPT_VERSION
+
+RESULT_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESULT_CACHE_MAX_KEYS = 512
+RESULT_CACHE_VARIETY = 1
+
+
+def build_result_cache_key(answers_key, text_model_id, prompt_version=SOUL_PROMPT_VERSION):
+    return (tuple(answers_key), text_model_id, prompt_version)
+
+
+# 进程级的侧写结果缓存，按 (答案组合, 文本模型, prompt 版本) 存放 validate_soul_profile 的输出。
+# 每个 key 最多保留 variety 个变体：凑满之前 get 返回 None 让调用方生成新变体，凑满之后随机返回其中一个。
+# 变体按 TTL 过期，key 数量超过 max_keys 时淘汰最久未使用的 key。
+class ResultCache:
+    def __init__(
+        self,
+        ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+        max_keys=RESULT_CACHE_MAX_KEYS,
+        variety=RESULT_CACHE_VARIETY,
+        clock=time.monotonic,
+        rng=None,
+    ):
+        if ttl_seconds <= 0 or max_keys <= 0 or variety <= 0:
+            raise ValueError("缓存的 TTL、容量和变体数量必须大于 0。")
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.variety = variety
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _live_variants(self, key, now):
+        variants = [(expires_at, profile) for expires_at, profile in self._entries.get(key, []) if expires_at > now]
+        if variants:
+            self._entries[key] = variants
+        else:
+            self._entries.pop(key, None)
+        return variants
+
+    def get(self, key):
+        with self._lock:
+            # 只读不剔除：过期变体留到下次 put 或按容量淘汰，provider 过载时 peek 还能拿它降级
+            now = self._clock()
+            variants = [(expires_at, profile) for expires_at, profile in self._entries.get(key, []) if expires_at > now]
+            if len(variants) < self.variety:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, profile = self._rng.choice(variants)
+        return copy.deepcopy(profile)
+
+    def peek(self, key):
+        # 降级用：不看 variety，也不剔除过期变体，只要还留在缓存里就返回
+        with self._lock:
+            variants = self._entries.get(key)
+            if not variants:
+                return None
+            _, profile = self._rng.choice(variants)
+        return copy.deepcopy(profile)
+
+    def put(self, key, profile):
+        with self._lock:
+            now = self._clock()
+            variants = self._live_variants(key, now)
+            variants.append((now + self.ttl_seconds, copy.deepcopy(profile)))
+            self._entries[key] = variants[-self.variety:]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SINGLE_FLIGHT_INTERRUPTED_MESSAGE = "合并的请求在执行中被中断，请稍后重试。"
+
+
+class InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+# 合并相同 key 的并发请求：第一个调用方真正执行，其余调用方等待并拿到同一份结果。
+# 异常同样传给所有等待者，但不会被记住，下一次调用会重新执行。
+# 执行方被 KeyboardInterrupt、页面重跑等非 Exception 打断时，等待者收到 RuntimeError，不会拿到空结果。
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = InFlightCall()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.value)
+
+        try:
+            call.value = function()
+        except Exception as exc:
+            call.error = exc
+            raise
+        except BaseException:
+            call.error = RuntimeError(SINGLE_FLIGHT_INTERRUPTED_MESSAGE)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+
+RESULT_FLIGHTS = SingleFlight()
@@ -0,0 +1,168 @@
+import functools
+import html
+import math
+
+# 雷达图渲染方式：svg 在服务端直接生成内联 SVG，不需要下发 Plotly 的前端脚本；plotly 保留原来的交互图表
+RADAR_RENDERERS = ("svg", "plotly")
+DEFAULT_RADAR_RENDERER = "svg"
+RADAR_RANGE = (0, 100)
+RADAR_SVG_WIDTH = 400
+RADAR_CACHE_SIZE = 1024
+
+# 两个页面原有 Plotly 雷达图的配色和布局，SVG 和 Plotly 两种渲染共用同一份参数
+RADAR_STYLES = {
+    "ethereal": {
+        "fill": "rgba(229, 192, 123, 0.2)",
+        "line": "#E5C07B",
+        "font_color": "#abb2bf",
+        "font_size": 14,
+        "font_family": None,
+        "grid": "rgba(171, 178, 191, 0.25)",
+        "radial_axis": False,
+        "radial_axis_color": None,
+        "margin": {"l": 30, "r": 30, "t": 20, "b": 20},
+        "height": 280,
+    },
+    "dark": {
+        "fill": "rgba(212, 175, 55, 0.3)",
+        "line": "#D4AF37",
+        "font_color": "#e0e0e0",
+        "font_size": 12,
+        "font_family": "serif",
+        "grid": "rgba(224, 224, 224, 0.2)",
+        "radial_axis": True,
+        "radial_axis_color": "#444",
+        "margin": {"l": 40, "r": 40, "t": 20, "b": 20},
+        "height": 300,
+    },
+}
+
+
+def get_radar_style(style):
+    radar_style = RADAR_STYLES.get(style)
+    if radar_style is None:
+        raise ValueError(f"未知雷达图样式：{style}")
+    return radar_style
+
+
+def format_number(value):
+    # 坐标保留一位小数并去掉多余的 0，SVG 文本更短
+    text = f"{value:.1f}"
+    return text[:-2] if text.endswith(".0") else text
+
+
+def clamp_radar_value(value):
+    low, high = RADAR_RANGE
+    return max(low, min(high, float(value)))
+
+
+def radar_point(center_x, center_y, radius, index, count):
+    # 和 Plotly 极坐标的默认方向一致：第一个维度在正右方，逆时针排列
+    angle = 2 * math.pi * index / count
+    return center_x + radius * math.cos(angle), center_y - radius * math.sin(angle)
+
+
+def format_points(points):
+    return " ".join(f"{format_number(x)},{format_number(y)}" for x, y in points)
+
+
+@functools.lru_cache(maxsize=RADAR_CACHE_SIZE)
+def _render_radar_svg(items, style):
+    radar_style = get_radar_style(style)
+    margin = radar_style["margin"]
+    width, height = RADAR_SVG_WIDTH, radar_style["height"]
+    plot_width = width - margin["l"] - margin["r"]
+    plot_height = height - margin["t"] - margin["b"]
+    center_x = margin["l"] + plot_width / 2
+    center_y = margin["t"] + plot_height / 2
+    radius = min(plot_width, plot_height) / 2
+    count = len(items)
+    low, high = RADAR_RANGE
+
+    font_family = f" font-family='{radar_style['font_family']}'" if radar_style["font_family"] else ""
+    parts = [
+        f"<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 {width} {height}' width='100%' style='max-width:{width}px;display:block;margin:0 auto;'"
+        f" font-size='{radar_style['font_size']}' fill='{radar_style['font_color']}'{font_family} role='img'>"
+    ]
+
+    # 角向网格：外圈 + 每个维度一条辐条；显示径向轴时再加 20 一格的同心圆和刻度
+    grid = radar_style["grid"]
+    outer = [radar_point(center_x, center_y, radius, index, count) for index in range(count)]
+    parts.append(f"<circle cx='{format_number(center_x)}' cy='{format_number(center_y)}' r='{format_number(radius)}' fill='none' stroke='{grid}'/>")
+    spokes = "".join(f"M{format_number(center_x)} {format_number(center_y)}L{format_number(x)} {format_number(y)}" for x, y in outer)
+    parts.append(f"<path d='{spokes}' stroke='{grid}' fill='none'/>")
+    if radar_style["radial_axis"]:
+        axis_color = radar_style["radial_axis_color"]
+        for tick in range(low + 20, high, 20):
+            tick_radius = radius * (tick - low) / (high - low)
+            parts.append(f"<circle cx='{format_number(center_x)}' cy='{format_number(center_y)}' r='{format_number(tick_radius)}' fill='none' stroke='{axis_color}'/>")
+        parts.append(f"<path d='M{format_number(center_x)} {format_number(center_y)}H{format_number(center_x + radius)}' stroke='{axis_color}'/>")
+        for tick in range(low, high + 1, 20):
+            tick_x = center_x + radius * (tick - low) / (high - low)
+            parts.append(f"<text x='{format_number(tick_x)}' y='{format_number(center_y + 12)}' text-anchor='middle' font-size='10' fill='{axis_color}'>{tick}</text>")
+
+    points = [
+        radar_point(center_x, center_y, radius * (clamp_radar_value(value) - low) / (high - low), index, count)
+        for index, (_, value) in enumerate(items)
+    ]
+    parts.append(
+        f"<polygon points='{format_points(points)}' fill='{radar_style['fill']}' stroke='{radar_style['line']}' stroke-width='2' stroke-linejoin='round'/>"
+    )
+    parts.extend(f"<circle cx='{format_number(x)}' cy='{format_number(y)}' r='2' fill='{radar_style['line']}'/>" for x, y in points)
+
+    # 维度名放在外圈外侧，按所在方位决定对齐方式
+    for index, (label, _) in enumerate(items):
+        x, y = radar_point(center_x, center_y, radius + 8, index, count)
+        cosine = math.cos(2 * math.pi * index / count)
+        sine = math.sin(2 * math.pi * index / count)
+        anchor = "start" if cosine > 0.1 else "end" if cosine < -0.1 else "middle"
+        baseline = "0" if sine > 0.1 else "0.7em" if sine < -0.1 else "0.35em"
+        parts.append(f"<text x='{format_number(x)}' y='{format_number(y)}' dy='{baseline}' text-anchor='{anchor}'>{html.escape(str(label), quote=True)}</text>")
+    parts.append("</svg>")
+    # 不能有换行：st.markdown 会把缩进的 HTML 当成代码块
+    return "".join(parts)
+
+
+def render_radar_svg(stats, style="ethereal"):
+    # 按 (维度, 数值) 元组记忆化：同一组 stats 在每次 rerun 时直接复用已经生成的 SVG
+    if not stats:
+        return ""
+    get_radar_style(style)
+    return _render_radar_svg(tuple(stats.items()), style)
+
+
+def build_radar_figure(stats, style="ethereal"):
+    # plotly 只有选择 Plotly 渲染时才用到，延迟到这里导入
+    import plotly.graph_objects as go
+
+    radar_style = get_radar_style(style)
+    categories = list(stats.keys())
+    values = list(stats.values())
+    categories += [categories[0]]
+    values += [values[0]]
+    fig = go.Figure()
+    fig.add_trace(go.Scatterpolar(
+        r=values, theta=categories, fill='toself',
+        fillcolor=radar_style["fill"], line=dict(color=radar_style["line"], width=2), marker=dict(size=4)
+    ))
+    radial_axis = dict(visible=radar_style["radial_axis"], range=list(RADAR_RANGE))
+    if radar_style["radial_axis_color"]:
+        radial_axis["color"] = radar_style["radial_axis_color"]
+    font = dict(color=radar_style["font_color"], size=radar_style["font_size"])
+    if radar_style["font_family"]:
+        font["family"] = radar_style["font_family"]
+    fig.update_layout(
+        polar=dict(radialaxis=radial_axis, bgcolor='rgba(0,0,0,0)'),
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        font=font, margin=dict(**radar_style["margin"]), height=radar_style["height"]
+    )
+    return fig
+
+
+def render_radar_chart(stats, renderer=DEFAULT_RADAR_RENDERER, style="ethereal"):
+    # svg 返回 HTML 字符串，交给 st.markdown；plotly 返回 Figure，交给 st.plotly_chart
+    if renderer == "svg":
+        return render_radar_svg(stats, style)
+    if renderer == "plotly":
+        return build_radar_figure(stats, style)
+    raise ValueError(f"未知雷达图渲染方式：{renderer}")
@@ -0,0 +1,190 @@
+import io
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_SOUL_PROFILE = {
+    "animal": "星光雪豹",
+    "keywords": ["洞察", "边界", "柔软"],
+    "quote": "在黑夜里保持清醒。",
+    "analysis": "你看似冷静，其实是在保护内心的火种。",
+    "mask": "礼貌而疏离",
+    "shadow": "高傲也柔软",
+    "stats": {"独立性": 90, "洞察力": 88, "边界感": 95, "精神力": 80, "共情力": 62, "掌控欲": 70},
+    "image_prompt": "A luminous snow leopard",
+}
+
+
+def build_fake_png_bytes(size=64):
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.new("RGB", (size, size), (229, 192, 123)).save(output, format="PNG")
+    return output.getvalue()
+
+
+# 延迟分布：fixed 固定值；uniform 在 [low, high] 间均匀分布；lognormal 以 median 为中位数、sigma 为离散度，模拟长尾
+def sample_latency_seconds(distribution, rng):
+    kind = distribution.get("kind", "fixed")
+    if kind == "fixed":
+        return distribution.get("seconds", 0.0)
+    if kind == "uniform":
+        return rng.uniform(distribution["low"], distribution["high"])
+    if kind == "lognormal":
+        return distribution["median"] * rng.lognormvariate(0.0, distribution.get("sigma", 0.5))
+    raise ValueError(f"未知延迟分布：{kind}")
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, body):
+        self._send(status, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        status = self.server.admit(self.path)
+        if status == 429:
+            self._send_json(429, {"error": "rate limited"})
+            self.server.record(self.path, 429)
+            return
+        time.sleep(self.server.sample_latency())
+        if status != 200:
+            self._send_json(status, {"error": "injected failure"})
+            self.server.record(self.path, status)
+            return
+
+        if self.path.endswith("/chat/completions"):
+            # 不同答案组合得到不同的 image_prompt，图片库和图片请求合并才会承受真实的负载
+            prompt = "".join(message.get("content", "") for message in payload.get("messages", []))
+            profile = dict(self.server.profile, image_prompt=f"{self.server.profile['image_prompt']}, variant {zlib.crc32(prompt.encode('utf-8')):08x}")
+            content = json.dumps(profile, ensure_ascii=False)
+            # 用字符数近似 token 数，足以对比不同 Prompt 版本的相对大小
+            usage = {"prompt_tokens": len(prompt), "completion_tokens": len(content), "total_tokens": len(prompt) + len(content)}
+            if payload.get("stream"):
+                self._send_chat_stream(content, usage if (payload.get("stream_options") or {}).get("include_usage") else None)
+            else:
+                message = {"message": {"content": content}, "finish_reason": "stop"}
+                self._send_json(200, {"choices": [message], "usage": usage})
+        elif self.path.endswith("/images/generations"):
+            image_id = self.server.next_image_id()
+            self._send_json(200, {"images": [{"url": f"http://{self.server.public_host}/images/{image_id}.png"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+            status = 404
+        self.server.record(self.path, status)
+
+    def _send_chat_stream(self, content, usage=None):
+        chunk_size = max(1, len(content) // 8)
+        events = []
+        for start in range(0, len(content), chunk_size):
+            delta = {"choices": [{"delta": {"content": content[start:start + chunk_size]}}]}
+            events.append(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+        if usage is not None:
+            events.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+        events.append("data: [DONE]\n\n")
+        self._send(200, "".join(events).encode("utf-8"), content_type="text/event-stream; charset=utf-8")
+
+    def do_GET(self):
+        if self.path.startswith("/images/"):
+            self._send(200, self.server.image_bytes, content_type="image/png")
+            self.server.record("/images", 200)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 本地假 provider：实现 OpenAI 兼容 /chat/completions（含 SSE 流式）和 SiliconFlow /images/generations，
+# 图片链接指回自身的 /images/<id>.png。可以配置延迟分布、随机错误率、按分钟的 429 限流，以及接下来若干次必定失败。
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=None,
+        error_rate=0.0,
+        rate_limit_rpm=None,
+        profile=None,
+        seed=None,
+    ):
+        super().__init__((host, port), FakeProviderHandler)
+        self.latency = latency or {"kind": "fixed", "seconds": 0.0}
+        self.error_rate = error_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self.profile = profile or FAKE_SOUL_PROFILE
+        self.image_bytes = build_fake_png_bytes()
+        self.public_host = f"{host}:{self.server_port}"
+        self.fail_next = 0
+        self.calls = []
+        self.status_counts = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_started_at = time.monotonic()
+        self._window_count = 0
+        self._image_id = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.public_host}/v1"
+
+    def sample_latency(self):
+        with self._lock:
+            return sample_latency_seconds(self.latency, self._rng)
+
+    def admit(self, path):
+        with self._lock:
+            if self.rate_limit_rpm is not None:
+                now = time.monotonic()
+                if now - self._window_started_at >= 60:
+                    self._window_started_at = now
+                    self._window_count = 0
+                self._window_count += 1
+                if self._window_count > self.rate_limit_rpm:
+                    return 429
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return 503
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return 500
+            return 200
+
+    def record(self, path, status):
+        with self._lock:
+            self.calls.append(path)
+            self.status_counts[(path, status)] += 1
+
+    def next_image_id(self):
+        with self._lock:
+            self._image_id += 1
+            return self._image_id
+
+    def call_counts(self):
+        with self._lock:
+            return {f"{path} {status}": count for (path, status), count in sorted(self.status_counts.items())}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,199 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from soul_animal_scheduler import ProviderOverloadedError
+
+# 每个 provider/模型保留最近的调用样本，超时和错误率都按这个滚动窗口计算
+HEALTH_WINDOW_SIZE = 200
+# 成功样本不足时仍使用固定超时；够了以后取成功耗时的高分位乘以余量，且不超过固定超时
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20
+ADAPTIVE_TIMEOUT_PERCENTILE = 0.99
+ADAPTIVE_TIMEOUT_MULTIPLIER = 1.5
+ADAPTIVE_TIMEOUT_FLOOR_SECONDS = 5.0
+# 熔断：连续失败达到阈值后打开，打开期间的请求直接失败；冷却结束后半开，只放行一个探测请求
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_OPEN_SECONDS = 30.0
+# 这些 4xx 之外的客户端错误说明请求本身有问题，不算 provider 不健康
+PROVIDER_FAILURE_CLIENT_STATUS_CODES = (408, 429)
+
+
+class CircuitOpenError(ProviderOverloadedError):
+    pass
+
+
+def get_error_status_code(exc):
+    # requests 的 HTTPError 带 response.status_code，google.api_core 的异常带 code
+    response = getattr(exc, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code is None:
+        status_code = getattr(exc, "code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_provider_failure(exc):
+    status_code = get_error_status_code(exc)
+    if status_code is not None and 400 <= status_code < 500:
+        return status_code in PROVIDER_FAILURE_CLIENT_STATUS_CODES
+    return True
+
+
+def nearest_rank_percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class ProviderHealth:
+    def __init__(self, window_size):
+        self.latencies = deque(maxlen=window_size)
+        self.outcomes = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = None
+        self.probe_started_at = None
+        self.trips = 0
+        self.default_timeout = None
+
+
+# 进程级 provider 健康状态：按 (provider, 模型) 记录滚动耗时和成败，据此给出自适应超时，并在连续失败时熔断。
+# 熔断打开时 admit 直接抛出 CircuitOpenError（ProviderOverloadedError 的子类），调用方沿用过载时的回退路径。
+class ProviderHealthRegistry:
+    def __init__(
+        self,
+        window_size=HEALTH_WINDOW_SIZE,
+        min_samples=ADAPTIVE_TIMEOUT_MIN_SAMPLES,
+        percentile=ADAPTIVE_TIMEOUT_PERCENTILE,
+        multiplier=ADAPTIVE_TIMEOUT_MULTIPLIER,
+        floor_seconds=ADAPTIVE_TIMEOUT_FLOOR_SECONDS,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        open_seconds=BREAKER_OPEN_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor_seconds = floor_seconds
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, provider, model):
+        entry = self._entries.get((provider, model))
+        if entry is None:
+            entry = ProviderHealth(self.window_size)
+            self._entries[(provider, model)] = entry
+        return entry
+
+    def _refresh(self, entry):
+        if entry.state == "open" and self._clock() - entry.opened_at >= self.open_seconds:
+            entry.state = "half_open"
+            entry.probe_started_at = None
+
+    def _probe_in_flight(self, entry):
+        # 探测请求被提前放弃（例如流式生成中途关闭）时不会有结果，超过冷却时间后允许下一个探测
+        return entry.probe_started_at is not None and self._clock() - entry.probe_started_at < self.open_seconds
+
+    def _adaptive_timeout(self, entry, default_timeout):
+        if entry.state != "closed" or len(entry.latencies) < self.min_samples:
+            return default_timeout
+        timeout = nearest_rank_percentile(entry.latencies, self.percentile) * self.multiplier
+        return round(min(default_timeout, max(self.floor_seconds, timeout)), 3)
+
+    def admit(self, provider, model, default_timeout):
+        # 返回本次请求的超时；熔断打开或半开探测已在进行时直接拒绝，不再排队等待
+        with self._lock:
+            entry = self._entry(provider, model)
+            entry.default_timeout = default_timeout
+            self._refresh(entry)
+            if entry.state == "open" or (entry.state == "half_open" and self._probe_in_flight(entry)):
+                raise CircuitOpenError(f"{provider} 暂时不可用（熔断中），请稍后重试。")
+            if entry.state == "half_open":
+                # 探测请求用完整的固定超时，避免 provider 整体变慢后按旧分位数一直超时、无法恢复
+                entry.probe_started_at = self._clock()
+            return self._adaptive_timeout(entry, default_timeout)
+
+    def is_available(self, provider, model):
+        with self._lock:
+            entry = self._entries.get((provider, model))
+            if entry is None:
+                return True
+            self._refresh(entry)
+            return entry.state == "closed" or (entry.state == "half_open" and not self._probe_in_flight(entry))
+
+    def record_success(self, provider, model, latency_seconds=None):
+        # latency_seconds 为 None 表示 provider 有响应但请求本身无效（4xx），只用来恢复熔断状态
+        with self._lock:
+            entry = self._entry(provider, model)
+            if latency_seconds is not None:
+                entry.latencies.append(latency_seconds)
+                entry.outcomes.append(True)
+            entry.consecutive_failures = 0
+            entry.state = "closed"
+            entry.probe_started_at = None
+
+    def record_failure(self, provider, model):
+        with self._lock:
+            entry = self._entry(provider, model)
+            entry.outcomes.append(False)
+            entry.consecutive_failures += 1
+            if entry.state == "half_open" or (
+                entry.state == "closed" and entry.consecutive_failures >= self.failure_threshold
+            ):
+                entry.state = "open"
+                entry.opened_at = self._clock()
+                entry.probe_started_at = None
+                entry.trips += 1
+
+    @contextmanager
+    def track(self, provider, model):
+        # 包住一次 provider 调用：正常结束记录耗时，异常按类型记为失败或无效请求；GeneratorExit 不记录
+        started_at = self._clock()
+        try:
+            yield
+        except Exception as exc:
+            if is_provider_failure(exc):
+                self.record_failure(provider, model)
+            else:
+                self.record_success(provider, model)
+            raise
+        self.record_success(provider, model, self._clock() - started_at)
+
+    def summary(self):
+        with self._lock:
+            summary = {}
+            for (provider, model), entry in sorted(self._entries.items()):
+                self._refresh(entry)
+                latencies = list(entry.latencies)
+                summary[f"{provider}/{model}"] = {
+                    "state": entry.state,
+                    "samples": len(entry.outcomes),
+                    "error_rate": round(entry.outcomes.count(False) / len(entry.outcomes), 3) if entry.outcomes else None,
+                    "p50_seconds": round(nearest_rank_percentile(latencies, 0.5), 3) if latencies else None,
+                    "p99_seconds": round(nearest_rank_percentile(latencies, 0.99), 3) if latencies else None,
+                    "timeout_seconds": self._adaptive_timeout(entry, entry.default_timeout) if entry.default_timeout else None,
+                    "consecutive_failures": entry.consecutive_failures,
+                    "trips": entry.trips,
+                }
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_provider_health = ProviderHealthRegistry()
+
+
+def get_provider_health():
+    return _provider_health
+
+
+def configure_provider_health(**options):
+    global _provider_health
+    _provider_health = ProviderHealthRegistry(**options)
+    return _provider_health
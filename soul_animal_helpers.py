@@ -1,13 +1,54 @@
 import html
 import json
+import math
+import os
+import re
+import threading
+import time
+import tomllib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from soul_animal_health import get_provider_health
+from soul_animal_metrics import measure_response_bytes, record_response, span
+from soul_animal_prompts import DEFAULT_PROMPT_VERSION, get_prompt_stats, get_prompt_template
+from soul_animal_scheduler import get_provider_scheduler
 
 SILICONFLOW_IMAGE_URL = "https://api.siliconflow.cn/v1/images/generations"
 SILICONFLOW_MODEL = "black-forest-labs/FLUX.1-schnell"
+SILICONFLOW_IMAGE_SIZE = "1024x1024"
+# 图片风格前缀按主题配置，这里是默认的空灵主题
+SILICONFLOW_STYLE_PREFIX = "Masterpiece, breathtaking ethereal fantasy art, majestic, luminous"
 SILICONFLOW_TIMEOUT_SECONDS = 30
+IMAGE_DOWNLOAD_TIMEOUT_SECONDS = 30
 OPENAI_COMPATIBLE_TIMEOUT_SECONDS = 60
+GEMINI_TIMEOUT_SECONDS = 60
+
+# 所有 provider 请求共用一个 requests.Session：按 host 维护 keep-alive 连接池，跨 Streamlit session 复用
+HTTP_POOL_CONNECTIONS = 8
+HTTP_POOL_MAXSIZE = 32
+HTTP_RETRY_TOTAL = 2
+HTTP_RETRY_BACKOFF_SECONDS = 0.5
+# 429 不在传输层重试：限流交给调度器的准入控制和熔断，避免按 Retry-After 在超时之外长时间睡眠
+HTTP_RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# 准入控制按 token 预估占用 TPM 额度：输入按字符数估算，输出按固定上限估算
+ESTIMATED_OUTPUT_TOKENS = 1200
+
+IMAGE_EXECUTOR_WORKERS = 8
+# 页面等待后台图片的上限：请求自身超时之外再留少量排队余量
+IMAGE_WAIT_TIMEOUT_SECONDS = SILICONFLOW_TIMEOUT_SECONDS + 5
 
+# 进程级线程池，所有 session 共享；图片请求在这里执行，不阻塞页面其余部分的渲染
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_EXECUTOR_WORKERS, thread_name_prefix="siliconflow-image")
+
+# max_output_tokens 是每个模型的输出预算；推理模型的思考 token 也计入预算，设得过紧会把 JSON 截断。
+# OpenAI 新模型用 max_completion_tokens，其他 OpenAI 兼容接口用 max_tokens
 TEXT_MODEL_OPTIONS = {
     "gemini_2_5_flash": {
         "label": "Gemini 2.5 Flash",
@@ -15,6 +56,8 @@ TEXT_MODEL_OPTIONS = {
         "model": "models/gemini-2.5-flash",
         "secret_name": "GEMINI_API_KEY",
         "base_url": None,
+        "structured_output": True,
+        "max_output_tokens": 4096,
     },
     "openai_gpt_5_5": {
         "label": "OpenAI GPT-5.5",
@@ -22,6 +65,9 @@ TEXT_MODEL_OPTIONS = {
         "model": "gpt-5.5",
         "secret_name": "OPENAI_API_KEY",
         "base_url": "https://api.openai.com/v1",
+        "structured_output": True,
+        "max_output_tokens": 4096,
+        "max_tokens_param": "max_completion_tokens",
     },
     "openai_gpt_5_4_mini": {
         "label": "OpenAI GPT-5.4 mini",
@@ -29,6 +75,9 @@ TEXT_MODEL_OPTIONS = {
         "model": "gpt-5.4-mini",
         "secret_name": "OPENAI_API_KEY",
         "base_url": "https://api.openai.com/v1",
+        "structured_output": True,
+        "max_output_tokens": 3072,
+        "max_tokens_param": "max_completion_tokens",
     },
     "xai_grok_4_3": {
         "label": "xAI Grok 4.3",
@@ -36,10 +85,80 @@ TEXT_MODEL_OPTIONS = {
         "model": "grok-4.3",
         "secret_name": "XAI_API_KEY",
         "base_url": "https://api.x.ai/v1",
+        "structured_output": True,
+        "max_output_tokens": 4096,
+        "max_tokens_param": "max_tokens",
     },
 }
 
 DEFAULT_TEXT_MODEL_ID = "gemini_2_5_flash"
+SECRET_NAMES = ["GEMINI_API_KEY", "OPENAI_API_KEY", "XAI_API_KEY", "SILICONFLOW_API_KEY"]
+
+QUESTIONS = [
+    {"id": "q1", "q": "1. 暴风雨夜，全世界电力切断。作为幸存者，你的第一反应是？", 
+     "options": ["A. 建立绝对防御圈（生存优先）", "B. 组建互助联盟（社交优先）", "C. 记录这一切混乱（观察者）"]},
+    {"id": "q2", "q": "2. 在名利场晚宴上，最让你感到不适的是？", 
+     "options": ["A. 低效的寒暄与客套", "B. 满场的虚伪与面具", "C. 无人关注到你的存在"]},
+    {"id": "q3", "q": "3. 如果必须获得一种能力，你会选择？", 
+     "options": ["A. 读心术：洞察一切谎言", "B. 预知未来：掌握绝对因果", "C. 隐形：获得纯粹的自由"]},
+    {"id": "q4", "q": "4. 面对愚蠢权威的发号施令，你的本能反应是？", 
+     "options": ["A. 当面指出逻辑漏洞", "B. 表面顺从，幕后按自己方式办", "C. 转身离开，不浪费时间"]},
+    {"id": "q5", "q": "5. 你认为这个世界的底层运行逻辑更像是？", 
+     "options": ["A. 弱肉强食的黑暗森林", "B. 精密冰冷的因果程序", "C. 一场没有意义但有趣的戏剧"]}
+]
+
+SOUL_STATS_AXES = ["独立性", "洞察力", "边界感", "精神力", "共情力", "掌控欲"]
+SOUL_TEXT_FIELDS = ["animal", "quote", "analysis", "mask", "shadow", "image_prompt"]
+
+# Prompt 模板在 soul_animal_prompts.py 中按版本维护，缓存键包含版本号
+SOUL_PROMPT_VERSION = DEFAULT_PROMPT_VERSION
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def build_http_session(
+    pool_connections=HTTP_POOL_CONNECTIONS,
+    pool_maxsize=HTTP_POOL_MAXSIZE,
+    retry_total=HTTP_RETRY_TOTAL,
+    retry_backoff_seconds=HTTP_RETRY_BACKOFF_SECONDS,
+):
+    # 只重试连接失败和 5xx，且不按 Retry-After 等待；读超时不重试，避免模型已经在生成时重复计费
+    retry = Retry(
+        total=retry_total,
+        connect=retry_total,
+        read=0,
+        status=retry_total,
+        backoff_factor=retry_backoff_seconds,
+        status_forcelist=HTTP_RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_http_session(**options):
+    global _http_session
+    session = build_http_session(**options)
+    with _http_session_lock:
+        previous, _http_session = _http_session, session
+    if previous is not None:
+        previous.close()
+    return session
+
+
+def get_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = build_http_session()
+        return _http_session
 
 
 def get_text_model_option(model_id):
@@ -49,6 +168,84 @@ def get_text_model_option(model_id):
     return option
 
 
+def get_provider_name(text_model):
+    if text_model["provider"] == "gemini":
+        return "gemini"
+    return urlparse(text_model["base_url"]).hostname
+
+
+def estimate_request_tokens(prompt):
+    return len(prompt) + ESTIMATED_OUTPUT_TOKENS
+
+
+def load_secrets(path=".streamlit/secrets.toml", environ=None):
+    # 脱离 Streamlit 运行（预计算脚本等）时读取同一份 secrets，环境变量优先
+    secrets = {}
+    if os.path.exists(path):
+        with open(path, "rb") as secrets_file:
+            secrets.update(tomllib.load(secrets_file))
+    environ = os.environ if environ is None else environ
+    for name in SECRET_NAMES:
+        if environ.get(name):
+            secrets[name] = environ[name]
+    return secrets
+
+
+def build_answers_key(answers):
+    return tuple(answers[question_id] for question_id in sorted(answers))
+
+
+def build_soul_prompt(user_profile, prompt_version=SOUL_PROMPT_VERSION):
+    return get_prompt_template(prompt_version).render(user_profile=user_profile)
+
+
+def build_soul_profile_json_schema(stats_axes=SOUL_STATS_AXES):
+    return {
+        "type": "object",
+        "properties": {
+            **{field: {"type": "string"} for field in SOUL_TEXT_FIELDS},
+            "keywords": {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 3},
+            "stats": {
+                "type": "object",
+                "properties": {axis: {"type": "integer", "minimum": 0, "maximum": 100} for axis in stats_axes},
+                "required": list(stats_axes),
+                "additionalProperties": False,
+            },
+        },
+        "required": SOUL_TEXT_FIELDS + ["keywords", "stats"],
+        "additionalProperties": False,
+    }
+
+
+def build_gemini_response_schema(schema):
+    # Gemini 的 response_schema 只支持 OpenAPI 子集，去掉它不认识的约束，范围和数量交给本地校验
+    if isinstance(schema, dict):
+        return {
+            key: build_gemini_response_schema(value) if key in {"properties", "items"} or isinstance(value, dict) else value
+            for key, value in schema.items()
+            if key not in {"additionalProperties", "minimum", "maximum", "minItems", "maxItems"}
+        }
+    return schema
+
+
+def normalize_answers(answers, questions=QUESTIONS):
+    # 接受 {"q1": ...} 字典、选项文本列表或选项下标列表，统一成按题号排列的选项文本元组
+    if isinstance(answers, dict):
+        answers = build_answers_key(answers)
+    if not isinstance(answers, (list, tuple)) or len(answers) != len(questions):
+        raise ValueError(f"需要 {len(questions)} 道题的答案。")
+
+    normalized = []
+    for question, answer in zip(questions, answers):
+        options = question["options"]
+        if isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < len(options):
+            answer = options[answer]
+        if not isinstance(answer, str) or answer not in options:
+            raise ValueError(f"题目 {question['id']} 的答案无效。")
+        normalized.append(answer)
+    return tuple(normalized)
+
+
 def extract_json_payload(raw_text):
     cleaned = raw_text.strip()
     if cleaned.startswith("```"):
@@ -71,8 +268,65 @@ def extract_json_payload(raw_text):
     return data
 
 
+# 流式输出时增量解析顶层 JSON 对象：每当一个顶层字段完整到达就立即返回，供页面提前渲染。
+# 这里只做预览，最终结果仍以完整文本经过 extract_json_payload + validate_soul_profile 为准。
+class IncrementalJsonFieldParser:
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        while self._pos < len(self.text) and not self.done:
+            char = self.text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1 and char == "{":
+                    self._member_start = self._pos + 1
+            elif char in "}]" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(completed)
+                    self.done = True
+            elif char == "," and self._depth == 1:
+                self._emit(completed)
+                self._member_start = self._pos + 1
+            self._pos += 1
+        return completed
+
+    def _emit(self, completed):
+        if self._member_start is None:
+            return
+        member = self.text[self._member_start:self._pos].strip()
+        if not member:
+            return
+        try:
+            field = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            return
+        for key, value in field.items():
+            self.fields[key] = value
+            completed.append((key, value))
+
+
 def validate_soul_profile(data):
-    required_text_fields = ["animal", "quote", "analysis", "mask", "shadow", "image_prompt"]
+    required_text_fields = SOUL_TEXT_FIELDS
     required_keys = set(required_text_fields + ["keywords", "stats"])
     missing_keys = sorted(required_keys - set(data.keys())) if isinstance(data, dict) else sorted(required_keys)
     if missing_keys:
@@ -108,6 +362,125 @@ def validate_soul_profile(data):
     return normalized
 
 
+def recover_json_payload(raw_text):
+    # 宽松解析：取文本中第一个 ```json 代码块或第一个完整的 JSON 对象，丢弃前后的多余说明
+    fenced = re.search(r"```(?:json)?\s*(\{.*)", raw_text, re.DOTALL)
+    candidates = [fenced.group(1)] if fenced else []
+    start_index = raw_text.find("{")
+    if start_index != -1:
+        candidates.append(raw_text[start_index:])
+
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        try:
+            data, _ = decoder.raw_decode(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    raise ValueError("AI 返回结果不是合法 JSON，请重试。")
+
+
+def repair_soul_profile(data):
+    # 只修复可以确定性修正的问题：文本两端空白、多余或拼成一串的关键词、小数/字符串/越界的分数
+    if not isinstance(data, dict):
+        return data
+    repaired = dict(data)
+
+    keywords = repaired.get("keywords")
+    if isinstance(keywords, str):
+        keywords = [keyword for keyword in re.split(r"[,，、/|\s]+", keywords) if keyword]
+    if isinstance(keywords, list):
+        keywords = [keyword.strip().lstrip("#").strip() if isinstance(keyword, str) else keyword for keyword in keywords]
+        repaired["keywords"] = [keyword for keyword in keywords if keyword != ""][:3]
+
+    stats = repaired.get("stats")
+    if isinstance(stats, dict):
+        repaired_stats = {}
+        for key, value in stats.items():
+            if isinstance(value, str):
+                try:
+                    value = float(value.strip().rstrip("%"))
+                except ValueError:
+                    pass
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                # inf / nan 无法取整，按校验失败处理，交给后续修复或故障转移
+                if not math.isfinite(value):
+                    raise ValueError(f"AI 返回的 stats.{key} 不是有限数值。")
+                value = min(100, max(0, int(round(value))))
+            repaired_stats[key] = value
+        repaired["stats"] = repaired_stats
+
+    return repaired
+
+
+_repair_counters = Counter()
+_repair_counters_lock = threading.Lock()
+
+
+def record_repair_path(path):
+    with _repair_counters_lock:
+        _repair_counters[path] += 1
+
+
+def get_repair_counters():
+    with _repair_counters_lock:
+        return dict(_repair_counters)
+
+
+def build_json_fix_prompt(raw_text, error_message):
+    return (
+        f"下面这段 JSON 没有通过校验：{error_message}\n"
+        "请只修正问题并输出完整的纯 JSON，不要任何解释或 Markdown。"
+        "keywords 必须正好 3 个短词，stats 的数值必须是 0-100 的整数。\n\n"
+        f"{raw_text}"
+    )
+
+
+def parse_soul_profile_with_path(raw_text, fix_json=None):
+    with span("parse", raw_bytes=len(raw_text.encode("utf-8"))) as parse:
+        profile, repair_path = parse_soul_profile_with_repairs(raw_text, fix_json)
+        parse.set(repair_path=repair_path)
+    return profile, repair_path
+
+
+# 所有修复路径都没能通过校验；是 ValueError 的子类，现有的 except ValueError 照常生效
+class ProfileValidationError(ValueError):
+    pass
+
+
+def parse_soul_profile_with_repairs(raw_text, fix_json):
+    # 1. 严格解析；2. 本地确定性修复；3. 最后才用一次针对性的“修 JSON”请求代替整次重新生成
+    try:
+        profile = validate_soul_profile(extract_json_payload(raw_text))
+    except ValueError as exc:
+        strict_error = exc
+    else:
+        record_repair_path("strict")
+        return profile, "strict"
+
+    try:
+        profile = validate_soul_profile(repair_soul_profile(recover_json_payload(raw_text)))
+    except ValueError as exc:
+        local_error = exc
+    else:
+        record_repair_path("local_repair")
+        return profile, "local_repair"
+
+    if fix_json is not None:
+        try:
+            fixed_text = fix_json(raw_text, str(local_error))
+            profile = validate_soul_profile(repair_soul_profile(recover_json_payload(fixed_text)))
+        except (RuntimeError, ValueError):
+            pass
+        else:
+            record_repair_path("followup_repair")
+            return profile, "followup_repair"
+
+    record_repair_path("failed")
+    raise ProfileValidationError(str(strict_error)) from strict_error
+
+
 def escape_profile_for_html(data):
     escaped = {}
     for key in ["animal", "quote", "analysis", "mask", "shadow"]:
@@ -116,9 +489,9 @@ def escape_profile_for_html(data):
     return escaped
 
 
-def generate_openai_compatible_chat_text(base_url, model, api_key, prompt, timeout=OPENAI_COMPATIBLE_TIMEOUT_SECONDS):
-    url = f"{base_url.rstrip('/')}/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+def build_openai_compatible_chat_payload(
+    model, prompt, response_schema=None, stream=False, max_output_tokens=None, max_tokens_param="max_tokens"
+):
     payload = {
         "model": model,
         "messages": [
@@ -129,11 +502,87 @@ def generate_openai_compatible_chat_text(base_url, model, api_key, prompt, timeo
             {"role": "user", "content": prompt},
         ],
     }
+    if stream:
+        payload["stream"] = True
+        # 流式响应默认不带 usage，需要显式要求在最后一个事件里返回
+        payload["stream_options"] = {"include_usage": True}
+    if max_output_tokens:
+        payload[max_tokens_param] = max_output_tokens
+    if response_schema is not None:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "soul_profile", "schema": response_schema, "strict": True},
+        }
+    return payload
+
+
+def parse_openai_usage(usage_data):
+    if not isinstance(usage_data, dict):
+        return {}
+    usage = {}
+    if isinstance(usage_data.get("prompt_tokens"), int):
+        usage["input_tokens"] = usage_data["prompt_tokens"]
+    if isinstance(usage_data.get("completion_tokens"), int):
+        usage["output_tokens"] = usage_data["completion_tokens"]
+    return usage
+
+
+def parse_gemini_usage(usage_metadata):
+    usage = {}
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", None)
+    output_tokens = getattr(usage_metadata, "candidates_token_count", None)
+    thoughts_tokens = getattr(usage_metadata, "thoughts_token_count", None)
+    if isinstance(prompt_tokens, int):
+        usage["input_tokens"] = prompt_tokens
+    if isinstance(output_tokens, int):
+        # 思考 token 同样按输出计费，合并计入
+        usage["output_tokens"] = output_tokens + (thoughts_tokens if isinstance(thoughts_tokens, int) else 0)
+    return usage
+
+
+def record_token_usage(call, usage, tokens):
+    if not tokens:
+        return
+    call.set(**tokens)
+    if usage is not None:
+        usage.update(tokens)
+
+
+def generate_openai_compatible_chat_text(
+    base_url,
+    model,
+    api_key,
+    prompt,
+    timeout=OPENAI_COMPATIBLE_TIMEOUT_SECONDS,
+    response_schema=None,
+    max_output_tokens=None,
+    max_tokens_param="max_tokens",
+    usage=None,
+):
+    url = f"{base_url.rstrip('/')}/chat/completions"
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = build_openai_compatible_chat_payload(
+        model, prompt, response_schema=response_schema, max_output_tokens=max_output_tokens, max_tokens_param=max_tokens_param
+    )
+    provider = urlparse(url).hostname
+    health = get_provider_health()
+    # 固定超时作为上限，样本足够后按观测到的耗时分位数收紧；熔断打开时直接抛出 CircuitOpenError
+    timeout = health.admit(provider, model, timeout)
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=timeout)
-        response.raise_for_status()
-        response_data = response.json()
+        with get_provider_scheduler().acquire(provider, tokens=estimate_request_tokens(prompt)):
+            with span("provider_call", provider, model, stream=False, timeout_seconds=timeout) as call, health.track(provider, model):
+                response = get_http_session().post(url, json=payload, headers=headers, timeout=timeout)
+                record_response(call, response)
+                call.set(response_bytes=measure_response_bytes(response))
+                response.raise_for_status()
+                response_data = response.json()
+                if isinstance(response_data, dict):
+                    record_token_usage(call, usage, parse_openai_usage(response_data.get("usage")))
+                    choices = response_data.get("choices")
+                    if isinstance(choices, list) and choices and isinstance(choices[0], dict):
+                        # finish_reason 为 length 说明输出预算不够，JSON 多半被截断
+                        call.set(finish_reason=choices[0].get("finish_reason"))
     except requests.Timeout as exc:
         raise RuntimeError("文本模型请求超时，请稍后重试。") from exc
     except requests.HTTPError as exc:
@@ -156,20 +605,274 @@ def generate_openai_compatible_chat_text(base_url, model, api_key, prompt, timeo
     return content.strip()
 
 
-def generate_siliconflow_image_url(image_prompt, api_key, timeout=SILICONFLOW_TIMEOUT_SECONDS):
+def stream_openai_compatible_chat_text(
+    base_url,
+    model,
+    api_key,
+    prompt,
+    timeout=OPENAI_COMPATIBLE_TIMEOUT_SECONDS,
+    response_schema=None,
+    max_output_tokens=None,
+    max_tokens_param="max_tokens",
+    usage=None,
+):
+    url = f"{base_url.rstrip('/')}/chat/completions"
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = build_openai_compatible_chat_payload(
+        model,
+        prompt,
+        response_schema=response_schema,
+        stream=True,
+        max_output_tokens=max_output_tokens,
+        max_tokens_param=max_tokens_param,
+    )
+
+    provider = urlparse(url).hostname
+    health = get_provider_health()
+    received_text = False
+    timeout = health.admit(provider, model, timeout)
+    try:
+        with get_provider_scheduler().acquire(provider, tokens=estimate_request_tokens(prompt)):
+            with span("provider_call", provider, model, stream=True, timeout_seconds=timeout) as call, health.track(provider, model):
+                started_at = time.perf_counter()
+                response = get_http_session().post(url, json=payload, headers=headers, timeout=timeout, stream=True)
+                record_response(call, response)
+                response_bytes = 0
+                try:
+                    response.raise_for_status()
+                    # SSE 固定为 UTF-8；响应头没写 charset 时 requests 会按 ISO-8859-1 解码，把中文拆成乱码并错误断行
+                    response.encoding = "utf-8"
+                    for line in response.iter_lines(decode_unicode=True):
+                        response_bytes += len(line or "")
+                        if not line or not line.startswith("data:"):
+                            continue
+                        event_data = line[len("data:"):].strip()
+                        if event_data == "[DONE]":
+                            break
+                        event = json.loads(event_data)
+                        record_token_usage(call, usage, parse_openai_usage(event.get("usage")))
+                        choices = event.get("choices")
+                        delta = choices[0].get("delta") if isinstance(choices, list) and choices and isinstance(choices[0], dict) else None
+                        content = delta.get("content") if isinstance(delta, dict) else None
+                        if isinstance(content, str) and content:
+                            if not received_text:
+                                call.set(first_token_ms=round((time.perf_counter() - started_at) * 1000, 2))
+                            received_text = True
+                            yield content
+                finally:
+                    # 流式响应必须关闭后连接才会归还连接池
+                    call.set(response_bytes=response_bytes)
+                    response.close()
+    except requests.Timeout as exc:
+        raise RuntimeError("文本模型请求超时，请稍后重试。") from exc
+    except requests.HTTPError as exc:
+        status_code = exc.response.status_code if exc.response is not None else "unknown"
+        raise RuntimeError(f"文本模型请求失败，HTTP 状态码：{status_code}") from exc
+    except requests.RequestException as exc:
+        raise RuntimeError("文本模型网络请求失败，请稍后重试。") from exc
+    except ValueError as exc:
+        raise RuntimeError("文本模型返回结果不是合法 JSON。") from exc
+
+    if not received_text:
+        raise RuntimeError("文本模型返回结果缺少文本内容。")
+
+
+def build_gemini_generation_config(response_schema=None, max_output_tokens=None):
+    config = {}
+    if response_schema is not None:
+        config["response_mime_type"] = "application/json"
+        config["response_schema"] = build_gemini_response_schema(response_schema)
+    if max_output_tokens:
+        config["max_output_tokens"] = max_output_tokens
+    return config or None
+
+
+def stream_gemini_text(
+    model, api_key, prompt, response_schema=None, max_output_tokens=None, usage=None, timeout=GEMINI_TIMEOUT_SECONDS
+):
+    import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
+
+    genai.configure(api_key=api_key)
+    generation_config = build_gemini_generation_config(response_schema, max_output_tokens)
+    health = get_provider_health()
+    timeout = health.admit("gemini", model, timeout)
+    try:
+        with get_provider_scheduler().acquire("gemini", tokens=estimate_request_tokens(prompt)):
+            with span(
+                "provider_call", "gemini", model, stream=True, request_bytes=len(prompt.encode("utf-8")), timeout_seconds=timeout
+            ) as call, health.track("gemini", model):
+                response_bytes = 0
+                for chunk in genai.GenerativeModel(model).generate_content(
+                    prompt, stream=True, generation_config=generation_config, request_options={"timeout": timeout}
+                ):
+                    # usage_metadata 在最后一个分片里是完整的累计值
+                    record_token_usage(call, usage, parse_gemini_usage(getattr(chunk, "usage_metadata", None)))
+                    if chunk.text:
+                        response_bytes += len(chunk.text.encode("utf-8"))
+                        call.set(response_bytes=response_bytes)
+                        yield chunk.text
+    except google_exceptions.DeadlineExceeded as exc:
+        raise RuntimeError("文本模型请求超时，请稍后重试。") from exc
+    except google_exceptions.GoogleAPIError as exc:
+        raise RuntimeError(f"Gemini 请求失败：{exc}") from exc
+
+
+def stream_text_model_text(text_model, api_key, prompt, response_schema=None, usage=None):
+    if text_model["provider"] == "gemini":
+        return stream_gemini_text(
+            text_model["model"],
+            api_key,
+            prompt,
+            response_schema=response_schema,
+            max_output_tokens=text_model.get("max_output_tokens"),
+            usage=usage,
+            timeout=text_model.get("timeout_seconds", GEMINI_TIMEOUT_SECONDS),
+        )
+    return stream_openai_compatible_chat_text(
+        text_model["base_url"],
+        text_model["model"],
+        api_key,
+        prompt,
+        timeout=text_model.get("timeout_seconds", OPENAI_COMPATIBLE_TIMEOUT_SECONDS),
+        response_schema=response_schema,
+        max_output_tokens=text_model.get("max_output_tokens"),
+        max_tokens_param=text_model.get("max_tokens_param", "max_tokens"),
+        usage=usage,
+    )
+
+
+def generate_gemini_text(
+    model, api_key, prompt, response_schema=None, max_output_tokens=None, usage=None, timeout=GEMINI_TIMEOUT_SECONDS
+):
+    import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
+
+    genai.configure(api_key=api_key)
+    generation_config = build_gemini_generation_config(response_schema, max_output_tokens)
+    health = get_provider_health()
+    timeout = health.admit("gemini", model, timeout)
+    try:
+        with get_provider_scheduler().acquire("gemini", tokens=estimate_request_tokens(prompt)):
+            with span(
+                "provider_call", "gemini", model, stream=False, request_bytes=len(prompt.encode("utf-8")), timeout_seconds=timeout
+            ) as call, health.track("gemini", model):
+                response = genai.GenerativeModel(model).generate_content(
+                    prompt, generation_config=generation_config, request_options={"timeout": timeout}
+                )
+                record_token_usage(call, usage, parse_gemini_usage(getattr(response, "usage_metadata", None)))
+                text = response.text
+                call.set(response_bytes=len(text.encode("utf-8")))
+                return text
+    except google_exceptions.DeadlineExceeded as exc:
+        raise RuntimeError("文本模型请求超时，请稍后重试。") from exc
+    except google_exceptions.GoogleAPIError as exc:
+        raise RuntimeError(f"Gemini 请求失败：{exc}") from exc
+
+
+def generate_text_model_text(text_model, api_key, prompt, response_schema=None, usage=None):
+    if text_model["provider"] == "gemini":
+        return generate_gemini_text(
+            text_model["model"],
+            api_key,
+            prompt,
+            response_schema=response_schema,
+            max_output_tokens=text_model.get("max_output_tokens"),
+            usage=usage,
+            timeout=text_model.get("timeout_seconds", GEMINI_TIMEOUT_SECONDS),
+        )
+    return generate_openai_compatible_chat_text(
+        text_model["base_url"],
+        text_model["model"],
+        api_key,
+        prompt,
+        timeout=text_model.get("timeout_seconds", OPENAI_COMPATIBLE_TIMEOUT_SECONDS),
+        response_schema=response_schema,
+        max_output_tokens=text_model.get("max_output_tokens"),
+        max_tokens_param=text_model.get("max_tokens_param", "max_tokens"),
+        usage=usage,
+    )
+
+
+def build_json_fixer(text_model, api_key):
+    # 修 JSON 的追加请求不带 schema 约束，只需要把现有内容改合法，比整次重新生成便宜得多
+    return lambda raw_text, error_message: generate_text_model_text(
+        text_model, api_key, build_json_fix_prompt(raw_text, error_message)
+    )
+
+
+def get_response_schema(text_model, stats_axes=SOUL_STATS_AXES):
+    return build_soul_profile_json_schema(stats_axes) if text_model.get("structured_output") else None
+
+
+def generate_soul_profile(
+    text_model, api_key, answers_key, prompt_version=SOUL_PROMPT_VERSION, followup_repair=True, stats_axes=SOUL_STATS_AXES
+):
+    with span("prompt_build", prompt_version=prompt_version):
+        prompt = build_soul_prompt("\n".join(answers_key), prompt_version)
+    usage = {}
+    started_at = time.perf_counter()
+    try:
+        response_text = generate_text_model_text(
+            text_model, api_key, prompt, response_schema=get_response_schema(text_model, stats_axes), usage=usage
+        )
+        fix_json = build_json_fixer(text_model, api_key) if followup_repair else None
+        profile, repair_path = parse_soul_profile_with_path(response_text, fix_json=fix_json)
+    except (RuntimeError, ValueError):
+        get_prompt_stats().record(prompt_version, "failed", time.perf_counter() - started_at, usage)
+        raise
+    get_prompt_stats().record(prompt_version, repair_path, time.perf_counter() - started_at, usage)
+    return profile
+
+
+def stream_soul_profile(
+    text_model, api_key, answers_key, on_field, prompt_version=SOUL_PROMPT_VERSION, stats_axes=SOUL_STATS_AXES
+):
+    with span("prompt_build", prompt_version=prompt_version):
+        prompt = build_soul_prompt("\n".join(answers_key), prompt_version)
+    usage = {}
+    started_at = time.perf_counter()
+    parser = IncrementalJsonFieldParser()
+    try:
+        for chunk in stream_text_model_text(
+            text_model, api_key, prompt, response_schema=get_response_schema(text_model, stats_axes), usage=usage
+        ):
+            for key, value in parser.feed(chunk):
+                on_field(key, value)
+        profile, repair_path = parse_soul_profile_with_path(parser.text, fix_json=build_json_fixer(text_model, api_key))
+    except (RuntimeError, ValueError):
+        get_prompt_stats().record(prompt_version, "failed", time.perf_counter() - started_at, usage)
+        raise
+    get_prompt_stats().record(prompt_version, repair_path, time.perf_counter() - started_at, usage)
+    return profile
+
+
+def build_siliconflow_enhanced_prompt(image_prompt, style_prefix=SILICONFLOW_STYLE_PREFIX):
+    return f"{style_prefix}, {image_prompt}"
+
+
+def generate_siliconflow_image_url(
+    image_prompt, api_key, timeout=SILICONFLOW_TIMEOUT_SECONDS, url=SILICONFLOW_IMAGE_URL, style_prefix=SILICONFLOW_STYLE_PREFIX
+):
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    enhanced_prompt = f"Masterpiece, breathtaking ethereal fantasy art, majestic, luminous, {image_prompt}"
     payload = {
         "model": SILICONFLOW_MODEL,
-        "prompt": enhanced_prompt,
-        "image_size": "1024x1024",
+        "prompt": build_siliconflow_enhanced_prompt(image_prompt, style_prefix),
+        "image_size": SILICONFLOW_IMAGE_SIZE,
         "batch_size": 1,
     }
 
+    provider = urlparse(url).hostname
+    health = get_provider_health()
+    timeout = health.admit(provider, SILICONFLOW_MODEL, timeout)
     try:
-        response = requests.post(SILICONFLOW_IMAGE_URL, json=payload, headers=headers, timeout=timeout)
-        response.raise_for_status()
-        response_data = response.json()
+        with get_provider_scheduler().acquire(provider), health.track(provider, SILICONFLOW_MODEL):
+            with span("image_generate", provider, SILICONFLOW_MODEL, timeout_seconds=timeout) as call:
+                response = get_http_session().post(url, json=payload, headers=headers, timeout=timeout)
+                record_response(call, response)
+                call.set(response_bytes=measure_response_bytes(response))
+                response.raise_for_status()
+                response_data = response.json()
     except requests.Timeout as exc:
         raise RuntimeError("SiliconFlow 图片生成请求超时，请稍后重试。") from exc
     except requests.HTTPError as exc:
@@ -191,6 +894,26 @@ def generate_siliconflow_image_url(image_prompt, api_key, timeout=SILICONFLOW_TI
     return image_url
 
 
+def download_image_bytes(image_url, timeout=IMAGE_DOWNLOAD_TIMEOUT_SECONDS):
+    try:
+        with span("image_download", urlparse(image_url).hostname) as download:
+            response = get_http_session().get(image_url, timeout=timeout)
+            record_response(download, response)
+            download.set(response_bytes=measure_response_bytes(response))
+            response.raise_for_status()
+    except requests.Timeout as exc:
+        raise RuntimeError("图片下载超时，请稍后重试。") from exc
+    except requests.HTTPError as exc:
+        status_code = exc.response.status_code if exc.response is not None else "unknown"
+        raise RuntimeError(f"图片下载失败，HTTP 状态码：{status_code}") from exc
+    except requests.RequestException as exc:
+        raise RuntimeError("图片下载网络请求失败，请稍后重试。") from exc
+
+    if not response.content:
+        raise RuntimeError("下载到的图片内容为空。")
+    return response.content
+
+
 def build_seedance_video_prompt(data):
     keywords = ", ".join(data["keywords"])
     return (
@@ -0,0 +1,169 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+
+from soul_animal_cache import SingleFlight
+from soul_animal_helpers import (
+    SILICONFLOW_IMAGE_SIZE,
+    SILICONFLOW_IMAGE_URL,
+    SILICONFLOW_MODEL,
+    SILICONFLOW_STYLE_PREFIX,
+    build_siliconflow_enhanced_prompt,
+    download_image_bytes,
+    generate_siliconflow_image_url,
+)
+from soul_animal_metrics import span
+
+IMAGE_STORE_DIR = ".image_store"
+IMAGE_STORE_QUOTA_BYTES = 512 * 1024 * 1024
+# 每张图保存的尺寸：full 用于保存原图，mobile 用于页面展示，避免手机端总是加载 1024x1024
+IMAGE_VARIANT_SIZES = {"full": 1024, "mobile": 512}
+IMAGE_DISPLAY_VARIANT = "mobile"
+IMAGE_WEBP_QUALITY = 82
+# 图片 key 是 sha256 十六进制串；外部传入的 key 拼进文件路径前必须先校验
+IMAGE_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def build_image_key(model, enhanced_prompt, image_size):
+    return hashlib.sha256(f"{model}\n{image_size}\n{enhanced_prompt}".encode("utf-8")).hexdigest()
+
+
+def is_valid_image_key(key):
+    return isinstance(key, str) and IMAGE_KEY_PATTERN.fullmatch(key) is not None
+
+
+def build_siliconflow_image_key(image_prompt, style_prefix=SILICONFLOW_STYLE_PREFIX):
+    # 风格前缀是增强 prompt 的一部分：不同主题的同一 image_prompt 对应不同的图
+    return build_image_key(SILICONFLOW_MODEL, build_siliconflow_enhanced_prompt(image_prompt, style_prefix), SILICONFLOW_IMAGE_SIZE)
+
+
+def transcode_image(original_bytes, variant_sizes=IMAGE_VARIANT_SIZES, quality=IMAGE_WEBP_QUALITY):
+    from PIL import Image
+
+    # 下载到的可能是过期链接返回的 HTML 或损坏的文件，统一转成 RuntimeError，调用方按普通图片失败处理
+    try:
+        with Image.open(io.BytesIO(original_bytes)) as image:
+            image = image.convert("RGB")
+            variants = {}
+            for variant, max_side in variant_sizes.items():
+                resized = image.copy()
+                resized.thumbnail((max_side, max_side))
+                output = io.BytesIO()
+                resized.save(output, format="WEBP", quality=quality, method=4)
+                variants[variant] = output.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise RuntimeError("图片内容无法解析，请稍后重试。") from exc
+    return variants
+
+
+# 按内容寻址的本地图片库：同一 (模型, 增强 prompt, 尺寸) 只下载/生成一次，转成多尺寸 WebP 保存，
+# 页面直接读取本地字节，不再让浏览器去拉会过期的 provider 临时链接。超出磁盘配额时按最近访问时间淘汰。
+class ImageStore:
+    def __init__(self, directory=IMAGE_STORE_DIR, quota_bytes=IMAGE_STORE_QUOTA_BYTES, variant_sizes=IMAGE_VARIANT_SIZES):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.variant_sizes = dict(variant_sizes)
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key, variant):
+        if not is_valid_image_key(key) or variant not in self.variant_sizes:
+            raise ValueError(f"无效的图片 key 或尺寸：{key!r} {variant!r}")
+        return os.path.join(self.directory, key[:2], f"{key}-{variant}.webp")
+
+    def has(self, key):
+        return is_valid_image_key(key) and all(os.path.exists(self.path_for(key, variant)) for variant in self.variant_sizes)
+
+    def get(self, key, variant=IMAGE_DISPLAY_VARIANT):
+        if not is_valid_image_key(key) or variant not in self.variant_sizes:
+            return None
+        path = self.path_for(key, variant)
+        try:
+            with open(path, "rb") as image_file:
+                image_bytes = image_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return image_bytes
+
+    def put(self, key, original_bytes):
+        with span("image_transcode", original_bytes=len(original_bytes)) as transcode:
+            variants = transcode_image(original_bytes, self.variant_sizes)
+            transcode.set(output_bytes=sum(len(image_bytes) for image_bytes in variants.values()))
+        for variant, image_bytes in variants.items():
+            path = self.path_for(key, variant)
+            temp_path = None
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # 先写临时文件再原子替换，并发读取时不会读到半张图
+                file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(file_descriptor, "wb") as temp_file:
+                    temp_file.write(image_bytes)
+                os.replace(temp_path, path)
+            except OSError as exc:
+                # 磁盘写满、没有权限等写入失败也按图片失败处理，并清掉写了一半的临时文件
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise RuntimeError("图片保存失败，请稍后重试。") from exc
+        self.enforce_quota()
+        return key
+
+    def get_or_create(
+        self,
+        image_prompt,
+        api_key=None,
+        source_url=None,
+        generate=generate_siliconflow_image_url,
+        download=download_image_bytes,
+        endpoint=SILICONFLOW_IMAGE_URL,
+        style_prefix=SILICONFLOW_STYLE_PREFIX,
+    ):
+        key = build_siliconflow_image_key(image_prompt, style_prefix)
+        if self.has(key):
+            return key
+
+        def create():
+            image_url = source_url
+            if image_url is None:
+                if api_key is None:
+                    raise RuntimeError("图片库中没有该图腾，且未配置 SILICONFLOW_API_KEY。")
+                image_url = generate(image_prompt, api_key, url=endpoint, style_prefix=style_prefix)
+            return self.put(key, download(image_url))
+
+        # 同一张图的并发请求合并成一次生成和下载
+        return self._flights.do(key, create)
+
+    def enforce_quota(self):
+        with self._lock:
+            groups = {}
+            for path, mtime, size in self._iter_files():
+                key = os.path.basename(path).split("-", 1)[0]
+                last_used, total_size, paths = groups.get(key, (0.0, 0, []))
+                groups[key] = (max(last_used, mtime), total_size + size, paths + [path])
+
+            usage = sum(total_size for _, total_size, _ in groups.values())
+            for key, (_, total_size, paths) in sorted(groups.items(), key=lambda item: item[1][0]):
+                if usage <= self.quota_bytes:
+                    break
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                usage -= total_size
+
+    def _iter_files(self):
+        for root, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith(".webp"):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
@@ -0,0 +1,241 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# 各阶段耗时直方图的桶边界（秒）：覆盖从本地解析的毫秒级到模型调用的几十秒
+STAGE_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+METRICS_LOGGER = logging.getLogger("soul_animal.metrics")
+
+_current_trace = contextvars.ContextVar("soul_animal_trace", default=None)
+
+
+class Span:
+    def __init__(self, stage, provider=None, model=None, attributes=None):
+        self.stage = stage
+        self.provider = provider
+        self.model = model
+        self.status = "ok"
+        self.attributes = dict(attributes or {})
+        self.started_at = time.time()
+        self.duration_seconds = None
+
+    def set(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "provider": self.provider,
+            "model": self.model,
+            "status": self.status,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round(self.duration_seconds * 1000, 2),
+            **self.attributes,
+        }
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    return ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels)
+
+
+# 进程级指标：按 (阶段, provider, 模型, 状态) 聚合耗时直方图，另外累计重试次数、请求/响应字节数和 token 用量。
+# 只在内存里做加法，导出时才格式化成 Prometheus 文本。
+class MetricsRegistry:
+    def __init__(self, buckets=STAGE_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._retries = {}
+        self._payload_bytes = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        labels = (span.stage, span.provider or "", span.model or "", span.status)
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if span.duration_seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += span.duration_seconds
+            histogram["count"] += 1
+
+            stage_labels = labels[:3]
+            if span.attributes.get("retries"):
+                self._retries[stage_labels] = self._retries.get(stage_labels, 0) + span.attributes["retries"]
+            for direction in ("request", "response"):
+                size = span.attributes.get(f"{direction}_bytes")
+                if size:
+                    key = stage_labels + (direction,)
+                    self._payload_bytes[key] = self._payload_bytes.get(key, 0) + size
+            for direction in ("input", "output"):
+                count = span.attributes.get(f"{direction}_tokens")
+                if count:
+                    key = stage_labels + (direction,)
+                    self._tokens[key] = self._tokens.get(key, 0) + count
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP soul_animal_stage_seconds 生成链路各阶段耗时",
+            "# TYPE soul_animal_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (stage, provider, model, status), histogram in sorted(self._histograms.items()):
+                base_labels = [("stage", stage), ("provider", provider), ("model", model), ("status", status)]
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f"soul_animal_stage_seconds_bucket{{{format_labels(base_labels + [('le', bound)])}}} {count}")
+                lines.append(f"soul_animal_stage_seconds_bucket{{{format_labels(base_labels + [('le', '+Inf')])}}} {histogram['count']}")
+                lines.append(f"soul_animal_stage_seconds_sum{{{format_labels(base_labels)}}} {histogram['sum']:.6f}")
+                lines.append(f"soul_animal_stage_seconds_count{{{format_labels(base_labels)}}} {histogram['count']}")
+
+            lines += [
+                "# HELP soul_animal_stage_retries_total provider 请求的 HTTP 重试次数",
+                "# TYPE soul_animal_stage_retries_total counter",
+            ]
+            for (stage, provider, model), count in sorted(self._retries.items()):
+                labels = format_labels([("stage", stage), ("provider", provider), ("model", model)])
+                lines.append(f"soul_animal_stage_retries_total{{{labels}}} {count}")
+
+            lines += [
+                "# HELP soul_animal_stage_payload_bytes_total provider 请求和响应的字节数",
+                "# TYPE soul_animal_stage_payload_bytes_total counter",
+            ]
+            for (stage, provider, model, direction), size in sorted(self._payload_bytes.items()):
+                labels = format_labels([("stage", stage), ("provider", provider), ("model", model), ("direction", direction)])
+                lines.append(f"soul_animal_stage_payload_bytes_total{{{labels}}} {size}")
+
+            lines += [
+                "# HELP soul_animal_stage_tokens_total provider 返回的输入/输出 token 用量",
+                "# TYPE soul_animal_stage_tokens_total counter",
+            ]
+            for (stage, provider, model, direction), count in sorted(self._tokens.items()):
+                labels = format_labels([("stage", stage), ("provider", provider), ("model", model), ("direction", direction)])
+                lines.append(f"soul_animal_stage_tokens_total{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # 原子替换，node_exporter 的 textfile collector 不会读到写了一半的文件
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as temp_file:
+            temp_file.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+    def summary(self):
+        stages = {}
+        with self._lock:
+            for (stage, _, _, status), histogram in self._histograms.items():
+                entry = stages.setdefault(stage, {"count": 0, "errors": 0, "total_seconds": 0.0})
+                entry["count"] += histogram["count"]
+                entry["total_seconds"] += histogram["sum"]
+                if status != "ok":
+                    entry["errors"] += histogram["count"]
+        return {
+            stage: {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "mean_seconds": round(entry["total_seconds"] / entry["count"], 4),
+            }
+            for stage, entry in sorted(stages.items())
+        }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._retries.clear()
+            self._payload_bytes.clear()
+            self._tokens.clear()
+
+
+_metrics_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return _metrics_registry
+
+
+@contextmanager
+def span(stage, provider=None, model=None, **attributes):
+    record = Span(stage, provider, model, attributes)
+    started_at = time.perf_counter()
+    try:
+        yield record
+    except BaseException as exc:
+        # GeneratorExit 是流式生成被提前关闭，不算失败
+        if not isinstance(exc, GeneratorExit):
+            record.status = "error"
+            record.set(error_type=type(exc).__name__)
+        raise
+    finally:
+        record.duration_seconds = time.perf_counter() - started_at
+        _metrics_registry.record(record)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append(record)
+        if METRICS_LOGGER.isEnabledFor(logging.INFO):
+            METRICS_LOGGER.info(json.dumps(record.to_dict(), ensure_ascii=False, default=str))
+
+
+@contextmanager
+def collect_spans():
+    # 收集当前上下文（含用 contextvars.copy_context 提交到线程池的任务）里的全部 span，用于单次请求的耗时分解
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def submit_in_context(executor, function, *args, **kwargs):
+    # 线程池不会自动继承 contextvars：带上当前上下文提交，后台任务的 span 才会归到发起它的请求
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+def count_response_retries(response):
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    history = getattr(retries, "history", None)
+    return len(history) if isinstance(history, tuple) else 0
+
+
+def measure_request_bytes(response):
+    body = getattr(getattr(response, "request", None), "body", None)
+    return len(body) if isinstance(body, (bytes, str)) else None
+
+
+def measure_response_bytes(response):
+    content = getattr(response, "content", None)
+    return len(content) if isinstance(content, bytes) else None
+
+
+def record_response(call, response):
+    call.set(
+        http_status=getattr(response, "status_code", None),
+        retries=count_response_retries(response),
+        request_bytes=measure_request_bytes(response),
+    )
+
+
+def configure_json_logging(stream=None, level=logging.INFO):
+    # 每个 span 输出一行 JSON，方便日志平台直接解析
+    if any(getattr(handler, "_soul_animal_json", False) for handler in METRICS_LOGGER.handlers):
+        return METRICS_LOGGER
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler._soul_animal_json = True
+    METRICS_LOGGER.addHandler(handler)
+    METRICS_LOGGER.setLevel(level)
+    METRICS_LOGGER.propagate = False
+    return METRICS_LOGGER
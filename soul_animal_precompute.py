@@ -0,0 +1,214 @@
+import argparse
+import itertools
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from soul_animal_cache import build_result_cache_key
+from soul_animal_helpers import (
+    DEFAULT_TEXT_MODEL_ID,
+    QUESTIONS,
+    SILICONFLOW_IMAGE_URL,
+    TEXT_MODEL_OPTIONS,
+    generate_siliconflow_image_url,
+    generate_soul_profile,
+    get_provider_name,
+    get_text_model_option,
+    load_secrets,
+)
+from soul_animal_images import IMAGE_STORE_DIR, ImageStore
+from soul_animal_prompts import PROMPT_TEMPLATES
+from soul_animal_store import PRECOMPUTED_RESULT_DB, ResultStore, serialize_cache_key
+from soul_animal_themes import DEFAULT_THEME_ID, THEME_PACKS, get_theme_pack
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TEXT_RPM = 60
+DEFAULT_IMAGE_RPM = 30
+
+
+def iter_answer_combinations(questions=QUESTIONS):
+    return itertools.product(*[question["options"] for question in questions])
+
+
+# 按固定间隔放行请求，保证单个 provider 的请求速率不超过 requests_per_minute
+class RateLimiter:
+    def __init__(self, requests_per_minute, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = self._clock()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.interval
+        delay = start_at - now
+        if delay > 0:
+            self._sleep(delay)
+
+
+def precompute_one(
+    store,
+    cache_key,
+    text_model,
+    secrets,
+    text_limiter,
+    image_limiter=None,
+    image_endpoint=SILICONFLOW_IMAGE_URL,
+    image_store=None,
+    theme_id=DEFAULT_THEME_ID,
+):
+    theme = get_theme_pack(theme_id)
+    answers_key, _, prompt_version = cache_key
+    existing = store.get(cache_key)
+    if existing is None:
+        text_limiter.wait()
+        try:
+            data = generate_soul_profile(
+                text_model, secrets[text_model["secret_name"]], answers_key, prompt_version, stats_axes=theme.stats_axes
+            )
+        except (RuntimeError, ValueError) as exc:
+            store.save_failure(cache_key, str(exc))
+            return "failed"
+        store.save_result(cache_key, data)
+    else:
+        data = existing["data"]
+
+    if image_limiter is None:
+        return "ok"
+
+    image_limiter.wait()
+    try:
+        image_url = generate_siliconflow_image_url(
+            data["image_prompt"], secrets["SILICONFLOW_API_KEY"], url=image_endpoint, style_prefix=theme.image_style_prefix
+        )
+        # provider 链接会过期：同时下载进本地图片库，应用直接读取本地文件
+        if image_store is not None:
+            image_store.get_or_create(data["image_prompt"], source_url=image_url, style_prefix=theme.image_style_prefix)
+    except RuntimeError:
+        store.save_result(cache_key, data)
+        return "image_failed"
+    store.save_result(cache_key, data, image_url)
+    return "ok"
+
+
+def run_precompute(
+    store,
+    text_models,
+    secrets,
+    include_images=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    text_rpm=DEFAULT_TEXT_RPM,
+    image_rpm=DEFAULT_IMAGE_RPM,
+    image_endpoint=SILICONFLOW_IMAGE_URL,
+    limit=None,
+    log=print,
+    image_store=None,
+    prompt_version=None,
+    theme_id=DEFAULT_THEME_ID,
+):
+    theme = get_theme_pack(theme_id)
+    prompt_version = theme.check_prompt_version(prompt_version or theme.default_prompt_version)
+    for text_model in text_models.values():
+        if text_model["secret_name"] not in secrets:
+            raise ValueError(f"缺少 {text_model['secret_name']}，无法预计算 {text_model['label']}。")
+    if include_images and "SILICONFLOW_API_KEY" not in secrets:
+        raise ValueError("缺少 SILICONFLOW_API_KEY，无法预生成图片。")
+
+    completed = store.completed_keys(require_image=include_images)
+    pending = []
+    total = 0
+    for text_model_id in text_models:
+        for answers_key in iter_answer_combinations(theme.questions):
+            cache_key = build_result_cache_key(answers_key, text_model_id, prompt_version)
+            total += 1
+            if serialize_cache_key(cache_key) not in completed:
+                pending.append((cache_key, text_models[text_model_id]))
+    if limit is not None:
+        pending = pending[:limit]
+
+    text_limiters = {}
+    for text_model in text_models.values():
+        text_limiters.setdefault(get_provider_name(text_model), RateLimiter(text_rpm))
+    image_limiter = RateLimiter(image_rpm) if include_images else None
+
+    summary = {"total": total, "skipped": total - len(pending), "ok": 0, "failed": 0, "image_failed": 0}
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                precompute_one,
+                store,
+                cache_key,
+                text_model,
+                secrets,
+                text_limiters[get_provider_name(text_model)],
+                image_limiter,
+                image_endpoint,
+                image_store,
+                theme_id,
+            )
+            for cache_key, text_model in pending
+        ]
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            summary[future.result()] += 1
+            if log is not None and (done_count % 10 == 0 or done_count == len(futures)):
+                log(f"[{done_count}/{len(futures)}] 成功 {summary['ok']}，失败 {summary['failed']}，图片失败 {summary['image_failed']}")
+
+    elapsed = time.monotonic() - started_at
+    summary["elapsed_seconds"] = round(elapsed, 3)
+    summary["per_minute"] = round(len(pending) / elapsed * 60, 2) if elapsed > 0 else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="预计算全部答案组合的灵魂侧写，写入本地 SQLite 结果库。")
+    parser.add_argument("--model", action="append", choices=list(TEXT_MODEL_OPTIONS), help="文本模型，可重复指定")
+    parser.add_argument("--db", default=PRECOMPUTED_RESULT_DB, help="结果库路径")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="secrets.toml 路径，环境变量优先")
+    parser.add_argument("--images", action="store_true", help="同时预生成 SiliconFlow 图片")
+    parser.add_argument("--image-dir", default=IMAGE_STORE_DIR, help="本地图片库目录")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--text-rpm", type=float, default=DEFAULT_TEXT_RPM, help="每个文本 provider 每分钟请求上限")
+    parser.add_argument("--image-rpm", type=float, default=DEFAULT_IMAGE_RPM, help="SiliconFlow 每分钟请求上限")
+    parser.add_argument("--limit", type=int, help="本次最多处理的答案组合数量")
+    parser.add_argument("--theme", default=DEFAULT_THEME_ID, choices=list(THEME_PACKS), help="题目和 Prompt 所属的主题")
+    parser.add_argument("--prompt-version", default=None, choices=list(PROMPT_TEMPLATES), help="使用的 Prompt 模板版本，默认为主题的第一个版本")
+    args = parser.parse_args(argv)
+
+    model_ids = args.model or [DEFAULT_TEXT_MODEL_ID]
+    text_models = {model_id: get_text_model_option(model_id) for model_id in model_ids}
+    store = ResultStore(args.db)
+    try:
+        summary = run_precompute(
+            store,
+            text_models,
+            load_secrets(args.secrets),
+            include_images=args.images,
+            concurrency=args.concurrency,
+            text_rpm=args.text_rpm,
+            image_rpm=args.image_rpm,
+            limit=args.limit,
+            image_store=ImageStore(args.image_dir) if args.images else None,
+            prompt_version=args.prompt_version,
+            theme_id=args.theme,
+        )
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    finally:
+        store.close()
+
+    print(
+        f"共 {summary['total']} 个组合，跳过已完成 {summary['skipped']}，成功 {summary['ok']}，"
+        f"失败 {summary['failed']}，图片失败 {summary['image_failed']}，"
+        f"耗时 {summary['elapsed_seconds']}s，吞吐 {summary['per_minute']}/min"
+    )
+    return 1 if summary["failed"] or summary["image_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
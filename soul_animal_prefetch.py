@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from soul_animal_helpers import normalize_answers
+from soul_animal_metrics import submit_in_context
+from soul_animal_themes import DEFAULT_THEME_ID, get_theme_pack
+
+# 投机预取模式：off 关闭；selected 在最后一题选中后预取该答案组合；all 进入最后一页时预取全部候选组合
+PREFETCH_MODES = ["off", "selected", "all"]
+DEFAULT_PREFETCH_MODE = "selected"
+# 每个 session 最多发起的投机生成次数，排队中被取消的任务会退回额度
+PREFETCH_BUDGET_PER_SESSION = 3
+PREFETCH_WORKERS = 4
+# 投机任务单独一个小线程池：排队中的任务可以取消，也不会挤占正式请求和图片下载的线程
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="soul-prefetch")
+# 进程内最多保留的 session 预取器数和空闲时间；Streamlit 不通知 session 结束，超出后按最久未访问淘汰
+PREFETCHER_MAX_SESSIONS = 10_000
+PREFETCHER_IDLE_SECONDS = 30 * 60
+
+
+# 进程级预取统计：submitted 发起数、adopted 被结果页用上的数、unused 没用上（结果留在缓存里）的数、
+# cancelled 排队中被取消的数、over_budget 因超出额度被拒绝的数
+class PrefetchStats:
+    def __init__(self):
+        self._counts = {"submitted": 0, "adopted": 0, "unused": 0, "cancelled": 0, "over_budget": 0}
+        self._lock = threading.Lock()
+
+    def record(self, outcome, count=1):
+        with self._lock:
+            self._counts[outcome] += count
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self._counts)
+        finished = counts["adopted"] + counts["unused"]
+        counts["adoption_rate"] = round(counts["adopted"] / finished, 3) if finished else None
+        return counts
+
+    def reset(self):
+        with self._lock:
+            for outcome in self._counts:
+                self._counts[outcome] = 0
+
+
+_prefetch_stats = PrefetchStats()
+
+
+def get_prefetch_stats():
+    return _prefetch_stats
+
+
+def iter_prefetch_candidates(partial_answers, question):
+    # 最后一题的每个选项各组成一组完整答案
+    for option in question["options"]:
+        yield dict(partial_answers, **{question["id"]: option})
+
+
+# 单个 session 的投机预取：一个 session 只属于一个主题，记录已经发起的任务和已用额度。结果本身写进服务的共享缓存和图片库，
+# 结果页照常调用服务，已完成的直接命中缓存，进行中的通过请求合并等待同一个 provider 调用。
+class SpeculativePrefetcher:
+    def __init__(self, budget=PREFETCH_BUDGET_PER_SESSION, executor=PREFETCH_EXECUTOR, stats=None, theme_id=DEFAULT_THEME_ID):
+        self.theme_id = theme_id
+        self.questions = get_theme_pack(theme_id).questions
+        self.budget = budget
+        self.executor = executor
+        self.stats = stats if stats is not None else get_prefetch_stats()
+        self.used = 0
+        self._futures = {}
+
+    def prefetch(self, service, answers, text_model_id, visual_mode="none", routing_mode="single", prompt_version=None):
+        answers_key = normalize_answers(answers, self.questions)
+        job_key = (answers_key, text_model_id, visual_mode, routing_mode, prompt_version)
+        if job_key in self._futures:
+            return self._futures[job_key]
+        if self.used >= self.budget:
+            self.stats.record("over_budget")
+            return None
+        self.used += 1
+        future = submit_in_context(
+            self.executor,
+            service.prefetch,
+            answers_key,
+            text_model_id,
+            visual_mode,
+            routing_mode,
+            prompt_version,
+            self.theme_id,
+        )
+        self._futures[job_key] = future
+        self.stats.record("submitted")
+        return future
+
+    def cancel_others(self, answers):
+        # 只能取消还在排队的任务；已经开始的任务跑完后结果留在共享缓存里，之后同一答案组合仍可命中
+        answers_key = normalize_answers(answers, self.questions)
+        for job_key, future in list(self._futures.items()):
+            if job_key[0] != answers_key and future.cancel():
+                del self._futures[job_key]
+                self.used -= 1
+                self.stats.record("cancelled")
+
+    def adopt(self, answers):
+        # 结果页开始生成前调用：返回该答案组合的预取任务（没有则为 None），其余任务计为未使用
+        answers_key = normalize_answers(answers, self.questions)
+        adopted = None
+        for job_key, future in self._futures.items():
+            if job_key[0] == answers_key and adopted is None:
+                adopted = future
+            else:
+                self.stats.record("unused")
+        self._futures.clear()
+        if adopted is not None:
+            self.stats.record("adopted")
+        return adopted
+
+
+# 进程级预取器注册表：每个 session 的预取器按 session ID 存在这里，session_state 里只留 session ID。
+# 被淘汰的预取器不会取消已经提交的任务，结果照常留在共享缓存里
+class PrefetcherRegistry:
+    def __init__(self, max_sessions=PREFETCHER_MAX_SESSIONS, idle_seconds=PREFETCHER_IDLE_SECONDS, clock=time.monotonic):
+        if max_sessions <= 0:
+            raise ValueError("预取器数量上限必须大于 0。")
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, session_id, factory):
+        # 没有该 session 的预取器（或已被淘汰）时调用 factory() 新建一个
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.pop(session_id, None)
+            while self._entries:
+                oldest_id, (_, last_used) = next(iter(self._entries.items()))
+                if now - last_used < self.idle_seconds and len(self._entries) < self.max_sessions:
+                    break
+                del self._entries[oldest_id]
+            prefetcher = entry[0] if entry is not None and now - entry[1] < self.idle_seconds else factory()
+            self._entries[session_id] = (prefetcher, now)
+            return prefetcher
+
+
+_prefetcher_registry = PrefetcherRegistry()
+
+
+def get_prefetcher_registry():
+    return _prefetcher_registry
@@ -0,0 +1,161 @@
+import hashlib
+import string
+import threading
+
+DEFAULT_PROMPT_VERSION = "ethereal-v1"
+# A/B 分流权重：按版本号给权重，0 表示不参与分流。secrets 中的 PROMPT_AB_WEIGHTS 可以覆盖
+PROMPT_AB_WEIGHTS = {"ethereal-v1": 1.0, "ethereal-compact-v1": 0.0}
+
+
+def compact_prompt_text(text):
+    # 去掉每行的缩进和空行：模板写在代码里时的缩进不再作为 token 发给模型
+    return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+
+# 预编译模板：导入时就完成空白压缩并拆成字面量 + 占位符片段，每次渲染只做字符串拼接。
+# 修改模板内容时新增一个版本号，旧版本的缓存结果会自然失效。
+class PromptTemplate:
+    def __init__(self, version, text):
+        self.version = version
+        self.text = compact_prompt_text(text)
+        self._parts = []
+        self.fields = []
+        for literal, field_name, _, _ in string.Formatter().parse(self.text):
+            if literal:
+                self._parts.append((literal, None))
+            if field_name is not None:
+                if not field_name:
+                    raise ValueError(f"Prompt 模板 {version} 不能使用匿名占位符。")
+                self._parts.append((None, field_name))
+                self.fields.append(field_name)
+
+    def render(self, **values):
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise ValueError(f"Prompt 模板 {self.version} 缺少参数：{', '.join(missing)}")
+        return "".join(literal if field is None else str(values[field]) for literal, field in self._parts)
+
+
+PROMPT_TEMPLATES = {
+    "ethereal-v1": PromptTemplate(
+        "ethereal-v1",
+        """
+        你是一位洞察人心的神秘学导师。根据用户的选择：{user_profile}
+        请输出纯 JSON 数据，不要Markdown标记。必须包含：
+        1. "animal": 动物名 (如：星光雪豹、水晶琉璃鹿、机械智者猫头鹰，名字要带有神性或空灵感)。
+        2. "keywords": [3个短词，体现智性、空灵或力量]。
+        3. "quote": 一句极具诗意与哲理的引言。
+        4. "analysis": 150字侧写。犀利地指出他的孤独与防备，但最终给予肯定和治愈（例如：你的冷漠其实是保护内心的火种）。
+        5. "mask": 社交面具（他如何应对外界）。
+        6. "shadow": 真实本性（他内心的柔软或高傲）。
+        7. "stats": {{"独立性": int, "洞察力": int, "边界感": int, "精神力": int, "共情力": int, "掌控欲": int}} (数值0-100)。
+        8. "image_prompt": 一段用于 FLUX 模型的英文提示词，描述这只动物。风格要求：Ethereal fantasy, majestic, highly detailed, luminous, glowing crystal elements, cinematic lighting, Studio Ghibli meets Tarot card art, masterpiece, 8k.
+        """,
+    ),
+    # 精简版：字段说明压缩成一行一个，侧写缩短到 80 字，image_prompt 限制在 40 个英文单词以内，用来和原版对比延迟和校验通过率
+    "ethereal-compact-v1": PromptTemplate(
+        "ethereal-compact-v1",
+        """
+        你是洞察人心的神秘学导师。用户的选择：{user_profile}
+        只输出 JSON：
+        animal：带神性或空灵感的动物名
+        keywords：3个短词
+        quote：一句诗意引言
+        analysis：80字侧写，点出孤独与防备，最后给予肯定和治愈
+        mask：社交面具
+        shadow：真实本性
+        stats：独立性/洞察力/边界感/精神力/共情力/掌控欲，各为0-100整数
+        image_prompt：不超过40词的英文 FLUX 提示词，ethereal fantasy, luminous crystal, cinematic lighting, tarot art
+        """,
+    ),
+    # 暗黑主题（soul-animal-dark）的 Prompt：毒舌风格、暗黑维度，图片提示词统一给 FLUX
+    "dark-v1": PromptTemplate(
+        "dark-v1",
+        """
+        你是一位暗黑心理学家。根据用户的选择：{user_profile}
+        请输出纯 JSON 数据，不要Markdown标记。必须包含以下字段：
+        1. "animal": 动物名 (如：深渊乌贼、发条猫头鹰)。
+        2. "keywords": [3个短词]。
+        3. "quote": 哲学引言。
+        4. "analysis": 150字毒舌分析。
+        5. "mask": 社交面具。
+        6. "shadow": 真实本性。
+        7. "stats": {{"毁灭欲": int, "掌控力": int, "孤独感": int, "理智": int, "伪装": int, "洞察力": int}} (数值0-100)。
+        8. "image_prompt": 一段用于 FLUX 模型的英文绘画提示词，描述这只动物，要求：Rococo Dark Fantasy style, ornate details, dramatic lighting, baroque elements, surrealism, 8k resolution.
+        """,
+    ),
+}
+
+
+def get_prompt_template(version=DEFAULT_PROMPT_VERSION):
+    template = PROMPT_TEMPLATES.get(version)
+    if template is None:
+        raise ValueError(f"未知 Prompt 版本：{version}")
+    return template
+
+
+def choose_prompt_version(assignment_key, weights=PROMPT_AB_WEIGHTS):
+    # 按 assignment_key 的哈希稳定分桶：同一个 session 或答案组合总是落在同一个版本
+    candidates = [(version, weight) for version, weight in weights.items() if weight > 0]
+    if not candidates:
+        return DEFAULT_PROMPT_VERSION
+    total = sum(weight for _, weight in candidates)
+    digest = hashlib.sha256(str(assignment_key).encode("utf-8")).digest()
+    point = int.from_bytes(digest[:8], "big") / 2**64 * total
+    for version, weight in candidates:
+        point -= weight
+        if point < 0:
+            return version
+    return candidates[-1][0]
+
+
+# 按 Prompt 版本累计请求数、校验结果、耗时和 token 用量，用于 A/B 对比
+class PromptStats:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, version, repair_path, duration_seconds, usage=None):
+        usage = usage or {}
+        with self._lock:
+            entry = self._stats.setdefault(
+                version,
+                {"requests": 0, "strict": 0, "repaired": 0, "failed": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "usage_reports": 0},
+            )
+            entry["requests"] += 1
+            if repair_path == "strict":
+                entry["strict"] += 1
+            elif repair_path == "failed":
+                entry["failed"] += 1
+            else:
+                entry["repaired"] += 1
+            entry["seconds"] += duration_seconds
+            if "input_tokens" in usage or "output_tokens" in usage:
+                entry["usage_reports"] += 1
+                entry["input_tokens"] += usage.get("input_tokens", 0)
+                entry["output_tokens"] += usage.get("output_tokens", 0)
+
+    def summary(self):
+        with self._lock:
+            return {
+                version: {
+                    "requests": entry["requests"],
+                    "strict_pass_rate": round(entry["strict"] / entry["requests"], 3),
+                    "pass_rate": round((entry["requests"] - entry["failed"]) / entry["requests"], 3),
+                    "mean_seconds": round(entry["seconds"] / entry["requests"], 3),
+                    "mean_input_tokens": round(entry["input_tokens"] / entry["usage_reports"], 1) if entry["usage_reports"] else None,
+                    "mean_output_tokens": round(entry["output_tokens"] / entry["usage_reports"], 1) if entry["usage_reports"] else None,
+                }
+                for version, entry in sorted(self._stats.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+_prompt_stats = PromptStats()
+
+
+def get_prompt_stats():
+    return _prompt_stats
@@ -0,0 +1,204 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from soul_animal_helpers import TEXT_MODEL_OPTIONS, generate_soul_profile, get_text_model_option
+from soul_animal_metrics import span, submit_in_context
+from soul_animal_scheduler import ProviderOverloadedError
+
+HEDGE_AFTER_SECONDS = 8.0
+HEDGE_MAX_IN_FLIGHT = 2
+ROUTING_EXECUTOR_WORKERS = 16
+# 级联模式：先用便宜快速的模型，在较短的超时内拿不到通过校验的结果再升级到更强的模型
+CASCADE_FAST_MODEL_IDS = ["openai_gpt_5_4_mini", "gemini_2_5_flash"]
+CASCADE_PREMIUM_MODEL_IDS = ["openai_gpt_5_5", "xai_grok_4_3"]
+CASCADE_FAST_TIMEOUT_SECONDS = 15.0
+
+# 进程级线程池：对冲请求和故障转移请求都在这里执行，落败的请求跑完后结果直接丢弃
+ROUTING_EXECUTOR = ThreadPoolExecutor(max_workers=ROUTING_EXECUTOR_WORKERS, thread_name_prefix="text-route")
+
+
+def raise_all_failed(errors, all_overloaded):
+    # 每个候选都被准入控制拒绝或熔断时抛 ProviderOverloadedError，调用方可以和单模型一样回退到过期缓存
+    message = "所有文本模型均请求失败。" + "；".join(errors)
+    if all_overloaded:
+        raise ProviderOverloadedError(message)
+    raise RuntimeError(message)
+
+
+def build_failover_order(primary_model_id, secrets):
+    # 首选模型在前，其余已配置密钥的模型按 TEXT_MODEL_OPTIONS 顺序作为备份
+    model_ids = [primary_model_id] + [model_id for model_id in TEXT_MODEL_OPTIONS if model_id != primary_model_id]
+    return [model_id for model_id in model_ids if get_text_model_option(model_id)["secret_name"] in secrets]
+
+
+def generate_soul_profile_hedged(
+    model_ids,
+    secrets,
+    answers_key,
+    hedge_after_seconds=HEDGE_AFTER_SECONDS,
+    max_in_flight=HEDGE_MAX_IN_FLIGHT,
+    generate=generate_soul_profile,
+    executor=ROUTING_EXECUTOR,
+):
+    if not model_ids:
+        raise ValueError("没有已配置密钥的文本模型。")
+
+    in_flight = {}
+    errors = []
+    all_overloaded = True
+    next_index = 0
+
+    def launch():
+        nonlocal next_index
+        model_id = model_ids[next_index]
+        next_index += 1
+        text_model = get_text_model_option(model_id)
+        future = submit_in_context(executor, generate, text_model, secrets[text_model["secret_name"]], answers_key)
+        in_flight[future] = model_id
+
+    launch()
+    while in_flight:
+        can_hedge = next_index < len(model_ids) and len(in_flight) < max_in_flight
+        done, _ = wait(list(in_flight), timeout=hedge_after_seconds if can_hedge else None, return_when=FIRST_COMPLETED)
+        if not done:
+            # 首选模型在阈值内没有返回：向下一个模型发出对冲请求，两者谁先通过校验用谁
+            launch()
+            continue
+        for future in done:
+            model_id = in_flight.pop(future)
+            try:
+                profile = future.result()
+            except (RuntimeError, ValueError) as exc:
+                errors.append(f"{get_text_model_option(model_id)['label']}：{exc}")
+                all_overloaded = all_overloaded and isinstance(exc, ProviderOverloadedError)
+                # HTTP 错误、超时或校验失败：立即转移到下一个模型
+                if next_index < len(model_ids):
+                    launch()
+                continue
+            for loser in in_flight:
+                loser.cancel()
+            return model_id, profile
+
+    raise_all_failed(errors, all_overloaded)
+
+
+def build_cascade_order(selected_model_id, secrets):
+    # 所选模型是快速档时从它开始，升级到第一个已配置的强模型；所选模型是强模型时，它就是最后一档
+    configured = [model_id for model_id in TEXT_MODEL_OPTIONS if get_text_model_option(model_id)["secret_name"] in secrets]
+    if selected_model_id in CASCADE_FAST_MODEL_IDS:
+        fast = selected_model_id
+        premium = next((model_id for model_id in CASCADE_PREMIUM_MODEL_IDS if model_id in configured), None)
+    else:
+        fast = next((model_id for model_id in CASCADE_FAST_MODEL_IDS if model_id in configured), None)
+        premium = selected_model_id
+    return [model_id for model_id in (fast, premium) if model_id in configured]
+
+
+# 级联统计：每档的尝试次数、结果（ok / timeout / invalid / error）和平均耗时，以及最终由哪一档返回
+class CascadeStats:
+    def __init__(self):
+        self._tiers = {}
+        self._served_by = {}
+        self._requests = 0
+        self._lock = threading.Lock()
+
+    def record_attempt(self, model_id, outcome, duration_seconds):
+        with self._lock:
+            tier = self._tiers.setdefault(
+                model_id, {"attempts": 0, "ok": 0, "timeout": 0, "invalid": 0, "error": 0, "seconds": 0.0}
+            )
+            tier["attempts"] += 1
+            tier[outcome] += 1
+            tier["seconds"] += duration_seconds
+
+    def record_request(self, tier_index):
+        # tier_index 为 None 表示所有档都失败
+        served_by = "failed" if tier_index is None else str(tier_index)
+        with self._lock:
+            self._requests += 1
+            self._served_by[served_by] = self._served_by.get(served_by, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            first_tier = self._served_by.get("0", 0)
+            return {
+                "requests": self._requests,
+                "escalation_rate": round(1 - first_tier / self._requests, 3) if self._requests else None,
+                "served_by_tier": dict(sorted(self._served_by.items())),
+                "tiers": {
+                    model_id: dict(
+                        {key: value for key, value in tier.items() if key != "seconds"},
+                        mean_seconds=round(tier["seconds"] / tier["attempts"], 3),
+                    )
+                    for model_id, tier in self._tiers.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._tiers.clear()
+            self._served_by.clear()
+            self._requests = 0
+
+
+_cascade_stats = CascadeStats()
+
+
+def get_cascade_stats():
+    return _cascade_stats
+
+
+def generate_soul_profile_cascade(
+    model_ids,
+    secrets,
+    answers_key,
+    fast_timeout_seconds=CASCADE_FAST_TIMEOUT_SECONDS,
+    generate=generate_soul_profile,
+    executor=ROUTING_EXECUTOR,
+    stats=None,
+):
+    if not model_ids:
+        raise ValueError("没有已配置密钥的文本模型。")
+    stats = stats if stats is not None else _cascade_stats
+
+    errors = []
+    all_overloaded = True
+    for tier_index, model_id in enumerate(model_ids):
+        text_model = get_text_model_option(model_id)
+        api_key = secrets[text_model["secret_name"]]
+        is_last_tier = tier_index == len(model_ids) - 1
+        started_at = time.monotonic()
+        with span("cascade_tier", model=model_id, tier=tier_index) as attempt:
+            try:
+                if is_last_tier:
+                    profile = generate(text_model, api_key, answers_key)
+                else:
+                    # 快速档不做“修 JSON”追加请求：校验失败直接升级，比多一次串行调用更快。
+                    # 超时后不再等待：还在排队的请求直接取消，已经开始的跑完后结果丢弃
+                    fast_model = dict(text_model, timeout_seconds=fast_timeout_seconds)
+                    future = submit_in_context(executor, generate, fast_model, api_key, answers_key, followup_repair=False)
+                    profile = future.result(timeout=fast_timeout_seconds)
+            except FutureTimeoutError:
+                future.cancel()
+                outcome = "timeout"
+                errors.append(f"{text_model['label']}：超过 {fast_timeout_seconds:g} 秒未返回")
+            except ValueError as exc:
+                outcome = "invalid"
+                errors.append(f"{text_model['label']}：{exc}")
+            except RuntimeError as exc:
+                outcome = "error"
+                errors.append(f"{text_model['label']}：{exc}")
+                all_overloaded = all_overloaded and isinstance(exc, ProviderOverloadedError)
+            else:
+                outcome = "ok"
+            attempt.set(outcome=outcome)
+        all_overloaded = all_overloaded and outcome == "error"
+        stats.record_attempt(model_id, outcome, time.monotonic() - started_at)
+        if outcome == "ok":
+            stats.record_request(tier_index)
+            return model_id, profile
+
+    stats.record_request(None)
+    raise_all_failed(errors, all_overloaded)
@@ -0,0 +1,167 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from soul_animal_metrics import span
+
+# 每个 provider 的速率上限：rpm 为每分钟请求数，tpm 为每分钟 token 数（None 表示不限制）
+PROVIDER_RATE_LIMITS = {
+    "gemini": {"rpm": 60, "tpm": 1_000_000},
+    "api.openai.com": {"rpm": 500, "tpm": 200_000},
+    "api.x.ai": {"rpm": 60, "tpm": 100_000},
+    "api.siliconflow.cn": {"rpm": 60, "tpm": None},
+}
+MAX_IN_FLIGHT_PER_PROVIDER = 16
+ADMISSION_DEADLINE_SECONDS = 20.0
+INITIAL_LATENCY_ESTIMATE_SECONDS = 8.0
+
+
+class ProviderOverloadedError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._clock = clock
+        self._updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def delay_for(self, amount):
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def reserve(self, amount):
+        # 允许 token 变成负数：相当于预约了未来的额度，后来的请求会看到更长的等待
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class ProviderState:
+    def __init__(self, limits, clock):
+        self.request_bucket = TokenBucket(limits["rpm"], clock) if limits.get("rpm") else None
+        self.token_bucket = TokenBucket(limits["tpm"], clock) if limits.get("tpm") else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.average_latency = INITIAL_LATENCY_ESTIMATE_SECONDS
+
+    def rate_delay(self, tokens):
+        delays = [0.0]
+        if self.request_bucket is not None:
+            delays.append(self.request_bucket.delay_for(1))
+        if self.token_bucket is not None and tokens:
+            delays.append(self.token_bucket.delay_for(tokens))
+        return max(delays)
+
+    def reserve(self, tokens):
+        if self.request_bucket is not None:
+            self.request_bucket.reserve(1)
+        if self.token_bucket is not None and tokens:
+            self.token_bucket.reserve(tokens)
+
+    def refund(self, tokens):
+        if self.request_bucket is not None:
+            self.request_bucket.refund(1)
+        if self.token_bucket is not None and tokens:
+            self.token_bucket.refund(tokens)
+
+
+# 进程级准入控制：所有 session 的 provider 请求都经过这里。按 provider 做令牌桶限速和并发上限，
+# 超出时排队；预计等待超过截止时间的请求直接拒绝（ProviderOverloadedError），由调用方回退到缓存结果。
+class ProviderScheduler:
+    def __init__(
+        self,
+        limits=PROVIDER_RATE_LIMITS,
+        max_in_flight=MAX_IN_FLIGHT_PER_PROVIDER,
+        deadline_seconds=ADMISSION_DEADLINE_SECONDS,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.limits = {provider: dict(provider_limits) for provider, provider_limits in limits.items()}
+        self.max_in_flight = max_in_flight
+        self.deadline_seconds = deadline_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._states = {}
+        self._condition = threading.Condition()
+
+    def _state(self, provider):
+        state = self._states.get(provider)
+        if state is None:
+            state = ProviderState(self.limits.get(provider, {}), self._clock)
+            self._states[provider] = state
+        return state
+
+    def _estimate_wait(self, state, tokens):
+        queued_ahead = state.waiting + state.in_flight - self.max_in_flight + 1
+        slot_wait = max(0, queued_ahead) * state.average_latency / self.max_in_flight
+        return max(state.rate_delay(tokens), slot_wait)
+
+    def queue_status(self, provider, tokens=0):
+        with self._condition:
+            state = self._state(provider)
+            return {
+                "waiting": state.waiting,
+                "in_flight": state.in_flight,
+                "eta_seconds": round(self._estimate_wait(state, tokens), 1),
+            }
+
+    @contextmanager
+    def acquire(self, provider, tokens=0, deadline_seconds=None):
+        deadline_seconds = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        started_at = self._clock()
+        with span("admission_wait", provider):
+            with self._condition:
+                state = self._state(provider)
+                if self._estimate_wait(state, tokens) > deadline_seconds:
+                    raise ProviderOverloadedError(f"{provider} 当前排队过长，请稍后重试。")
+                rate_delay = state.rate_delay(tokens)
+                state.reserve(tokens)
+                state.waiting += 1
+
+            try:
+                if rate_delay > 0:
+                    self._sleep(rate_delay)
+                with self._condition:
+                    while state.in_flight >= self.max_in_flight:
+                        remaining = deadline_seconds - (self._clock() - started_at)
+                        if remaining <= 0:
+                            state.refund(tokens)
+                            raise ProviderOverloadedError(f"{provider} 当前排队过长，请稍后重试。")
+                        self._condition.wait(remaining)
+                    state.in_flight += 1
+            finally:
+                with self._condition:
+                    state.waiting -= 1
+
+        request_started_at = self._clock()
+        try:
+            yield
+        finally:
+            with self._condition:
+                state.in_flight -= 1
+                latency = self._clock() - request_started_at
+                state.average_latency = 0.8 * state.average_latency + 0.2 * latency
+                self._condition.notify()
+
+
+_provider_scheduler = ProviderScheduler()
+
+
+def get_provider_scheduler():
+    return _provider_scheduler
+
+
+def configure_provider_scheduler(**options):
+    global _provider_scheduler
+    _provider_scheduler = ProviderScheduler(**options)
+    return _provider_scheduler
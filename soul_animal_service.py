@@ -0,0 +1,528 @@
+import argparse
+import asyncio
+import functools
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from soul_animal_cache import RESULT_FLIGHTS, ResultCache, build_result_cache_key
+from soul_animal_helpers import (
+    DEFAULT_TEXT_MODEL_ID,
+    IMAGE_EXECUTOR,
+    IMAGE_WAIT_TIMEOUT_SECONDS,
+    SILICONFLOW_IMAGE_URL,
+    SILICONFLOW_MODEL,
+    TEXT_MODEL_OPTIONS,
+    build_seedance_video_prompt,
+    generate_soul_profile,
+    get_provider_name,
+    get_text_model_option,
+    load_secrets,
+    normalize_answers,
+    stream_soul_profile,
+)
+from soul_animal_health import CircuitOpenError, get_provider_health
+from soul_animal_images import (
+    IMAGE_DISPLAY_VARIANT,
+    IMAGE_STORE_DIR,
+    ImageStore,
+    build_siliconflow_image_key,
+    is_valid_image_key,
+)
+from soul_animal_metrics import configure_json_logging, get_metrics_registry, span, submit_in_context
+from soul_animal_prompts import PROMPT_AB_WEIGHTS, choose_prompt_version, get_prompt_template
+from soul_animal_routing import (
+    CASCADE_FAST_TIMEOUT_SECONDS,
+    HEDGE_AFTER_SECONDS,
+    build_cascade_order,
+    build_failover_order,
+    generate_soul_profile_cascade,
+    generate_soul_profile_hedged,
+)
+from soul_animal_scheduler import ProviderOverloadedError
+from soul_animal_store import PRECOMPUTED_RESULT_DB, SHARE_RESULT_DB, ShareStore, open_precomputed_store
+from soul_animal_themes import DEFAULT_THEME_ID, get_theme_pack
+
+VISUAL_OUTPUT_MODES = ["siliconflow_flux", "seedance_prompt", "none"]
+ROUTING_MODES = ["single", "hedged", "cascade"]
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_WORKERS = 8
+JOB_RETENTION_SECONDS = 15 * 60
+IMAGE_CIRCUIT_OPEN_NOTICE = "图片服务暂时不可用，本次先展示文字结果和 Seedance 视频 Prompt。"
+
+
+# 无界面的生成服务：缓存、预计算结果库、请求合并、路由和图片库都在这里串起来。
+# Streamlit 页面、HTTP 接口和 asyncio 调用方都只是它的客户端。
+class SoulResultService:
+    def __init__(
+        self,
+        secrets,
+        result_cache=None,
+        precomputed_store=None,
+        image_store=None,
+        hedge_after_seconds=HEDGE_AFTER_SECONDS,
+        text_models=None,
+        image_endpoint=SILICONFLOW_IMAGE_URL,
+        prompt_weights=PROMPT_AB_WEIGHTS,
+        cascade_fast_timeout_seconds=CASCADE_FAST_TIMEOUT_SECONDS,
+        share_store=None,
+    ):
+        self.secrets = dict(secrets)
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.precomputed_store = precomputed_store
+        self.image_store = image_store if image_store is not None else ImageStore(IMAGE_STORE_DIR)
+        self.hedge_after_seconds = hedge_after_seconds
+        # 压测和测试可以把模型的 base_url、图片接口指向本地假 provider
+        self.text_models = text_models or {}
+        self.image_endpoint = image_endpoint
+        # 传入的 A/B 权重只覆盖默认主题，其他主题使用主题包自带的权重
+        self.prompt_weights = dict(prompt_weights)
+        self.cascade_fast_timeout_seconds = cascade_fast_timeout_seconds
+        self.share_store = share_store
+        # 进行中的图片任务，按图片 key 记录；rerun、预取和其他 session 再次提交同一张图时直接返回它，不再占用图片线程
+        self._image_jobs = {}
+        self._image_jobs_lock = threading.Lock()
+
+    def get_text_model(self, text_model_id):
+        if text_model_id in self.text_models:
+            return self.text_models[text_model_id]
+        return get_text_model_option(text_model_id)
+
+    def is_text_model_available(self, text_model_id):
+        text_model = self.get_text_model(text_model_id)
+        return get_provider_health().is_available(get_provider_name(text_model), text_model["model"])
+
+    def find_fallback_model(self, text_model_id):
+        # 所选模型熔断时，按故障转移顺序找第一个已配置密钥且未熔断的模型
+        for model_id in build_failover_order(text_model_id, self.secrets)[1:]:
+            if self.is_text_model_available(model_id):
+                return model_id
+        return None
+
+    def is_image_provider_available(self):
+        return get_provider_health().is_available(urlparse(self.image_endpoint).hostname, SILICONFLOW_MODEL)
+
+    def get_prompt_weights(self, theme):
+        return self.prompt_weights if theme.theme_id == DEFAULT_THEME_ID else theme.prompt_weights
+
+    def _produce_profile(self, answers_key, text_model_id, routing_mode, on_field, prompt_version, theme):
+        if routing_mode == "hedged":
+            model_id, profile = generate_soul_profile_hedged(
+                build_failover_order(text_model_id, self.secrets),
+                self.secrets,
+                answers_key,
+                hedge_after_seconds=self.hedge_after_seconds,
+                generate=functools.partial(generate_soul_profile, prompt_version=prompt_version, stats_axes=theme.stats_axes),
+            )
+        elif routing_mode == "cascade":
+            model_id, profile = generate_soul_profile_cascade(
+                build_cascade_order(text_model_id, self.secrets),
+                self.secrets,
+                answers_key,
+                fast_timeout_seconds=self.cascade_fast_timeout_seconds,
+                generate=functools.partial(generate_soul_profile, prompt_version=prompt_version, stats_axes=theme.stats_axes),
+            )
+        else:
+            text_model = self.get_text_model(text_model_id)
+            if text_model["secret_name"] not in self.secrets:
+                raise ValueError(f"缺少 {text_model['secret_name']}，请先在 secrets 中配置。")
+            api_key = self.secrets[text_model["secret_name"]]
+            model_id = text_model_id
+            if on_field is None:
+                profile = generate_soul_profile(text_model, api_key, answers_key, prompt_version, stats_axes=theme.stats_axes)
+            else:
+                profile = stream_soul_profile(
+                    text_model, api_key, answers_key, on_field, prompt_version, stats_axes=theme.stats_axes
+                )
+        # 按实际返回结果的模型写缓存：对冲、级联换了模型时，结果不能冒充所选模型的缓存
+        self.result_cache.put(build_result_cache_key(answers_key, model_id, prompt_version), profile)
+        return model_id, profile
+
+    def generate_profile(
+        self,
+        answers,
+        text_model_id,
+        use_cache=True,
+        on_field=None,
+        routing_mode="single",
+        prompt_version=None,
+        theme_id=DEFAULT_THEME_ID,
+    ):
+        with span("generate_profile", model=text_model_id, routing_mode=routing_mode, theme=theme_id) as generate:
+            result = self._generate_profile(
+                answers, text_model_id, use_cache, on_field, routing_mode, prompt_version, get_theme_pack(theme_id)
+            )
+            generate.set(source=result["source"], prompt_version=result["prompt_version"])
+        return result
+
+    def _generate_profile(self, answers, text_model_id, use_cache, on_field, routing_mode, prompt_version, theme):
+        answers_key = normalize_answers(answers, theme.questions)
+        self.get_text_model(text_model_id)
+        if routing_mode not in ROUTING_MODES:
+            raise ValueError(f"未知路由模式：{routing_mode}")
+        # 调用方没有指定版本时按答案组合稳定分流，同一组合总是命中同一份缓存
+        if prompt_version is None:
+            prompt_version = choose_prompt_version("\n".join(answers_key), self.get_prompt_weights(theme))
+        get_prompt_template(theme.check_prompt_version(prompt_version))
+
+        result = {
+            "key": answers_key,
+            "text_model_id": text_model_id,
+            "data": None,
+            "source_image_url": None,
+            "notice": None,
+            "source": "provider",
+            "prompt_version": prompt_version,
+        }
+        cache_key = build_result_cache_key(answers_key, text_model_id, prompt_version)
+        precomputed = self.precomputed_store.get(cache_key) if use_cache and self.precomputed_store is not None else None
+        if precomputed is not None:
+            result["data"] = precomputed["data"]
+            result["source_image_url"] = precomputed["image_url"]
+            result["source"] = "precomputed"
+            return result
+
+        if use_cache:
+            result["data"] = self.result_cache.get(cache_key)
+            if result["data"] is not None:
+                result["source"] = "cache"
+                return result
+
+        try:
+            # 相同答案组合 + 模型 + 路由模式的并发请求只调用一次 provider，其余调用方等待同一结果
+            result["text_model_id"], result["data"] = RESULT_FLIGHTS.do(
+                (cache_key, routing_mode),
+                lambda: self._produce_profile(answers_key, text_model_id, routing_mode, on_field, prompt_version, theme),
+            )
+        except ProviderOverloadedError as exc:
+            # 被准入控制拒绝或所选模型熔断（对冲、级联模式下是所有候选模型都如此）：
+            # 有同一答案组合的缓存结果（即使已过期）就先返回它
+            result["data"] = self.result_cache.peek(cache_key)
+            if result["data"] is not None:
+                result["source"] = "stale_cache"
+                result["notice"] = "当前访问人数较多，先为你展示同一答案组合的历史结果。"
+                return result
+            # 没有缓存时，熔断的单模型请求改用其他健康的模型；对冲和级联模式自己会转移到下一个模型
+            fallback_model_id = self.find_fallback_model(text_model_id) if isinstance(exc, CircuitOpenError) else None
+            if routing_mode != "single" or fallback_model_id is None:
+                raise
+            result = self._generate_profile(
+                answers_key, fallback_model_id, use_cache, on_field, routing_mode, prompt_version, theme
+            )
+            result["notice"] = (
+                f"{self.get_text_model(text_model_id)['label']} 暂时不可用，"
+                f"本次改用 {self.get_text_model(fallback_model_id)['label']} 生成。"
+            )
+        return result
+
+    def find_image(self, profile, theme_id=DEFAULT_THEME_ID):
+        image_key = build_siliconflow_image_key(profile["image_prompt"], get_theme_pack(theme_id).image_style_prefix)
+        return image_key if self.image_store.has(image_key) else None
+
+    def submit_image(self, profile, source_image_url=None, theme_id=DEFAULT_THEME_ID):
+        # 图片库里没有且既无预计算链接也无密钥时返回 None，调用方只展示文字结果
+        if not source_image_url and "SILICONFLOW_API_KEY" not in self.secrets:
+            return None
+        style_prefix = get_theme_pack(theme_id).image_style_prefix
+        image_key = build_siliconflow_image_key(profile["image_prompt"], style_prefix)
+        with self._image_jobs_lock:
+            future = self._image_jobs.get(image_key)
+            if future is not None:
+                return future
+            future = submit_in_context(
+                IMAGE_EXECUTOR,
+                self.image_store.get_or_create,
+                profile["image_prompt"],
+                self.secrets.get("SILICONFLOW_API_KEY"),
+                source_url=source_image_url,
+                endpoint=self.image_endpoint,
+                style_prefix=style_prefix,
+            )
+            self._image_jobs[image_key] = future
+        # 完成后移除：成功的图片已进图片库，由 find_image 命中；失败的允许下次重新提交
+        future.add_done_callback(lambda _: self._finish_image_job(image_key, future))
+        return future
+
+    def _finish_image_job(self, image_key, future):
+        with self._image_jobs_lock:
+            if self._image_jobs.get(image_key) is future:
+                del self._image_jobs[image_key]
+
+    def share_result(self, profile, image_key=None, text_model_id=None, prompt_version=None, theme_id=DEFAULT_THEME_ID):
+        # 没有配置分享结果库时返回 None，调用方不展示分享链接
+        if self.share_store is None:
+            return None
+        return self.share_store.save(profile, image_key, text_model_id, prompt_version, theme_id)
+
+    def get_shared_result(self, share_id):
+        # 分享链接只读结果库和图片库；图片已被图片库清理时只返回文字结果
+        shared = self.share_store.get(share_id) if self.share_store is not None else None
+        if shared is not None and shared["image_key"] and not self.image_store.has(shared["image_key"]):
+            shared["image_key"] = None
+        return shared
+
+    def prefetch(
+        self, answers, text_model_id, visual_mode="none", routing_mode="single", prompt_version=None, theme_id=DEFAULT_THEME_ID
+    ):
+        # 投机预取：结果写进共享缓存，图片交给图片库后台生成不等待。正式请求使用相同的缓存键和合并键，
+        # 预取已完成时命中缓存，仍在进行时等待同一个 provider 调用
+        with span("prefetch", model=text_model_id, routing_mode=routing_mode):
+            result = self.generate_profile(
+                answers, text_model_id, routing_mode=routing_mode, prompt_version=prompt_version, theme_id=theme_id
+            )
+            if visual_mode == "siliconflow_flux" and self.find_image(result["data"], theme_id) is None:
+                self.submit_image(result["data"], result["source_image_url"], theme_id)
+        return result
+
+    def generate(
+        self,
+        answers,
+        text_model_id,
+        visual_mode,
+        use_cache=True,
+        routing_mode="single",
+        prompt_version=None,
+        theme_id=DEFAULT_THEME_ID,
+    ):
+        if visual_mode not in VISUAL_OUTPUT_MODES:
+            raise ValueError(f"未知视觉输出：{visual_mode}")
+        result = self.generate_profile(
+            answers,
+            text_model_id,
+            use_cache=use_cache,
+            routing_mode=routing_mode,
+            prompt_version=prompt_version,
+            theme_id=theme_id,
+        )
+        output = {
+            "answers": list(result["key"]),
+            "text_model_id": result["text_model_id"],
+            "data": result["data"],
+            "notice": result["notice"],
+            "source": result["source"],
+            "prompt_version": result["prompt_version"],
+            "theme": theme_id,
+            "image_key": None,
+            "image_error": None,
+            "seedance_prompt": None,
+            "share_id": None,
+        }
+        if visual_mode == "seedance_prompt":
+            output["seedance_prompt"] = build_seedance_video_prompt(result["data"])
+        elif visual_mode == "siliconflow_flux":
+            output["image_key"] = self.find_image(result["data"], theme_id)
+            future = None
+            if output["image_key"] is None and not result["source_image_url"] and not self.is_image_provider_available():
+                # 图片 provider 熔断中：不排队等它失败，直接降级为文字结果 + Seedance 视频 Prompt
+                output["image_error"] = IMAGE_CIRCUIT_OPEN_NOTICE
+                output["seedance_prompt"] = build_seedance_video_prompt(result["data"])
+            elif output["image_key"] is None:
+                future = self.submit_image(result["data"], result["source_image_url"], theme_id)
+            if future is not None:
+                try:
+                    output["image_key"] = future.result(timeout=IMAGE_WAIT_TIMEOUT_SECONDS)
+                except Exception as exc:
+                    output["image_error"] = str(exc) or "图腾渲染超时。"
+        output["share_id"] = self.share_result(
+            result["data"], output["image_key"], output["text_model_id"], output["prompt_version"], theme_id
+        )
+        return output
+
+
+async def generate_soul_result(answers, model_id, visual_mode, service=None, **options):
+    service = service if service is not None else get_default_service()
+    return await asyncio.to_thread(service.generate, answers, model_id, visual_mode, **options)
+
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+
+def get_default_service():
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = SoulResultService(load_secrets(), precomputed_store=open_precomputed_store())
+        return _default_service
+
+
+# 内存中的任务表：提交后立即返回 job_id，由工作线程池执行，客户端轮询结果。已完成的任务保留一段时间后清理。
+class JobRunner:
+    def __init__(self, service, workers=SERVICE_WORKERS, retention_seconds=JOB_RETENTION_SECONDS, clock=time.monotonic):
+        self.service = service
+        self.retention_seconds = retention_seconds
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="soul-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, answers, model_id=DEFAULT_TEXT_MODEL_ID, visual_mode="none", routing_mode="single", theme_id=DEFAULT_THEME_ID):
+        # 提交时就校验参数，非法请求直接返回 400，不占用工作线程
+        normalize_answers(answers, get_theme_pack(theme_id).questions)
+        self.service.get_text_model(model_id)
+        if visual_mode not in VISUAL_OUTPUT_MODES:
+            raise ValueError(f"未知视觉输出：{visual_mode}")
+        if routing_mode not in ROUTING_MODES:
+            raise ValueError(f"未知路由模式：{routing_mode}")
+
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = {"status": "queued", "result": None, "error": None, "finished_at": None}
+        self._executor.submit(self._run, job_id, answers, model_id, visual_mode, routing_mode, theme_id)
+        return job_id
+
+    def _run(self, job_id, answers, model_id, visual_mode, routing_mode, theme_id):
+        self._update(job_id, status="running")
+        try:
+            result = self.service.generate(answers, model_id, visual_mode, routing_mode=routing_mode, theme_id=theme_id)
+        except Exception as exc:
+            self._update(job_id, status="failed", error=str(exc), finished_at=self._clock())
+        else:
+            self._update(job_id, status="done", result=result, finished_at=self._clock())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        now = self._clock()
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else {key: value for key, value in job.items() if key != "finished_at"}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SoulServiceHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        encoded = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/v1/jobs":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            job_id = self.server.jobs.submit(
+                payload.get("answers"),
+                payload.get("model_id", DEFAULT_TEXT_MODEL_ID),
+                payload.get("visual_mode", "none"),
+                payload.get("routing_mode", "single"),
+                payload.get("theme", DEFAULT_THEME_ID),
+            )
+        except (ValueError, TypeError, AttributeError) as exc:
+            self._send_json(400, {"error": str(exc)})
+            return
+        self._send_json(202, {"job_id": job_id, "status": "queued"})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) == 3 and parts[:2] == ["v1", "jobs"]:
+            job = self.server.jobs.get(parts[2])
+            if job is None:
+                self._send_json(404, {"error": "job not found"})
+            else:
+                self._send_json(200, job)
+        elif len(parts) == 3 and parts[:2] == ["v1", "images"]:
+            # key 和尺寸都来自 URL，格式不对直接 404，不拼进文件路径
+            image_store = self.server.jobs.service.image_store
+            variant = parse_qs(parsed.query).get("variant", [IMAGE_DISPLAY_VARIANT])[0]
+            valid = is_valid_image_key(parts[2]) and variant in image_store.variant_sizes
+            image_bytes = image_store.get(parts[2], variant) if valid else None
+            if image_bytes is None:
+                self._send_json(404, {"error": "image not found"})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/webp")
+            self.send_header("Content-Length", str(len(image_bytes)))
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            self.end_headers()
+            self.wfile.write(image_bytes)
+        elif len(parts) == 3 and parts[:2] == ["v1", "shares"]:
+            shared = self.server.jobs.service.get_shared_result(parts[2])
+            if shared is None:
+                self._send_json(404, {"error": "share not found"})
+            else:
+                self._send_json(200, shared)
+        elif parsed.path == "/metrics":
+            encoded = get_metrics_registry().render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+        elif parsed.path == "/v1/health":
+            # 每个 provider/模型的熔断状态、错误率、耗时分位数和当前超时
+            self._send_json(200, get_provider_health().summary())
+        elif parsed.path == "/v1/models":
+            self._send_json(200, {model_id: option["label"] for model_id, option in TEXT_MODEL_OPTIONS.items()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_service_server(service, host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS):
+    server = ThreadingHTTPServer((host, port), SoulServiceHandler)
+    server.jobs = JobRunner(service, workers=workers)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="灵魂图腾无界面生成服务：提交任务并轮询结果。")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="生成工作线程数")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="secrets.toml 路径，环境变量优先")
+    parser.add_argument("--image-dir", default=IMAGE_STORE_DIR, help="本地图片库目录")
+    parser.add_argument("--db", default=PRECOMPUTED_RESULT_DB, help="预计算结果库路径")
+    parser.add_argument("--share-db", default=SHARE_RESULT_DB, help="分享结果库路径")
+    parser.add_argument("--json-log", action="store_true", help="每个耗时 span 输出一行 JSON 日志到标准错误")
+    args = parser.parse_args(argv)
+
+    if args.json_log:
+        configure_json_logging()
+
+    service = SoulResultService(
+        load_secrets(args.secrets),
+        precomputed_store=open_precomputed_store(args.db),
+        image_store=ImageStore(args.image_dir),
+        share_store=ShareStore(args.share_db),
+    )
+    server = create_service_server(service, args.host, args.port, args.workers)
+    print(f"灵魂图腾生成服务已启动：http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.jobs.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
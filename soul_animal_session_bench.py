@@ -0,0 +1,170 @@
+import argparse
+import copy
+import gc
+import hashlib
+import itertools
+import json
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+from soul_animal_charts import render_radar_svg
+from soul_animal_fake_provider import FAKE_SOUL_PROFILE
+from soul_animal_helpers import QUESTIONS
+from soul_animal_metrics import Span
+from soul_animal_sessions import ResultArtifactStore, build_result_id, encode_answers
+
+DEFAULT_BENCH_SESSIONS = 10_000
+# 旧版 session 里每次生成保留的耗时 span，内存测量时按这些阶段模拟；阶段名与代码里 span() 的阶段名一致
+LEGACY_SPAN_STAGES = (
+    "prompt_build",
+    "admission_wait",
+    "provider_call",
+    "parse",
+    "generate_profile",
+    "chart",
+    "image_generate",
+    "image_download",
+    "image_transcode",
+)
+
+
+def build_bench_profiles(combinations):
+    # 每个答案组合一份不同的侧写，雷达图分数随组合变化
+    profiles = []
+    for index, answers_key in enumerate(combinations):
+        profile = copy.deepcopy(FAKE_SOUL_PROFILE)
+        profile["animal"] = f"{profile['animal']}·{index}"
+        profile["stats"] = {axis: (value + index * 7) % 101 for axis, value in profile["stats"].items()}
+        profiles.append(profile)
+    return profiles
+
+
+def build_legacy_session(answers_key, profile, text_model_id, prompt_version):
+    # 改造前的 session_state：选项文本、整份结果（侧写副本、雷达图、耗时 span）都留在每个 session 里
+    return {
+        "page": 4,
+        "answers": {question["id"]: answer for question, answer in zip(QUESTIONS, answers_key)},
+        "session_id": uuid.uuid4().hex,
+        "result": {
+            "key": answers_key,
+            "text_model_id": text_model_id,
+            "data": copy.deepcopy(profile),
+            "chart": render_radar_svg(profile["stats"]),
+            "image_key": hashlib.sha256(profile["image_prompt"].encode("utf-8")).hexdigest(),
+            "image_error": None,
+            "image_future": None,
+            "notice": None,
+            "error": None,
+            "spans": [Span(stage, "api.openai.com", "gpt-5.5", {"status_code": 200}) for stage in LEGACY_SPAN_STAGES],
+            "prompt_version": prompt_version,
+            "share_id": None,
+        },
+    }
+
+
+def build_compact_session(answers_key, profile, text_model_id, prompt_version, store):
+    # 改造后的 session_state：页码、答案下标和结果 ID；大对象进共享结果库，相同结果只存一份
+    result_id = build_result_id(answers_key, text_model_id, prompt_version, profile)
+    if result_id not in store:
+        store.put(
+            result_id,
+            {
+                "key": answers_key,
+                "text_model_id": text_model_id,
+                "prompt_version": prompt_version,
+                "data": copy.deepcopy(profile),
+                "chart": render_radar_svg(profile["stats"]),
+                "source_image_url": None,
+                "image_key": hashlib.sha256(profile["image_prompt"].encode("utf-8")).hexdigest(),
+                "shares": {},
+            },
+        )
+    return {
+        "page": 4,
+        "answers": {question["id"]: index for question, index in zip(QUESTIONS, encode_answers(answers_key))},
+        "session_id": uuid.uuid4().hex,
+        "result_id": result_id,
+        "result_notice": None,
+        "result_error": None,
+        "image_error": None,
+    }
+
+
+def measure_allocated_bytes(build):
+    # tracemalloc 统计 build() 分配且仍被引用的内存；返回值要一直持有到测量结束
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return allocated, kept
+
+
+def run_session_memory_bench(
+    sessions=DEFAULT_BENCH_SESSIONS, distinct_answers=243, text_model_id="gemini_2_5_flash", prompt_version="ethereal-v1", seed=0
+):
+    if sessions <= 0 or distinct_answers <= 0:
+        raise ValueError("session 数和答案组合数必须大于 0。")
+    rng = random.Random(seed)
+    combinations = list(itertools.product(*(question["options"] for question in QUESTIONS)))
+    combinations = rng.sample(combinations, min(distinct_answers, len(combinations)))
+    profiles = build_bench_profiles(combinations)
+    picks = [rng.randrange(len(combinations)) for _ in range(sessions)]
+    # 雷达图 SVG 在两种布局里都来自同一个记忆化缓存，先预热，不计入任何一方
+    for profile in profiles:
+        render_radar_svg(profile["stats"])
+
+    legacy_bytes, legacy_states = measure_allocated_bytes(
+        lambda: [build_legacy_session(combinations[pick], profiles[pick], text_model_id, prompt_version) for pick in picks]
+    )
+    del legacy_states
+
+    store = ResultArtifactStore()
+    compact_bytes, compact_states = measure_allocated_bytes(
+        lambda: [build_compact_session(combinations[pick], profiles[pick], text_model_id, prompt_version, store) for pick in picks]
+    )
+    store_stats = store.stats()
+    del compact_states
+
+    return {
+        "sessions": sessions,
+        "distinct_answers": len(combinations),
+        "legacy_bytes_per_session": round(legacy_bytes / sessions, 1),
+        "compact_bytes_per_session": round(compact_bytes / sessions, 1),
+        "compact_state_bytes_per_session": round((compact_bytes - store_stats["bytes"]) / sessions, 1),
+        "shared_store_entries": store_stats["entries"],
+        "shared_store_bytes": store_stats["bytes"],
+        "legacy_total_bytes": legacy_bytes,
+        "compact_total_bytes": compact_bytes,
+        "reduction": round(1 - compact_bytes / legacy_bytes, 3) if legacy_bytes else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量改造前后每个 session 占用的内存，输出 JSON 报告。")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_BENCH_SESSIONS, help="模拟的空闲 session 数")
+    parser.add_argument("--distinct-answers", type=int, default=243, help="参与抽样的答案组合数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="报告写入的 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    started_at = time.perf_counter()
+    report = run_session_memory_bench(args.sessions, args.distinct_answers, seed=args.seed)
+    report["total_seconds"] = round(time.perf_counter() - started_at, 3)
+    encoded = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(encoded + "\n")
+    else:
+        print(encoded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
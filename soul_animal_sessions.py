@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+from soul_animal_helpers import QUESTIONS, normalize_answers
+
+# 进程级结果库的容量上限（按估算的 Python 对象字节数），超出后按最近访问淘汰
+RESULT_ARTIFACT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def encode_answers(answers, questions=QUESTIONS):
+    # session 里只存选项下标；需要选项文本（拼 prompt、查缓存）时再用 normalize_answers 还原
+    return tuple(
+        question["options"].index(answer) for question, answer in zip(questions, normalize_answers(answers, questions))
+    )
+
+
+def build_result_id(answers_key, text_model_id, prompt_version, profile):
+    # 按内容寻址：不同 session 得到同一份结果时共用一个条目
+    payload = json.dumps(
+        [list(answers_key), text_model_id, prompt_version, profile], ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    digest = hashlib.sha256(payload.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest[:9]).decode("ascii")
+
+
+def deep_sizeof(value, seen=None):
+    # 递归估算对象占用的字节数，同一个对象只算一次
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += deep_sizeof(vars(value), seen)
+    return size
+
+
+# 进程级结果库：侧写、雷达图等大对象按结果 ID 存放一份，所有 session 共用，session_state 里只留结果 ID。
+# 按估算字节数限制容量，超出时淘汰最久未访问的条目；被淘汰的 session 下次渲染时重新走一遍结果缓存。
+# 返回的条目是共享对象，调用方只读，需要补充图片 key 等字段时通过 update 修改。
+class ResultArtifactStore:
+    def __init__(self, max_bytes=RESULT_ARTIFACT_MAX_BYTES):
+        if max_bytes <= 0:
+            raise ValueError("结果库容量必须大于 0。")
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, result_id):
+        with self._lock:
+            return result_id in self._entries
+
+    def _evict(self, keep_id):
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            result_id = next(iter(self._entries))
+            if result_id == keep_id:
+                self._entries.move_to_end(result_id)
+                continue
+            _, size = self._entries.pop(result_id)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def put(self, result_id, artifact):
+        # 已经存在时保留原条目并返回它：相同结果只存一份
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                entry = (artifact, deep_sizeof(artifact))
+                self._entries[result_id] = entry
+                self.total_bytes += entry[1]
+            self._entries.move_to_end(result_id)
+            self._evict(result_id)
+            return entry[0]
+
+    def get(self, result_id):
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(result_id)
+            self.hits += 1
+            return entry[0]
+
+    def update(self, result_id, **fields):
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                return None
+            artifact, size = entry
+            artifact.update(fields)
+            new_size = deep_sizeof(artifact)
+            self._entries[result_id] = (artifact, new_size)
+            self.total_bytes += new_size - size
+            self._evict(result_id)
+            return artifact
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,119 @@
+import argparse
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# 只在结果页才需要的重量级依赖：题目页渲染前不应加载它们
+HEAVY_MODULES = ("plotly.graph_objects", "google.generativeai", "PIL.Image")
+DEFAULT_STARTUP_RUNS = 5
+STARTUP_TIMEOUT_SECONDS = 120
+
+_prewarm_started = set()
+_prewarm_lock = threading.Lock()
+
+
+def import_optional(module_name):
+    # 依赖没有安装时跳过：预热只是优化，真正用到时再报错
+    try:
+        importlib.import_module(module_name)
+    except ImportError:
+        return False
+    return True
+
+
+def prewarm_modules(module_names):
+    # 进程内每个模块只预热一次；在后台线程里导入，用户答题期间把导入耗时藏起来
+    with _prewarm_lock:
+        pending = [module_name for module_name in module_names if module_name not in _prewarm_started]
+        _prewarm_started.update(pending)
+    if not pending:
+        return None
+    thread = threading.Thread(target=lambda: [import_optional(module_name) for module_name in pending], name="soul-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+# 在全新的子进程里测量冷启动：有 Streamlit 时用 AppTest 跑一遍 app.py 直到第一页渲染完成；
+# 没有 Streamlit 时只测应用依赖的本地模块的导入时间。同时记录首屏渲染后已经加载了哪些重量级依赖。
+STARTUP_PROBE = """
+import json, sys, time
+started_at = time.perf_counter()
+mode = sys.argv[1]
+error = None
+if mode == "apptest":
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(sys.argv[2], default_timeout=60)
+    app.run()
+    if app.exception:
+        error = str(app.exception[0].message)
+else:
+    import soul_animal_service
+elapsed = time.perf_counter() - started_at
+heavy = json.loads(sys.argv[3])
+print(json.dumps({"seconds": elapsed, "loaded": [name for name in heavy if name in sys.modules], "error": error}))
+"""
+
+
+def detect_startup_mode():
+    try:
+        importlib.import_module("streamlit.testing.v1")
+    except ImportError:
+        return "imports"
+    return "apptest"
+
+
+def run_startup_probe(mode, app_path="app.py", python=sys.executable):
+    completed = subprocess.run(
+        [python, "-c", STARTUP_PROBE, mode, app_path, json.dumps(HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        timeout=STARTUP_TIMEOUT_SECONDS,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"冷启动测量进程失败：{completed.stderr.strip()[-500:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_startup_bench(runs=DEFAULT_STARTUP_RUNS, mode=None, app_path="app.py"):
+    if runs <= 0:
+        raise ValueError("runs 必须大于 0。")
+    mode = mode or detect_startup_mode()
+    samples = [run_startup_probe(mode, app_path) for _ in range(runs)]
+    seconds = [sample["seconds"] for sample in samples]
+    return {
+        "mode": mode,
+        "runs": runs,
+        "median_seconds": round(statistics.median(seconds), 4),
+        "min_seconds": round(min(seconds), 4),
+        "max_seconds": round(max(seconds), 4),
+        "heavy_modules_loaded": sorted({name for sample in samples for name in sample["loaded"]}),
+        "errors": [sample["error"] for sample in samples if sample["error"]],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量冷进程首屏渲染时间，输出 JSON 报告。")
+    parser.add_argument("--runs", type=int, default=DEFAULT_STARTUP_RUNS, help="冷启动次数，每次都是新的 Python 进程")
+    parser.add_argument("--mode", choices=["apptest", "imports"], default=None, help="默认有 Streamlit 时用 apptest")
+    parser.add_argument("--app", default="app.py", help="apptest 模式下运行的脚本")
+    parser.add_argument("--output", default=None, help="报告写入的 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    started_at = time.perf_counter()
+    report = run_startup_bench(args.runs, args.mode, args.app)
+    report["total_seconds"] = round(time.perf_counter() - started_at, 3)
+    encoded = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(encoded + "\n")
+    else:
+        print(encoded)
+    return 1 if report["heavy_modules_loaded"] or report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
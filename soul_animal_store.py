@@ -0,0 +1,182 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PRECOMPUTED_RESULT_DB = "precomputed_results.sqlite3"
+SHARE_RESULT_DB = "shared_results.sqlite3"
+# 热门分享链接直接从内存返回，不再查 SQLite
+SHARE_CACHE_SIZE = 1024
+SHARE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{12}$")
+
+
+def serialize_cache_key(cache_key):
+    answers_key, text_model_id, prompt_version = cache_key
+    return json.dumps([list(answers_key), text_model_id, prompt_version], ensure_ascii=False)
+
+
+# 本地 SQLite 结果库：预计算脚本写入，应用按 cache key 直接读取，不再请求模型
+class ResultStore:
+    def __init__(self, path=PRECOMPUTED_RESULT_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                cache_key TEXT PRIMARY KEY,
+                text_model_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                status TEXT NOT NULL,
+                profile TEXT,
+                image_url TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, cache_key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT profile, image_url FROM results WHERE cache_key = ? AND status = 'ok'",
+                (serialize_cache_key(cache_key),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"data": json.loads(row[0]), "image_url": row[1]}
+
+    def completed_keys(self, require_image=False):
+        query = "SELECT cache_key FROM results WHERE status = 'ok'"
+        if require_image:
+            query += " AND image_url IS NOT NULL"
+        with self._lock:
+            rows = self._connection.execute(query).fetchall()
+        return {row[0] for row in rows}
+
+    def save_result(self, cache_key, profile, image_url=None):
+        self._save(cache_key, "ok", json.dumps(profile, ensure_ascii=False), image_url, None)
+
+    def save_failure(self, cache_key, error):
+        self._save(cache_key, "failed", None, None, error)
+
+    def _save(self, cache_key, status, profile, image_url, error):
+        _, text_model_id, prompt_version = cache_key
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT INTO results (cache_key, text_model_id, prompt_version, status, profile, image_url, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    status = excluded.status,
+                    profile = excluded.profile,
+                    image_url = excluded.image_url,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+                """,
+                (serialize_cache_key(cache_key), text_model_id, prompt_version, status, profile, image_url, error, time.time()),
+            )
+            self._connection.commit()
+
+
+def build_share_id(profile, image_key=None):
+    # 按内容寻址：同一份结果重复分享得到同一个 ID；取摘要前 9 字节，编码成 12 个 URL 安全字符
+    payload = json.dumps([profile, image_key], ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(payload.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest[:9]).decode("ascii")
+
+
+# 分享结果库：校验通过的结果和图片库中的图片 key 按短 ID 保存，打开分享链接时直接读取，不调用任何 provider。
+# 按主键查询，前面再挡一层进程内 LRU，单个链接被大量打开时只有第一次会读 SQLite。
+class ShareStore:
+    def __init__(self, path=SHARE_RESULT_DB, cache_size=SHARE_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shared_results (
+                share_id TEXT PRIMARY KEY,
+                profile TEXT NOT NULL,
+                image_key TEXT,
+                text_model_id TEXT,
+                prompt_version TEXT,
+                created_at REAL NOT NULL,
+                theme_id TEXT
+            ) WITHOUT ROWID
+            """
+        )
+        # 旧版库没有 theme_id 列：补上这一列，旧记录的主题为 NULL
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(shared_results)")}
+        if "theme_id" not in columns:
+            self._connection.execute("ALTER TABLE shared_results ADD COLUMN theme_id TEXT")
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def save(self, profile, image_key=None, text_model_id=None, prompt_version=None, theme_id=None):
+        # 主题决定雷达图维度、配色和文案，打开分享链接时按它渲染
+        share_id = build_share_id(profile, image_key)
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT OR IGNORE INTO shared_results (share_id, profile, image_key, text_model_id, prompt_version, created_at, theme_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (share_id, json.dumps(profile, ensure_ascii=False), image_key, text_model_id, prompt_version, time.time(), theme_id),
+            )
+            self._connection.commit()
+        return share_id
+
+    def get(self, share_id):
+        # 格式不对的 ID 直接返回 None，不查库
+        if not isinstance(share_id, str) or not SHARE_ID_PATTERN.match(share_id):
+            return None
+        with self._lock:
+            shared = self._cache.get(share_id)
+            if shared is not None:
+                self._cache.move_to_end(share_id)
+                return dict(shared)
+            row = self._connection.execute(
+                "SELECT profile, image_key, text_model_id, prompt_version, created_at, theme_id FROM shared_results WHERE share_id = ?",
+                (share_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            shared = {
+                "share_id": share_id,
+                "data": json.loads(row[0]),
+                "image_key": row[1],
+                "text_model_id": row[2],
+                "prompt_version": row[3],
+                "created_at": row[4],
+                "theme_id": row[5],
+            }
+            self._cache[share_id] = shared
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(shared)
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM shared_results").fetchone()[0]
+
+
+def open_precomputed_store(path=PRECOMPUTED_RESULT_DB):
+    # 结果库不存在时返回 None，调用方完全走实时生成
+    return ResultStore(path) if os.path.exists(path) else None
@@ -0,0 +1,212 @@
+from soul_animal_helpers import QUESTIONS, SILICONFLOW_STYLE_PREFIX, SOUL_STATS_AXES
+from soul_animal_prompts import PROMPT_AB_WEIGHTS, PROMPT_TEMPLATES
+
+DEFAULT_THEME_ID = "ethereal"
+
+ETHEREAL_CSS = """
+<style>
+    /* 全局背景与字体 - 偏向深邃空灵 */
+    .stApp { background-color: #080b12; color: #e6e9f0; font-family: -apple-system, BlinkMacSystemFont, sans-serif; }
+    h1, h2, h3 { color: #E5C07B; text-align: center; font-weight: 300; letter-spacing: 2px; }
+
+    /* 进度条样式 */
+    .stProgress > div > div > div > div { background-color: #E5C07B; }
+
+    /* 单选题优化：扩大点击热区，适合手机盲按 */
+    .stRadio > label { font-size: 1.1rem !important; color: #abb2bf; margin-bottom: 10px; }
+    div[role="radiogroup"] > label {
+        padding: 15px;
+        background: rgba(255,255,255,0.03);
+        border-radius: 10px;
+        border: 1px solid rgba(255,255,255,0.05);
+        margin-bottom: 10px;
+    }
+    div[role="radiogroup"] > label > div:first-of-type { background-color: #E5C07B !important; }
+
+    /* 按钮样式：大圆角，防误触 */
+    .stButton > button {
+        width: 100%; background: linear-gradient(135deg, #E5C07B, #D4AF37);
+        color: #1e1e1e; font-weight: bold; border: none; padding: 15px;
+        border-radius: 25px; font-size: 1.1em; letter-spacing: 1px;
+        box-shadow: 0 4px 15px rgba(229, 192, 123, 0.2);
+        margin-top: 20px;
+    }
+
+    /* 结果卡片 */
+    .result-container {
+        background: linear-gradient(180deg, rgba(30,34,42,0.8) 0%, rgba(15,17,21,0.9) 100%);
+        padding: 25px; border-radius: 20px; text-align: center;
+        margin-top: 20px; border: 1px solid rgba(229,192,123,0.2);
+        box-shadow: 0 10px 30px rgba(0,0,0,0.5);
+    }
+    .tag {
+        background: rgba(229, 192, 123, 0.1); border: 1px solid #E5C07B;
+        color: #E5C07B; padding: 5px 15px; border-radius: 20px;
+        font-size: 0.85rem; margin: 4px; display: inline-block;
+    }
+    .stImage > img {border: 2px solid #E5C07B; border-radius: 15px;}
+</style>
+"""
+
+DARK_CSS = """
+<style>
+    .stApp { background-color: #000000; color: #e0e0e0; }
+    h1 {
+        font-family: 'Didot', serif; color: #D4AF37; text-align: center;
+        text-shadow: 0 0 15px rgba(212, 175, 55, 0.5);
+    }
+    h2, h3 { color: #D4AF37; text-align: center; font-family: 'Didot', serif; }
+    .stProgress > div > div > div > div { background-color: #D4AF37; }
+    .stRadio > label { color: #ccc; font-size: 1.05em; }
+    div[role="radiogroup"] > label > div:first-of-type {
+        background-color: #D4AF37 !important;
+    }
+    .stButton > button {
+        width: 100%; background: linear-gradient(45deg, #D4AF37, #FDC830);
+        color: #000; font-weight: 900; border: none; padding: 18px;
+        border-radius: 8px; font-size: 1.2em; letter-spacing: 2px;
+        box-shadow: 0 0 20px rgba(212, 175, 55, 0.2);
+    }
+    .result-container {
+        border: 1px solid #333;
+        background: radial-gradient(circle at center, #1a1a1a 0%, #000000 100%);
+        padding: 30px; border-radius: 15px; text-align: center;
+        margin-top: 30px; border-top: 3px solid #D4AF37;
+    }
+    .tag {
+        background: rgba(212, 175, 55, 0.15); border: 1px solid #D4AF37;
+        color: #D4AF37; padding: 4px 12px; border-radius: 20px;
+        font-size: 0.8em; margin: 0 5px; display: inline-block;
+    }
+    .stImage > img {border: 3px solid #D4AF37; border-radius: 10px; box-shadow: 0 0 30px rgba(212, 175, 55, 0.3);}
+</style>
+"""
+
+DARK_QUESTIONS = [
+    {"id": "q1", "q": "1. 暴风雨夜，全世界电力切断。作为幸存者，你的第一反应是？",
+     "options": ["A. 建立绝对防御圈（生存优先）", "B. 组建互助联盟（社交优先）", "C. 记录这一切混乱（观察者）"]},
+    {"id": "q2", "q": "2. 在名利场晚宴上，最让你感到不适的是？",
+     "options": ["A. 低效的寒暄（厌恶低效）", "B. 满场的虚伪（厌恶谎言）", "C. 无人关注（渴望聚光灯）"]},
+    {"id": "q3", "q": "3. 必须获得一种禁忌能力，你选择？",
+     "options": ["A. 读心术：洞察一切谎言", "B. 预知未来：绝对正确的决策", "C. 隐形：随心所欲的自由"]},
+    {"id": "q4", "q": "4. 面对愚蠢权威的发号施令，你会？",
+     "options": ["A. 当面处刑，指出逻辑漏洞", "B. 表面顺从，幕后操纵走向", "C. 转身离开，不与傻瓜论长短"]},
+    {"id": "q5", "q": "5. 你认为世界的本质是？",
+     "options": ["A. 弱肉强食的狩猎场", "B. 精密冰冷的数据程序", "C. 一场荒诞好笑的戏剧"]},
+]
+
+
+# 主题包：题目、分页、Prompt 版本、雷达图维度、图片风格前缀、CSS 和页面文案。
+# 生成链路只按主题取参数，新增主题不需要新的调用路径。每个 Prompt 版本只属于一个主题，结果缓存键不用再带主题。
+class ThemePack:
+    def __init__(
+        self,
+        theme_id,
+        questions,
+        pages,
+        prompt_weights,
+        stats_axes,
+        image_style_prefix,
+        css,
+        radar_style,
+        copy,
+        colors,
+    ):
+        unknown_versions = [version for version in prompt_weights if version not in PROMPT_TEMPLATES]
+        if unknown_versions:
+            raise ValueError(f"主题 {theme_id} 使用了未知 Prompt 版本：{', '.join(unknown_versions)}")
+        self.theme_id = theme_id
+        self.questions = questions
+        # 每页的标题和题目下标，最后一页提交后进入结果页
+        self.pages = pages
+        self.prompt_weights = dict(prompt_weights)
+        self.stats_axes = list(stats_axes)
+        self.image_style_prefix = image_style_prefix
+        self.css = css
+        self.radar_style = radar_style
+        self.copy = dict(copy)
+        self.colors = dict(colors)
+
+    @property
+    def prompt_versions(self):
+        return list(self.prompt_weights)
+
+    @property
+    def default_prompt_version(self):
+        return next(iter(self.prompt_weights))
+
+    def check_prompt_version(self, prompt_version):
+        if prompt_version not in self.prompt_weights:
+            raise ValueError(f"Prompt 版本 {prompt_version} 不属于主题 {self.theme_id}。")
+        return prompt_version
+
+
+THEME_PACKS = {
+    "ethereal": ThemePack(
+        "ethereal",
+        questions=QUESTIONS,
+        pages=[("Part 1: 本能与社交", [0, 1]), ("Part 2: 欲望与边界", [2, 3]), ("Part 3: 世界观", [4])],
+        prompt_weights=PROMPT_AB_WEIGHTS,
+        stats_axes=SOUL_STATS_AXES,
+        image_style_prefix=SILICONFLOW_STYLE_PREFIX,
+        css=ETHEREAL_CSS,
+        radar_style="ethereal",
+        copy={
+            "page_title": "灵魂潜行",
+            "page_icon": "✨",
+            "title": "✨ 灵魂显影测试",
+            "subtitle": "测一测你内在的真实图腾",
+            "submit": "🔮 生成图腾",
+            "spinner": "正在通过星界连接你的潜意识...",
+            "image_caption": "你的灵魂图腾 (长按保存)",
+            "mask": "🛡️ <b>表象面具：</b>",
+            "shadow": "✨ <b>真实内核：</b>",
+        },
+        colors={
+            "accent": "#E5C07B",
+            "muted": "#7f848e",
+            "quote": "#abb2bf",
+            "body": "#d7dae0",
+            "label": "#abb2bf",
+            "value": "#e6e9f0",
+            "panel": "rgba(255,255,255,0.03)",
+        },
+    ),
+    "dark": ThemePack(
+        "dark",
+        questions=DARK_QUESTIONS,
+        pages=[("第一幕：生存本能", [0, 1]), ("第二幕：权力与谎言", [2, 3]), ("第三幕：世界真相", [4])],
+        prompt_weights={"dark-v1": 1.0},
+        stats_axes=["毁灭欲", "掌控力", "孤独感", "理智", "伪装", "洞察力"],
+        image_style_prefix="Dark fantasy masterpiece, Rococo Noir style",
+        css=DARK_CSS,
+        radar_style="dark",
+        copy={
+            "page_title": "内在野兽 Soul Animal",
+            "page_icon": "🕸️",
+            "title": "👁️ 你的灵魂囚禁在什么野兽体内？",
+            "subtitle": "A Rococo Basilisk Experiment",
+            "submit": "🔮 献祭选择，显形真身",
+            "spinner": "AI 正在重构你的灵魂数据...",
+            "image_caption": "你的 Rococo 灵魂图腾 (长按或右键保存)",
+            "mask": "🎭 <b>面具：</b>",
+            "shadow": "🌑 <b>本性：</b>",
+        },
+        colors={
+            "accent": "#D4AF37",
+            "muted": "#666",
+            "quote": "#888",
+            "body": "#ddd",
+            "label": "#e0e0e0",
+            "value": "#e0e0e0",
+            "panel": "#111",
+        },
+    ),
+}
+
+
+def get_theme_pack(theme_id=DEFAULT_THEME_ID):
+    theme = THEME_PACKS.get(theme_id)
+    if theme is None:
+        raise ValueError(f"未知主题：{theme_id}")
+    return theme
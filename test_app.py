@@ -1,16 +1,84 @@
+import asyncio
+import glob
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
 
 import requests
 
+from soul_animal_analytics import (
+    AnalyticsLog,
+    build_analytics_report,
+    classify_generation,
+    encode_answers_code,
+    open_analytics_reader,
+    query_answer_distribution,
+    query_failing_answers,
+    query_funnel,
+    query_image_outcomes,
+    query_model_usage,
+)
+from soul_animal_bench import percentile, run_bench
+from soul_animal_cache import ResultCache, SingleFlight, build_result_cache_key
+from soul_animal_charts import RADAR_STYLES, render_radar_chart, render_radar_svg
+from soul_animal_fake_provider import FakeProviderServer, sample_latency_seconds
+from soul_animal_health import CircuitOpenError, ProviderHealthRegistry, configure_provider_health
+from soul_animal_images import ImageStore, build_siliconflow_image_key
+from soul_animal_metrics import Span, collect_spans, get_metrics_registry, span
+from soul_animal_precompute import RateLimiter, iter_answer_combinations, run_precompute
+from soul_animal_prefetch import PrefetcherRegistry, PrefetchStats, SpeculativePrefetcher, iter_prefetch_candidates
+from soul_animal_prompts import choose_prompt_version, get_prompt_stats, get_prompt_template
+from soul_animal_routing import (
+    CascadeStats,
+    build_cascade_order,
+    build_failover_order,
+    generate_soul_profile_cascade,
+    generate_soul_profile_hedged,
+)
+from soul_animal_scheduler import ProviderOverloadedError, ProviderScheduler, TokenBucket
+from soul_animal_service import SoulResultService, create_service_server, generate_soul_result
+from soul_animal_session_bench import LEGACY_SPAN_STAGES, run_session_memory_bench
+from soul_animal_sessions import ResultArtifactStore, build_result_id, deep_sizeof, encode_answers
+from soul_animal_startup import import_optional, prewarm_modules, run_startup_bench
+from soul_animal_store import ResultStore, ShareStore, build_share_id
+from soul_animal_themes import THEME_PACKS, get_theme_pack
 from soul_animal_helpers import (
+    HTTP_POOL_MAXSIZE,
+    QUESTIONS,
     TEXT_MODEL_OPTIONS,
+    IncrementalJsonFieldParser,
+    ProfileValidationError,
+    build_gemini_generation_config,
+    build_gemini_response_schema,
+    build_openai_compatible_chat_payload,
+    build_soul_profile_json_schema,
+    build_answers_key,
     build_seedance_video_prompt,
+    configure_http_session,
     extract_json_payload,
     escape_profile_for_html,
     generate_openai_compatible_chat_text,
     generate_siliconflow_image_url,
+    generate_soul_profile,
+    get_http_session,
+    get_repair_counters,
     get_text_model_option,
+    load_secrets,
+    normalize_answers,
+    parse_gemini_usage,
+    parse_soul_profile_with_path,
+    repair_soul_profile,
+    stream_openai_compatible_chat_text,
+    stream_soul_profile,
     validate_soul_profile,
 )
 
@@ -28,6 +96,10 @@ VALID_PROFILE = {
 
 
 class SoulAnimalHelpersTest(unittest.TestCase):
+    def setUp(self):
+        # 各用例模拟的失败不能累积成熔断
+        configure_provider_health()
+
     def test_text_model_options_include_gemini_gpt_and_grok(self):
         self.assertEqual(TEXT_MODEL_OPTIONS["gemini_2_5_flash"]["secret_name"], "GEMINI_API_KEY")
         self.assertEqual(TEXT_MODEL_OPTIONS["openai_gpt_5_5"]["model"], "gpt-5.5")
@@ -39,6 +111,32 @@ class SoulAnimalHelpersTest(unittest.TestCase):
         with self.assertRaisesRegex(ValueError, "未知模型"):
             get_text_model_option("missing")
 
+    def test_build_answers_key_orders_by_question_id(self):
+        key = build_answers_key({"q2": "B", "q1": "A", "q3": "C"})
+
+        self.assertEqual(key, ("A", "B", "C"))
+
+    def test_load_secrets_prefers_environment(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "secrets.toml")
+            with open(path, "w", encoding="utf-8") as secrets_file:
+                secrets_file.write('OPENAI_API_KEY = "from-file"\nXAI_API_KEY = "xai"\n')
+
+            secrets = load_secrets(path, environ={"OPENAI_API_KEY": "from-env"})
+
+        self.assertEqual(secrets, {"OPENAI_API_KEY": "from-env", "XAI_API_KEY": "xai"})
+
+    def test_normalize_answers_accepts_text_indices_and_dicts(self):
+        answers = tuple(question["options"][1] for question in QUESTIONS)
+
+        self.assertEqual(normalize_answers([1, 1, 1, 1, 1]), answers)
+        self.assertEqual(normalize_answers(list(answers)), answers)
+        self.assertEqual(normalize_answers({question["id"]: answers[i] for i, question in enumerate(QUESTIONS)}), answers)
+        with self.assertRaisesRegex(ValueError, "q2"):
+            normalize_answers([0, 3, 0, 0, 0])
+        with self.assertRaisesRegex(ValueError, "5 道题"):
+            normalize_answers([0, 0])
+
     def test_extract_json_payload_rejects_extra_text(self):
         with self.assertRaisesRegex(ValueError, "额外内容"):
             extract_json_payload('{"animal": "雪豹"} trailing')
@@ -67,7 +165,83 @@ class SoulAnimalHelpersTest(unittest.TestCase):
         self.assertEqual(escaped["animal"], "&lt;script&gt;alert(1)&lt;/script&gt;")
         self.assertIn("&quot;&gt;&lt;img", escaped["keywords"][0])
 
-    @patch("soul_animal_helpers.requests.post")
+    def test_parse_soul_profile_counts_strict_path(self):
+        before = get_repair_counters().get("strict", 0)
+
+        profile, repair_path = parse_soul_profile_with_path(json.dumps(VALID_PROFILE, ensure_ascii=False))
+
+        self.assertEqual((profile["animal"], repair_path), ("星光雪豹", "strict"))
+        self.assertEqual(get_repair_counters()["strict"], before + 1)
+
+    def test_parse_soul_profile_repairs_locally(self):
+        payload = dict(VALID_PROFILE)
+        payload["keywords"] = ["#洞察", "边界", "柔软", "多余"]
+        payload["stats"] = {"独立性": 101, "洞察力": 87.6, "边界感": "95", "精神力": -3}
+        raw_text = "好的，这是结果：\n```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```\n希望你喜欢。"
+        before = get_repair_counters().get("local_repair", 0)
+
+        profile, repair_path = parse_soul_profile_with_path(raw_text)
+
+        self.assertEqual(repair_path, "local_repair")
+        self.assertEqual(profile["keywords"], ["洞察", "边界", "柔软"])
+        self.assertEqual(profile["stats"], {"独立性": 100, "洞察力": 88, "边界感": 95, "精神力": 0})
+        self.assertEqual(get_repair_counters()["local_repair"], before + 1)
+
+    def test_non_finite_stats_fail_validation_instead_of_crashing(self):
+        raw_text = json.dumps(VALID_PROFILE, ensure_ascii=False).replace('"独立性": 90', '"独立性": 1e999')
+        self.assertIn("1e999", raw_text)
+
+        with self.assertRaises(ValueError):
+            parse_soul_profile_with_path(raw_text)
+        with self.assertRaisesRegex(ValueError, "有限数值"):
+            repair_soul_profile(dict(VALID_PROFILE, stats=dict(VALID_PROFILE["stats"], 独立性="inf")))
+
+    def test_parse_soul_profile_uses_followup_fix_as_last_resort(self):
+        payload = dict(VALID_PROFILE, keywords=["洞察", "边界"])
+        fix_calls = []
+
+        def fix_json(raw_text, error_message):
+            fix_calls.append(error_message)
+            return json.dumps(VALID_PROFILE, ensure_ascii=False)
+
+        profile, repair_path = parse_soul_profile_with_path(json.dumps(payload, ensure_ascii=False), fix_json=fix_json)
+
+        self.assertEqual(repair_path, "followup_repair")
+        self.assertEqual(profile["keywords"], ["洞察", "边界", "柔软"])
+        self.assertEqual(len(fix_calls), 1)
+        self.assertIn("keywords", fix_calls[0])
+        with self.assertRaisesRegex(ValueError, "3 个短词"):
+            parse_soul_profile_with_path(json.dumps(payload, ensure_ascii=False))
+
+    def test_openai_payload_requests_json_schema_output(self):
+        schema = build_soul_profile_json_schema()
+
+        payload = build_openai_compatible_chat_payload("gpt-5.5", "prompt", response_schema=schema)
+
+        self.assertEqual(payload["response_format"]["type"], "json_schema")
+        self.assertEqual(payload["response_format"]["json_schema"]["schema"]["properties"]["stats"]["required"][0], "独立性")
+        self.assertNotIn("response_format", build_openai_compatible_chat_payload("gpt-5.5", "prompt"))
+
+    def test_gemini_response_schema_drops_unsupported_keywords(self):
+        schema = build_gemini_response_schema(build_soul_profile_json_schema())
+
+        self.assertNotIn("additionalProperties", schema)
+        self.assertNotIn("maximum", schema["properties"]["stats"]["properties"]["洞察力"])
+        self.assertEqual(schema["properties"]["keywords"]["items"], {"type": "string"})
+
+    @patch("soul_animal_helpers.requests.Session.post")
+    def test_generate_soul_profile_sends_schema_for_structured_models(self, post):
+        response = Mock()
+        response.json.return_value = {"choices": [{"message": {"content": json.dumps(VALID_PROFILE, ensure_ascii=False)}}]}
+        response.raise_for_status.return_value = None
+        post.return_value = response
+
+        profile = generate_soul_profile(TEXT_MODEL_OPTIONS["openai_gpt_5_5"], "secret", ("A",))
+
+        self.assertEqual(profile["animal"], "星光雪豹")
+        self.assertIn("response_format", post.call_args.kwargs["json"])
+
+    @patch("soul_animal_helpers.requests.Session.post")
     def test_generate_siliconflow_image_url_uses_timeout_and_validates_response(self, post):
         response = Mock()
         response.json.return_value = {"images": [{"url": "https://example.com/image.png"}]}
@@ -80,12 +254,12 @@ class SoulAnimalHelpersTest(unittest.TestCase):
         post.assert_called_once()
         self.assertEqual(post.call_args.kwargs["timeout"], 5)
 
-    @patch("soul_animal_helpers.requests.post", side_effect=requests.Timeout())
+    @patch("soul_animal_helpers.requests.Session.post", side_effect=requests.Timeout())
     def test_generate_siliconflow_image_url_reports_timeout(self, post):
         with self.assertRaisesRegex(RuntimeError, "超时"):
             generate_siliconflow_image_url("prompt", "secret", timeout=5)
 
-    @patch("soul_animal_helpers.requests.post")
+    @patch("soul_animal_helpers.requests.Session.post")
     def test_generate_openai_compatible_chat_text_posts_to_chat_completions(self, post):
         response = Mock()
         response.json.return_value = {"choices": [{"message": {"content": '{"animal": "星光雪豹"}'}}]}
@@ -105,7 +279,7 @@ class SoulAnimalHelpersTest(unittest.TestCase):
         self.assertEqual(post.call_args.kwargs["json"]["model"], "gpt-5.5")
         self.assertEqual(post.call_args.kwargs["timeout"], 7)
 
-    @patch("soul_animal_helpers.requests.post")
+    @patch("soul_animal_helpers.requests.Session.post")
     def test_generate_openai_compatible_chat_text_validates_choice_content(self, post):
         response = Mock()
         response.json.return_value = {"choices": []}
@@ -115,6 +289,70 @@ class SoulAnimalHelpersTest(unittest.TestCase):
         with self.assertRaisesRegex(RuntimeError, "文本内容"):
             generate_openai_compatible_chat_text("https://api.x.ai/v1", "grok-4.3", "secret", "prompt")
 
+    def test_incremental_json_field_parser_emits_completed_fields(self):
+        parser = IncrementalJsonFieldParser()
+        text = '```json\n{"animal": "雪豹, {夜}", "keywords": ["a", "b\\"c", "d"], "stats": {"x": 1}}\n```'
+
+        completed = []
+        for char in text:
+            completed.extend(parser.feed(char))
+
+        self.assertEqual([key for key, _ in completed], ["animal", "keywords", "stats"])
+        self.assertEqual(parser.fields["animal"], "雪豹, {夜}")
+        self.assertEqual(parser.fields["keywords"][1], 'b"c')
+        self.assertTrue(parser.done)
+
+    def test_incremental_json_field_parser_waits_for_complete_field(self):
+        parser = IncrementalJsonFieldParser()
+
+        self.assertEqual(parser.feed('{"animal": "星光'), [])
+        self.assertEqual(parser.feed('雪豹", "quote"'), [("animal", "星光雪豹")])
+
+    @patch("soul_animal_helpers.requests.Session.post")
+    def test_stream_openai_compatible_chat_text_reads_sse_deltas(self, post):
+        response = Mock()
+        response.raise_for_status.return_value = None
+        response.iter_lines.return_value = [
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            "",
+            'data: {"choices": [{"delta": {"content": "{\\"animal\\""}}]}',
+            'data: {"choices": [{"delta": {"content": ": \\"雪豹\\"}"}}]}',
+            "data: [DONE]",
+        ]
+        post.return_value = response
+
+        chunks = list(stream_openai_compatible_chat_text("https://api.x.ai/v1", "grok-4.3", "secret", "prompt", timeout=7))
+
+        self.assertEqual("".join(chunks), '{"animal": "雪豹"}')
+        self.assertTrue(post.call_args.kwargs["json"]["stream"])
+        self.assertTrue(post.call_args.kwargs["stream"])
+
+    @patch("soul_animal_helpers.stream_text_model_text")
+    def test_stream_soul_profile_validates_after_stream_ends(self, stream_text):
+        text = json.dumps(VALID_PROFILE, ensure_ascii=False)
+        stream_text.return_value = iter([text[:20], text[20:]])
+        fields = []
+
+        profile = stream_soul_profile(TEXT_MODEL_OPTIONS["openai_gpt_5_5"], "secret", ("A",), lambda key, value: fields.append(key))
+
+        self.assertEqual(profile, validate_soul_profile(VALID_PROFILE))
+        self.assertEqual(fields, list(VALID_PROFILE))
+
+        stream_text.return_value = iter(['{"animal": "雪豹"}'])
+        with self.assertRaisesRegex(ValueError, "缺少字段"):
+            stream_soul_profile(TEXT_MODEL_OPTIONS["openai_gpt_5_5"], "secret", ("A",), lambda key, value: None)
+
+    def test_get_http_session_is_shared_and_pooled(self):
+        session = get_http_session()
+
+        self.assertIs(get_http_session(), session)
+        adapter = session.get_adapter("https://api.openai.com/v1/chat/completions")
+        self.assertEqual(adapter._pool_maxsize, HTTP_POOL_MAXSIZE)
+        self.assertNotIn(429, adapter.max_retries.status_forcelist)
+        self.assertFalse(adapter.max_retries.respect_retry_after_header)
+        self.assertIn("POST", adapter.max_retries.allowed_methods)
+        self.assertEqual(adapter.max_retries.read, 0)
+
     def test_build_seedance_video_prompt_uses_profile_details(self):
         prompt = build_seedance_video_prompt(VALID_PROFILE)
 
@@ -123,5 +361,1366 @@ class SoulAnimalHelpersTest(unittest.TestCase):
         self.assertIn("cinematic", prompt)
 
 
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_build_result_cache_key_includes_model_and_prompt_version(self):
+        key = build_result_cache_key(["A", "B"], "gemini_2_5_flash", "v9")
+
+        self.assertEqual(key, (("A", "B"), "gemini_2_5_flash", "v9"))
+
+    def test_get_returns_cached_profile_until_ttl_expires(self):
+        clock = FakeClock()
+        cache = ResultCache(ttl_seconds=10, clock=clock)
+        cache.put("key", VALID_PROFILE)
+
+        self.assertEqual(cache.get("key"), VALID_PROFILE)
+        clock.now = 11
+        self.assertIsNone(cache.get("key"))
+        # 过期变体仍留给 peek 做过载降级
+        self.assertEqual(cache.peek("key"), VALID_PROFILE)
+
+    def test_get_waits_for_variety_then_picks_a_variant(self):
+        cache = ResultCache(variety=2)
+        other = dict(VALID_PROFILE, animal="水晶琉璃鹿")
+        cache.put("key", VALID_PROFILE)
+
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", other)
+        self.assertIn(cache.get("key")["animal"], {"星光雪豹", "水晶琉璃鹿"})
+
+    def test_peek_returns_expired_variant_for_fallback(self):
+        clock = FakeClock()
+        cache = ResultCache(ttl_seconds=10, variety=2, clock=clock)
+        cache.put("key", VALID_PROFILE)
+        clock.now = 11
+
+        self.assertEqual(cache.peek("key"), VALID_PROFILE)
+        self.assertIsNone(cache.peek("missing"))
+
+    def test_put_evicts_least_recently_used_key(self):
+        cache = ResultCache(max_keys=2)
+        cache.put("a", VALID_PROFILE)
+        cache.put("b", VALID_PROFILE)
+        cache.get("a")
+        cache.put("c", VALID_PROFILE)
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+
+class PrecomputeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeProviderServer(profile=VALID_PROFILE).start()
+        self.base_url = self.server.base_url
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ResultStore(os.path.join(self.directory.name, "results.sqlite3"))
+        self.text_models = {
+            "openai_gpt_5_4_mini": dict(TEXT_MODEL_OPTIONS["openai_gpt_5_4_mini"], base_url=self.base_url),
+        }
+        self.secrets = {"OPENAI_API_KEY": "secret", "SILICONFLOW_API_KEY": "secret"}
+
+    def tearDown(self):
+        self.server.stop()
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_iter_answer_combinations_covers_full_space(self):
+        self.assertEqual(len(list(iter_answer_combinations())), 243)
+
+    def test_run_precompute_fills_store_and_resumes(self):
+        summary = run_precompute(self.store, self.text_models, self.secrets, concurrency=8, text_rpm=0, log=None)
+
+        self.assertEqual(summary["ok"], 243)
+        self.assertEqual(summary["failed"], 0)
+        answers_key = next(iter(iter_answer_combinations()))
+        stored = self.store.get(build_result_cache_key(answers_key, "openai_gpt_5_4_mini"))
+        self.assertEqual(stored["data"]["animal"], "星光雪豹")
+
+        summary = run_precompute(self.store, self.text_models, self.secrets, text_rpm=0, log=None)
+
+        self.assertEqual(summary["skipped"], 243)
+        self.assertEqual(len(self.server.calls), 243)
+
+    def test_run_precompute_generates_images_for_stored_profiles(self):
+        run_precompute(self.store, self.text_models, self.secrets, text_rpm=0, limit=2, log=None)
+
+        summary = run_precompute(
+            self.store,
+            self.text_models,
+            self.secrets,
+            include_images=True,
+            text_rpm=0,
+            image_rpm=0,
+            image_endpoint=f"{self.base_url}/images/generations",
+            limit=2,
+            log=None,
+        )
+
+        self.assertEqual(summary["ok"], 2)
+        self.assertEqual(self.server.calls.count("/v1/chat/completions"), 2)
+        self.assertEqual(self.server.calls.count("/v1/images/generations"), 2)
+        self.assertEqual(len(self.store.completed_keys(require_image=True)), 2)
+
+    def test_pooled_session_retries_transient_status(self):
+        self.server.fail_next = 1
+        configure_http_session(retry_backoff_seconds=0)
+        try:
+            text = generate_openai_compatible_chat_text(self.base_url, "gpt-5.4-mini", "secret", "prompt")
+        finally:
+            configure_http_session()
+
+        self.assertEqual(json.loads(text)["animal"], "星光雪豹")
+        self.assertEqual(self.server.calls, ["/v1/chat/completions", "/v1/chat/completions"])
+
+    def test_run_precompute_requires_model_secret(self):
+        with self.assertRaisesRegex(ValueError, "OPENAI_API_KEY"):
+            run_precompute(self.store, self.text_models, {}, log=None)
+
+    def test_rate_limiter_spaces_requests(self):
+        clock = FakeClock()
+        delays = []
+        limiter = RateLimiter(60, clock=clock, sleep=delays.append)
+
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+
+        self.assertEqual(delays, [1.0, 2.0])
+
+
+class HedgedRoutingTest(unittest.TestCase):
+    secrets = {"GEMINI_API_KEY": "g", "OPENAI_API_KEY": "o"}
+
+    def test_build_failover_order_keeps_primary_first_and_skips_missing_secrets(self):
+        order = build_failover_order("openai_gpt_5_4_mini", self.secrets)
+
+        self.assertEqual(order, ["openai_gpt_5_4_mini", "gemini_2_5_flash", "openai_gpt_5_5"])
+
+    def test_hedges_to_backup_when_primary_is_slow(self):
+        release = threading.Event()
+        calls = []
+
+        def generate(text_model, api_key, answers_key):
+            calls.append(text_model["model"])
+            if text_model["provider"] == "gemini":
+                release.wait(5)
+                return dict(VALID_PROFILE, animal="慢")
+            return dict(VALID_PROFILE, animal="快")
+
+        model_id, profile = generate_soul_profile_hedged(
+            ["gemini_2_5_flash", "openai_gpt_5_5"], self.secrets, ("A",), hedge_after_seconds=0.05, generate=generate
+        )
+        release.set()
+
+        self.assertEqual(model_id, "openai_gpt_5_5")
+        self.assertEqual(profile["animal"], "快")
+        self.assertEqual(calls, ["models/gemini-2.5-flash", "gpt-5.5"])
+
+    def test_fails_over_immediately_on_error(self):
+        def generate(text_model, api_key, answers_key):
+            if text_model["provider"] == "gemini":
+                raise RuntimeError("文本模型请求失败，HTTP 状态码：503")
+            return VALID_PROFILE
+
+        started_at = time.monotonic()
+        model_id, _ = generate_soul_profile_hedged(
+            ["gemini_2_5_flash", "openai_gpt_5_5"], self.secrets, ("A",), hedge_after_seconds=5, generate=generate
+        )
+
+        self.assertEqual(model_id, "openai_gpt_5_5")
+        self.assertLess(time.monotonic() - started_at, 1)
+
+    def test_raises_with_every_provider_error_when_all_fail(self):
+        def generate(text_model, api_key, answers_key):
+            raise ValueError("AI 返回结果不是合法 JSON，请重试。")
+
+        with self.assertRaisesRegex(RuntimeError, "Gemini 2.5 Flash.*OpenAI GPT-5.5"):
+            generate_soul_profile_hedged(["gemini_2_5_flash", "openai_gpt_5_5"], self.secrets, ("A",), generate=generate)
+
+
+
+class CascadeRoutingTest(unittest.TestCase):
+    secrets = {"GEMINI_API_KEY": "g", "OPENAI_API_KEY": "o"}
+
+    def setUp(self):
+        self.stats = CascadeStats()
+
+    def test_build_cascade_order_puts_fast_model_before_premium(self):
+        self.assertEqual(build_cascade_order("openai_gpt_5_5", self.secrets), ["openai_gpt_5_4_mini", "openai_gpt_5_5"])
+        self.assertEqual(build_cascade_order("openai_gpt_5_4_mini", self.secrets), ["openai_gpt_5_4_mini", "openai_gpt_5_5"])
+        self.assertEqual(build_cascade_order("gemini_2_5_flash", self.secrets), ["gemini_2_5_flash", "openai_gpt_5_5"])
+        self.assertEqual(build_cascade_order("gemini_2_5_flash", {"GEMINI_API_KEY": "g"}), ["gemini_2_5_flash"])
+
+    def test_fast_tier_result_is_used_without_escalation(self):
+        calls = []
+
+        def generate(text_model, api_key, answers_key, followup_repair=True):
+            calls.append((text_model["model"], text_model.get("timeout_seconds"), followup_repair))
+            return VALID_PROFILE
+
+        model_id, _ = generate_soul_profile_cascade(
+            ["openai_gpt_5_4_mini", "openai_gpt_5_5"], self.secrets, ("A",), fast_timeout_seconds=3, generate=generate, stats=self.stats
+        )
+
+        self.assertEqual(model_id, "openai_gpt_5_4_mini")
+        self.assertEqual(calls, [("gpt-5.4-mini", 3, False)])
+        self.assertEqual(self.stats.summary()["escalation_rate"], 0.0)
+
+    def test_escalates_on_validation_failure_and_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def generate(text_model, api_key, answers_key, followup_repair=True):
+            if text_model["model"] == "gpt-5.4-mini":
+                raise ValueError("AI 返回结果缺少字段：stats")
+            if text_model["provider"] == "gemini":
+                release.wait(5)
+            return dict(VALID_PROFILE, animal=text_model["model"])
+
+        model_id, profile = generate_soul_profile_cascade(
+            ["openai_gpt_5_4_mini", "openai_gpt_5_5"], self.secrets, ("A",), generate=generate, stats=self.stats
+        )
+        self.assertEqual((model_id, profile["animal"]), ("openai_gpt_5_5", "gpt-5.5"))
+
+        model_id, _ = generate_soul_profile_cascade(
+            ["gemini_2_5_flash", "openai_gpt_5_5"], self.secrets, ("A",), fast_timeout_seconds=0.05, generate=generate, stats=self.stats
+        )
+        self.assertEqual(model_id, "openai_gpt_5_5")
+
+        summary = self.stats.summary()
+        self.assertEqual(summary["escalation_rate"], 1.0)
+        self.assertEqual(summary["served_by_tier"], {"1": 2})
+        self.assertEqual(summary["tiers"]["openai_gpt_5_4_mini"]["invalid"], 1)
+        self.assertEqual(summary["tiers"]["gemini_2_5_flash"]["timeout"], 1)
+        self.assertEqual(summary["tiers"]["openai_gpt_5_5"]["ok"], 2)
+
+    def test_cancels_queued_fast_tier_after_timeout(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        executor.submit(release.wait, 5)
+        calls = []
+
+        def generate(text_model, api_key, answers_key, followup_repair=True):
+            calls.append(text_model["model"])
+            return VALID_PROFILE
+
+        model_id, _ = generate_soul_profile_cascade(
+            ["openai_gpt_5_4_mini", "openai_gpt_5_5"],
+            self.secrets,
+            ("A",),
+            fast_timeout_seconds=0.05,
+            generate=generate,
+            executor=executor,
+            stats=self.stats,
+        )
+        release.set()
+        executor.shutdown(wait=True)
+
+        self.assertEqual(model_id, "openai_gpt_5_5")
+        self.assertEqual(calls, ["gpt-5.5"])
+
+    def test_raises_when_every_tier_fails(self):
+        def generate(text_model, api_key, answers_key, followup_repair=True):
+            raise RuntimeError("文本模型请求失败，HTTP 状态码：503")
+
+        with self.assertRaisesRegex(RuntimeError, "OpenAI GPT-5.4 mini.*OpenAI GPT-5.5"):
+            generate_soul_profile_cascade(
+                ["openai_gpt_5_4_mini", "openai_gpt_5_5"], self.secrets, ("A",), generate=generate, stats=self.stats
+            )
+        self.assertEqual(self.stats.summary()["served_by_tier"], {"failed": 1})
+
+def make_png_bytes(size=1024, color=(229, 192, 123)):
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+class ImageStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_or_create_generates_once_and_stores_variants(self):
+        from PIL import Image
+
+        store = ImageStore(self.directory.name)
+        generate = Mock(return_value="https://example.com/a.png")
+        download = Mock(return_value=make_png_bytes())
+
+        key = store.get_or_create("A luminous snow leopard", "secret", generate=generate, download=download)
+        again = store.get_or_create("A luminous snow leopard", "secret", generate=generate, download=download)
+
+        self.assertEqual(key, again)
+        self.assertEqual(key, build_siliconflow_image_key("A luminous snow leopard"))
+        generate.assert_called_once()
+        download.assert_called_once_with("https://example.com/a.png")
+        with Image.open(io.BytesIO(store.get(key, "mobile"))) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (512, 512)))
+        with Image.open(io.BytesIO(store.get(key, "full"))) as image:
+            self.assertEqual(image.size, (1024, 1024))
+
+    def test_get_or_create_ingests_source_url_without_api_key(self):
+        store = ImageStore(self.directory.name)
+        generate = Mock()
+
+        key = store.get_or_create("prompt", source_url="https://example.com/b.png", generate=generate, download=lambda url: make_png_bytes(64))
+
+        generate.assert_not_called()
+        self.assertTrue(store.has(key))
+        with self.assertRaisesRegex(RuntimeError, "SILICONFLOW_API_KEY"):
+            store.get_or_create("other prompt", download=lambda url: make_png_bytes(64))
+
+    def test_non_image_bytes_and_write_failures_raise_runtime_error(self):
+        store = ImageStore(self.directory.name)
+
+        with self.assertRaisesRegex(RuntimeError, "无法解析"):
+            store.get_or_create("prompt", source_url="https://example.com/expired.png", download=lambda url: b"<html>expired</html>")
+        self.assertFalse(store.has(build_siliconflow_image_key("prompt")))
+
+        with patch("soul_animal_images.tempfile.mkstemp", side_effect=OSError(28, "No space left on device")):
+            with self.assertRaisesRegex(RuntimeError, "保存失败"):
+                store.put("a" * 64, make_png_bytes(64))
+
+    def test_rejects_malformed_keys_and_variants(self):
+        store = ImageStore(self.directory.name)
+        key = store.put("a" * 64, make_png_bytes(64))
+
+        self.assertIsNotNone(store.get(key, "full"))
+        self.assertIsNone(store.get("../" + key[3:], "full"))
+        self.assertIsNone(store.get(key, "../full"))
+        self.assertFalse(store.has("A" * 64))
+        with self.assertRaises(ValueError):
+            store.path_for("../../etc/passwd", "full")
+
+        server = create_service_server(SoulResultService({}, image_store=store), port=0, workers=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = f"http://127.0.0.1:{server.server_port}/v1/images"
+        self.assertEqual(requests.get(f"{base_url}/{key}?variant=full").status_code, 200)
+        self.assertEqual(requests.get(f"{base_url}/{key}?variant=..%2Ffull").status_code, 404)
+        self.assertEqual(requests.get(f"{base_url}/..%2F{key[3:]}").status_code, 404)
+
+    def test_enforce_quota_evicts_least_recently_used_image(self):
+        store = ImageStore(self.directory.name, quota_bytes=10**9)
+        store.put("a" * 64, make_png_bytes(256, (10, 20, 30)))
+        store.put("b" * 64, make_png_bytes(256, (30, 20, 10)))
+        for variant in store.variant_sizes:
+            os.utime(store.path_for("a" * 64, variant), (1, 1))
+        store.quota_bytes = sum(
+            os.path.getsize(store.path_for(key, variant)) for key in ("a" * 64, "b" * 64) for variant in store.variant_sizes
+        ) - 1
+
+        store.enforce_quota()
+
+        self.assertFalse(store.has("a" * 64))
+        self.assertTrue(store.has("b" * 64))
+
+
+class SingleFlightTest(unittest.TestCase):
+    def run_concurrently(self, flight, function, count=5):
+        outcomes = []
+        started = threading.Barrier(count)
+
+        def call():
+            started.wait(5)
+            try:
+                outcomes.append(flight.do("key", function))
+            except RuntimeError as exc:
+                outcomes.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_identical_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        def generate():
+            calls.append(1)
+            time.sleep(0.2)
+            return VALID_PROFILE
+
+        outcomes = self.run_concurrently(flight, generate)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [VALID_PROFILE] * 5)
+        # 完成后不再合并：下一次调用重新执行
+        self.assertEqual(flight.do("key", lambda: "fresh"), "fresh")
+
+    def test_errors_reach_every_waiter_and_are_not_cached(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            time.sleep(0.2)
+            raise RuntimeError("文本模型请求超时，请稍后重试。")
+
+        outcomes = self.run_concurrently(flight, fail)
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(outcome, RuntimeError) for outcome in outcomes))
+        self.assertEqual(flight.do("key", lambda: "fresh"), "fresh")
+
+    def test_leader_interrupted_by_base_exception_fails_waiters(self):
+        class Interrupted(BaseException):
+            pass
+
+        flight = SingleFlight()
+        leader_started = threading.Event()
+        release = threading.Event()
+        outcomes = []
+
+        def interrupted():
+            leader_started.set()
+            release.wait(5)
+            raise Interrupted()
+
+        def lead():
+            try:
+                flight.do("key", interrupted)
+            except Interrupted as exc:
+                outcomes.append(exc)
+
+        def wait():
+            try:
+                outcomes.append(flight.do("key", lambda: "unused"))
+            except RuntimeError as exc:
+                outcomes.append(exc)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        leader_started.wait(5)
+        waiters = [threading.Thread(target=wait) for _ in range(3)]
+        for thread in waiters:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + waiters:
+            thread.join(5)
+
+        self.assertEqual(len(outcomes), 4)
+        self.assertEqual(sum(isinstance(outcome, Interrupted) for outcome in outcomes), 1)
+        self.assertEqual(sum(isinstance(outcome, RuntimeError) for outcome in outcomes), 3)
+        self.assertEqual(flight.do("key", lambda: "fresh"), "fresh")
+
+
+class SoulResultServiceTest(unittest.TestCase):
+    answers = [0, 1, 2, 0, 1]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.service = SoulResultService(
+            {"OPENAI_API_KEY": "secret"},
+            image_store=ImageStore(os.path.join(self.directory.name, "images")),
+        )
+        patcher = patch("soul_animal_service.generate_soul_profile", return_value=validate_soul_profile(VALID_PROFILE))
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_generate_profile_uses_cache_after_first_call(self):
+        first = self.service.generate_profile(self.answers, "openai_gpt_5_5")
+        second = self.service.generate_profile(self.answers, "openai_gpt_5_5")
+
+        self.assertEqual(first["data"], second["data"])
+        self.assertEqual(first["key"], normalize_answers(self.answers))
+        self.generate.assert_called_once()
+
+    def test_generate_profile_caches_each_prompt_version_separately(self):
+        compact = self.service.generate_profile(self.answers, "openai_gpt_5_5", prompt_version="ethereal-compact-v1")
+        default = self.service.generate_profile(self.answers, "openai_gpt_5_5")
+
+        self.assertEqual(compact["prompt_version"], "ethereal-compact-v1")
+        self.assertEqual(default["prompt_version"], "ethereal-v1")
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(self.generate.call_args_list[0].args[3], "ethereal-compact-v1")
+
+    def test_hedged_result_is_cached_under_the_model_that_answered(self):
+        fallback_profile = validate_soul_profile(dict(VALID_PROFILE, animal="备用雪豹"))
+        with patch("soul_animal_service.generate_soul_profile_hedged", return_value=("openai_gpt_5_4_mini", fallback_profile)):
+            hedged = self.service.generate_profile(self.answers, "openai_gpt_5_5", routing_mode="hedged")
+        selected = self.service.generate_profile(self.answers, "openai_gpt_5_5")
+        fallback = self.service.generate_profile(self.answers, "openai_gpt_5_4_mini")
+
+        self.assertEqual(hedged["text_model_id"], "openai_gpt_5_4_mini")
+        self.assertEqual((selected["source"], selected["data"]["animal"]), ("provider", "星光雪豹"))
+        self.assertEqual((fallback["source"], fallback["text_model_id"], fallback["data"]["animal"]), ("cache", "openai_gpt_5_4_mini", "备用雪豹"))
+
+    def test_cascade_result_is_cached_under_the_model_that_answered(self):
+        fast_profile = validate_soul_profile(dict(VALID_PROFILE, animal="快速雪豹"))
+        with patch("soul_animal_service.generate_soul_profile_cascade", return_value=("openai_gpt_5_4_mini", fast_profile)):
+            cascade = self.service.generate_profile(self.answers, "openai_gpt_5_5", routing_mode="cascade")
+        premium = self.service.generate_profile(self.answers, "openai_gpt_5_5")
+
+        self.assertEqual(cascade["text_model_id"], "openai_gpt_5_4_mini")
+        self.assertEqual((premium["source"], premium["text_model_id"], premium["data"]["animal"]), ("provider", "openai_gpt_5_5", "星光雪豹"))
+
+    def test_submit_image_reuses_pending_job(self):
+        service = SoulResultService(
+            {"SILICONFLOW_API_KEY": "secret"}, image_store=ImageStore(os.path.join(self.directory.name, "pending"))
+        )
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def get_or_create(image_prompt, *args, **kwargs):
+            calls.append(image_prompt)
+            release.wait(5)
+            return "k" * 64
+
+        with patch.object(service.image_store, "get_or_create", side_effect=get_or_create):
+            first = service.submit_image(VALID_PROFILE)
+            self.assertIs(service.submit_image(VALID_PROFILE), first)
+            release.set()
+            self.assertEqual(first.result(5), "k" * 64)
+            for _ in range(100):
+                if not service._image_jobs:
+                    break
+                time.sleep(0.01)
+            second = service.submit_image(VALID_PROFILE)
+            self.assertIsNot(second, first)
+            second.result(5)
+        self.assertEqual(len(calls), 2)
+
+    def test_every_routing_mode_falls_back_to_stale_cache_when_overloaded(self):
+        clock = FakeClock()
+        self.service.result_cache = ResultCache(ttl_seconds=60, clock=clock)
+        self.service.generate_profile(self.answers, "openai_gpt_5_5")
+        clock.now += 61
+        self.generate.side_effect = ProviderOverloadedError("排队过长")
+
+        for routing_mode in ("single", "hedged", "cascade"):
+            result = self.service.generate_profile(self.answers, "openai_gpt_5_5", routing_mode=routing_mode)
+            self.assertEqual((result["source"], result["text_model_id"]), ("stale_cache", "openai_gpt_5_5"))
+        self.generate.side_effect = [ProviderOverloadedError("排队过长"), RuntimeError("HTTP 状态码：503")]
+        with self.assertRaises(RuntimeError) as raised:
+            self.service.generate_profile(self.answers, "openai_gpt_5_5", routing_mode="hedged")
+        self.assertNotIsInstance(raised.exception, ProviderOverloadedError)
+
+    def test_generate_profile_reports_missing_secret(self):
+        with self.assertRaisesRegex(ValueError, "GEMINI_API_KEY"):
+            self.service.generate_profile(self.answers, "gemini_2_5_flash")
+
+    def test_generate_soul_result_is_awaitable(self):
+        result = asyncio.run(generate_soul_result(self.answers, "openai_gpt_5_5", "seedance_prompt", service=self.service))
+
+        self.assertEqual(result["data"]["animal"], "星光雪豹")
+        self.assertIn("Seedance video prompt", result["seedance_prompt"])
+        self.assertIsNone(result["image_key"])
+
+    def test_http_endpoint_runs_submitted_job(self):
+        server = create_service_server(self.service, port=0, workers=2)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+        response = requests.post(f"{base_url}/jobs", json={"answers": self.answers, "model_id": "openai_gpt_5_5"})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        for _ in range(50):
+            job = requests.get(f"{base_url}/jobs/{job_id}").json()
+            if job["status"] in {"done", "failed"}:
+                break
+            time.sleep(0.05)
+
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"]["data"]["animal"], "星光雪豹")
+        self.assertEqual(requests.post(f"{base_url}/jobs", json={"answers": [9]}).status_code, 400)
+        self.assertEqual(requests.get(f"{base_url}/jobs/missing").status_code, 404)
+
+
+class ProviderHealthTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.health = ProviderHealthRegistry(
+            min_samples=5, percentile=0.99, multiplier=2.0, floor_seconds=1.0, failure_threshold=3, open_seconds=30, clock=lambda: self.now
+        )
+
+    def fail(self, times=1):
+        for _ in range(times):
+            self.health.admit("api.openai.com", "gpt-5.5", 60)
+            self.health.record_failure("api.openai.com", "gpt-5.5")
+
+    def test_timeout_follows_observed_latency_with_fixed_cap(self):
+        self.assertEqual(self.health.admit("api.openai.com", "gpt-5.5", 60), 60)
+        for latency in [2.0, 3.0, 2.5, 4.0, 3.5]:
+            self.health.record_success("api.openai.com", "gpt-5.5", latency)
+
+        self.assertEqual(self.health.admit("api.openai.com", "gpt-5.5", 60), 8.0)
+        self.assertEqual(self.health.admit("api.openai.com", "gpt-5.5", 5), 5)
+        self.assertEqual(self.health.summary()["api.openai.com/gpt-5.5"]["p99_seconds"], 4.0)
+
+    def test_breaker_opens_then_half_opens_for_one_probe(self):
+        self.fail(3)
+        with self.assertRaises(CircuitOpenError):
+            self.health.admit("api.openai.com", "gpt-5.5", 60)
+        self.assertFalse(self.health.is_available("api.openai.com", "gpt-5.5"))
+
+        self.now = 31
+        self.assertEqual(self.health.admit("api.openai.com", "gpt-5.5", 60), 60)
+        with self.assertRaises(CircuitOpenError):
+            self.health.admit("api.openai.com", "gpt-5.5", 60)
+        self.health.record_failure("api.openai.com", "gpt-5.5")
+        self.assertEqual(self.health.summary()["api.openai.com/gpt-5.5"]["state"], "open")
+
+        self.now = 62
+        self.health.admit("api.openai.com", "gpt-5.5", 60)
+        self.health.record_success("api.openai.com", "gpt-5.5", 2.0)
+        summary = self.health.summary()["api.openai.com/gpt-5.5"]
+        self.assertEqual((summary["state"], summary["trips"], summary["consecutive_failures"]), ("closed", 2, 0))
+
+    def test_client_errors_do_not_count_as_provider_failures(self):
+        bad_request = requests.HTTPError(response=Mock(status_code=400))
+        overloaded = requests.HTTPError(response=Mock(status_code=503))
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                with self.health.track("api.openai.com", "gpt-5.5"):
+                    raise bad_request
+        self.assertTrue(self.health.is_available("api.openai.com", "gpt-5.5"))
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                with self.health.track("api.openai.com", "gpt-5.5"):
+                    raise overloaded
+        self.assertFalse(self.health.is_available("api.openai.com", "gpt-5.5"))
+
+    @patch("soul_animal_helpers.requests.Session.post")
+    def test_open_breaker_skips_provider_request(self, post):
+        health = configure_provider_health(failure_threshold=1)
+        self.addCleanup(configure_provider_health)
+        health.record_failure("api.siliconflow.cn", "black-forest-labs/FLUX.1-schnell")
+
+        with self.assertRaisesRegex(RuntimeError, "熔断"):
+            generate_siliconflow_image_url("prompt", "secret")
+        post.assert_not_called()
+
+    def test_service_falls_back_to_healthy_model_and_seedance_prompt(self):
+        health = configure_provider_health(failure_threshold=1)
+        self.addCleanup(configure_provider_health)
+        health.record_failure("api.openai.com", "gpt-5.5")
+        health.record_failure("api.siliconflow.cn", "black-forest-labs/FLUX.1-schnell")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        service = SoulResultService(
+            {"OPENAI_API_KEY": "secret", "SILICONFLOW_API_KEY": "secret"}, image_store=ImageStore(directory.name)
+        )
+
+        def generate(text_model, *args, **kwargs):
+            if text_model["model"] == "gpt-5.5":
+                raise CircuitOpenError("api.openai.com 暂时不可用（熔断中），请稍后重试。")
+            return validate_soul_profile(VALID_PROFILE)
+
+        with patch("soul_animal_service.generate_soul_profile", side_effect=generate):
+            result = service.generate([0, 1, 2, 0, 1], "openai_gpt_5_5", "siliconflow_flux")
+
+        self.assertEqual(result["text_model_id"], "openai_gpt_5_4_mini")
+        self.assertIn("GPT-5.4 mini", result["notice"])
+        self.assertIsNone(result["image_key"])
+        self.assertIn("Seedance", result["image_error"])
+        self.assertIn("Seedance video prompt", result["seedance_prompt"])
+
+
+class ResultArtifactStoreTest(unittest.TestCase):
+    def artifact(self, animal):
+        return {"data": dict(VALID_PROFILE, animal=animal), "chart": "<svg/>", "image_key": None, "shares": {}}
+
+    def test_encode_answers_keeps_option_indexes(self):
+        answers_key = normalize_answers([0, 1, 2, 0, 1])
+        self.assertEqual(encode_answers(answers_key), (0, 1, 2, 0, 1))
+        self.assertEqual(encode_answers({"q1": 0, "q2": 1, "q3": answers_key[2], "q4": 0, "q5": 1}), (0, 1, 2, 0, 1))
+        self.assertEqual(normalize_answers(encode_answers(answers_key)), answers_key)
+
+    def test_result_id_is_content_addressed(self):
+        answers_key = normalize_answers([0, 1, 2, 0, 1])
+        result_id = build_result_id(answers_key, "gemini_2_5_flash", "ethereal-v1", VALID_PROFILE)
+
+        self.assertEqual(result_id, build_result_id(answers_key, "gemini_2_5_flash", "ethereal-v1", dict(VALID_PROFILE)))
+        self.assertEqual(len(result_id), 12)
+        self.assertNotEqual(result_id, build_result_id(answers_key, "gemini_2_5_flash", "ethereal-compact-v1", VALID_PROFILE))
+
+    def test_put_deduplicates_and_update_tracks_size(self):
+        store = ResultArtifactStore()
+        first = store.put("a", self.artifact("星光雪豹"))
+        second = store.put("a", self.artifact("另一只"))
+
+        self.assertIs(first, second)
+        self.assertEqual(len(store), 1)
+        size = store.total_bytes
+        store.update("a", image_key="k" * 64)
+        self.assertEqual(store.get("a")["image_key"], "k" * 64)
+        self.assertGreater(store.total_bytes, size)
+        self.assertEqual(store.total_bytes, deep_sizeof(store.get("a")))
+        self.assertIsNone(store.update("missing", image_key="k"))
+
+    def test_evicts_least_recently_used_over_byte_budget(self):
+        entry_bytes = deep_sizeof(self.artifact("星光雪豹"))
+        store = ResultArtifactStore(max_bytes=entry_bytes * 2 + entry_bytes // 2)
+        store.put("a", self.artifact("星光雪豹"))
+        store.put("b", self.artifact("星光雪豹"))
+        store.get("a")
+        store.put("c", self.artifact("星光雪豹"))
+
+        self.assertIsNotNone(store.get("a"))
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.stats()["evictions"], 1)
+        with self.assertRaises(ValueError):
+            ResultArtifactStore(max_bytes=0)
+
+    def test_memory_bench_reports_smaller_compact_sessions(self):
+        report = run_session_memory_bench(sessions=300, distinct_answers=20)
+
+        self.assertEqual(report["shared_store_entries"], 20)
+        self.assertLess(report["compact_bytes_per_session"], report["legacy_bytes_per_session"])
+        self.assertGreater(report["reduction"], 0)
+
+    def test_memory_bench_uses_stage_names_emitted_by_the_code(self):
+        sources = ""
+        for path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")):
+            if not path.endswith(("test_app.py", "soul_animal_session_bench.py")):
+                with open(path, encoding="utf-8") as source:
+                    sources += source.read()
+
+        for stage in LEGACY_SPAN_STAGES:
+            self.assertIn(f'span("{stage}"', sources)
+
+
+class AnalyticsLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "events.sqlite3")
+
+    def open_log(self, **options):
+        log = AnalyticsLog(self.path, **options)
+        self.addCleanup(log.close)
+        return log
+
+    def test_records_are_written_in_batches_and_queried(self):
+        log = self.open_log(batch_size=3, flush_interval_seconds=60)
+        for session_id, pages in (("s1", 4), ("s2", 2), ("s3", 1), ("s4", 4)):
+            for page in range(1, pages + 1):
+                log.record("page_view", session_id=session_id, theme="default", page=page)
+        log.record("result", session_id="s1", answers="01201", model_id="gemini_2_5_flash", outcome="ok", detail="strict")
+        log.record("result", session_id="s4", answers="01201", model_id="gpt_5_5", outcome="ok", detail="local_repair")
+        log.record("result", session_id="s5", answers="22222", model_id="gpt_5_5", outcome="validation_failed")
+        log.record("result", session_id="s6", answers="22222", model_id="gpt_5_5", outcome="ok")
+        log.record("image", session_id="s1", answers="01201", outcome="ok")
+        log.record("image", session_id="s4", answers="01201", outcome="timeout")
+        self.assertTrue(log.flush())
+
+        self.assertEqual(log.stats(), {"enqueued": 17, "written": 17, "dropped": 0, "write_errors": 0, "queued": 0})
+        funnel = query_funnel(self.path)
+        self.assertEqual([(row["page"], row["sessions"]) for row in funnel], [(1, 4), (2, 3), (3, 2), (4, 2)])
+        self.assertEqual(funnel[-1]["conversion"], 0.5)
+        self.assertEqual(query_answer_distribution(self.path), [{"answers": "01201", "results": 2}, {"answers": "22222", "results": 1}])
+        self.assertEqual(query_model_usage(self.path)["gpt_5_5"], {"requests": 3, "ok": 2, "validation_failed": 1})
+        self.assertEqual(
+            query_failing_answers(self.path),
+            [{"answers": "22222", "failures": 1, "requests": 2, "failure_rate": 0.5}],
+        )
+        self.assertEqual(query_image_outcomes(self.path), {"requests": 2, "outcomes": {"ok": 1, "timeout": 1}, "failure_rate": 0.5})
+        self.assertEqual(build_analytics_report(self.path)["funnel"], funnel)
+
+    def test_full_queue_drops_events_without_blocking(self):
+        log = self.open_log(queue_size=1, batch_size=1)
+        writing = threading.Event()
+        release = threading.Event()
+        write = log._write
+
+        def blocked_write(batch):
+            writing.set()
+            release.wait(5)
+            write(batch)
+
+        log._write = blocked_write
+        log.record("page_view", session_id="s1", page=1)
+        self.assertTrue(writing.wait(5))
+        self.assertTrue(log.record("page_view", session_id="s1", page=2))
+        started_at = time.perf_counter()
+        self.assertFalse(log.record("page_view", session_id="s1", page=3))
+        self.assertLess(time.perf_counter() - started_at, 0.5)
+        release.set()
+        self.assertTrue(log.flush())
+
+        self.assertEqual(log.stats()["dropped"], 1)
+        self.assertEqual([row["page"] for row in query_funnel(self.path)], [1, 2])
+
+    def test_close_writes_queued_events(self):
+        log = self.open_log(batch_size=100, flush_interval_seconds=60)
+        log.record("share_view", session_id="s1", outcome="ok", detail="abc")
+        log.close()
+        log.close()
+
+        self.assertEqual(log.stats()["written"], 1)
+        self.assertFalse(log.record("share_view", session_id="s2", outcome="ok"))
+        self.assertEqual(log.stats()["dropped"], 1)
+        with open_analytics_reader(self.path) as connection:
+            self.assertEqual(connection.execute("SELECT event, detail FROM analytics_events").fetchall(), [("share_view", "abc")])
+
+    def test_rejects_unknown_events_and_fields(self):
+        log = self.open_log()
+        with self.assertRaises(ValueError):
+            log.record("click")
+        with self.assertRaises(ValueError):
+            log.record("page_view", user_agent="x")
+        with self.assertRaises(ValueError):
+            AnalyticsLog(self.path, queue_size=0)
+
+    def test_classify_generation_uses_returned_source_and_error(self):
+        strict = Span("parse", None, None, {"repair_path": "strict"})
+        provider = Span("provider_call", "api.openai.com", "gpt-5.5", {})
+
+        self.assertEqual(classify_generation("provider", None, [provider, strict]), ("ok", "strict"))
+        # 请求合并的跟随者和缓存命中没有 parse span，仍然记为成功
+        self.assertEqual(classify_generation("provider", None, []), ("ok", None))
+        self.assertEqual(classify_generation("cache", None), ("ok", None))
+        with self.assertRaises(ProfileValidationError) as raised:
+            parse_soul_profile_with_path("不是 JSON")
+        self.assertEqual(classify_generation(None, raised.exception), ("validation_failed", None))
+        self.assertEqual(classify_generation(None, RuntimeError("HTTP 状态码：503")), ("error", None))
+        self.assertEqual(encode_answers_code(normalize_answers([0, 1, 2, 0, 1]), QUESTIONS), "01201")
+
+
+class ShareStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = ShareStore(os.path.join(self.directory.name, "shared.sqlite3"), cache_size=2)
+        self.addCleanup(self.store.close)
+        self.profile = validate_soul_profile(VALID_PROFILE)
+
+    def test_share_ids_are_compact_and_content_addressed(self):
+        share_id = self.store.save(self.profile, "a" * 64, "openai_gpt_5_5", "ethereal-v1")
+
+        self.assertEqual(len(share_id), 12)
+        self.assertEqual(self.store.save(dict(self.profile), "a" * 64), share_id)
+        self.assertNotEqual(build_share_id(self.profile), share_id)
+        self.assertEqual(self.store.count(), 1)
+
+        shared = self.store.get(share_id)
+        self.assertEqual(shared["data"], self.profile)
+        self.assertEqual(shared["image_key"], "a" * 64)
+        self.assertEqual(shared["text_model_id"], "openai_gpt_5_5")
+
+    def test_records_theme_and_upgrades_old_databases(self):
+        share_id = self.store.save(self.profile, theme_id="dark")
+        self.assertEqual(self.store.get(share_id)["theme_id"], "dark")
+
+        path = os.path.join(self.directory.name, "legacy.sqlite3")
+        with sqlite3.connect(path) as connection:
+            connection.execute(
+                "CREATE TABLE shared_results (share_id TEXT PRIMARY KEY, profile TEXT NOT NULL, image_key TEXT, "
+                "text_model_id TEXT, prompt_version TEXT, created_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            connection.execute(
+                "INSERT INTO shared_results VALUES (?, ?, NULL, NULL, NULL, 0)",
+                ("A" * 11 + "a", json.dumps(self.profile, ensure_ascii=False)),
+            )
+        connection.close()
+        legacy = ShareStore(path)
+        self.addCleanup(legacy.close)
+        self.assertIsNone(legacy.get("A" * 11 + "a")["theme_id"])
+        self.assertEqual(legacy.get(legacy.save(self.profile, theme_id="dark"))["theme_id"], "dark")
+
+    def test_get_rejects_malformed_ids_and_serves_hot_links_from_memory(self):
+        share_id = self.store.save(self.profile)
+        self.assertIsNone(self.store.get("../etc/passwd"))
+        self.assertIsNone(self.store.get("A" * 12))
+
+        self.store.get(share_id)["image_key"] = "被调用方修改"
+        with patch.object(self.store, "_connection") as connection:
+            self.assertIsNone(self.store.get(share_id)["image_key"])
+            connection.execute.assert_not_called()
+
+    def test_service_shares_generated_results_and_serves_them_without_provider(self):
+        image_store = ImageStore(os.path.join(self.directory.name, "images"))
+        service = SoulResultService({"OPENAI_API_KEY": "secret"}, image_store=image_store, share_store=self.store)
+        with patch("soul_animal_service.generate_soul_profile", return_value=self.profile) as generate:
+            output = service.generate([0, 1, 2, 0, 1], "openai_gpt_5_5", "seedance_prompt")
+        generate.assert_called_once()
+
+        server = create_service_server(service, port=0, workers=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = f"http://127.0.0.1:{server.server_port}/v1/shares"
+        response = requests.get(f"{base_url}/{output['share_id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["animal"], "星光雪豹")
+        self.assertEqual(response.json()["prompt_version"], "ethereal-v1")
+        self.assertEqual(response.json()["theme_id"], "ethereal")
+        self.assertEqual(requests.get(f"{base_url}/missing").status_code, 404)
+
+        # 图片已被图片库清理时只返回文字结果
+        image_share_id = service.share_result(self.profile, "b" * 64)
+        self.assertIsNone(service.get_shared_result(image_share_id)["image_key"])
+
+
+class PrefetchTest(unittest.TestCase):
+    partial_answers = {"q1": 0, "q2": 1, "q3": 2, "q4": 0}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.service = SoulResultService(
+            {"OPENAI_API_KEY": "secret"},
+            image_store=ImageStore(os.path.join(self.directory.name, "images")),
+        )
+        self.release = threading.Event()
+
+        def generate(*args, **kwargs):
+            self.release.wait(5)
+            return validate_soul_profile(VALID_PROFILE)
+
+        patcher = patch("soul_animal_service.generate_soul_profile", side_effect=generate)
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown, wait=False, cancel_futures=True)
+        self.addCleanup(self.release.set)
+        self.stats = PrefetchStats()
+
+    def candidates(self):
+        return list(iter_prefetch_candidates(self.partial_answers, QUESTIONS[4]))
+
+    def test_candidates_cover_every_option_of_last_question(self):
+        candidates = self.candidates()
+        self.assertEqual([answers["q5"] for answers in candidates], QUESTIONS[4]["options"])
+        self.assertTrue(all(answers["q1"] == 0 for answers in candidates))
+
+    def test_result_page_joins_in_flight_prefetch(self):
+        answers = self.candidates()[0]
+        prefetcher = SpeculativePrefetcher(executor=self.executor, stats=self.stats)
+        future = prefetcher.prefetch(self.service, answers, "openai_gpt_5_5")
+        for _ in range(100):
+            if self.generate.called:
+                break
+            time.sleep(0.01)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.service.generate_profile(answers, "openai_gpt_5_5")))
+        thread.start()
+        time.sleep(0.05)
+        self.assertIs(prefetcher.adopt(answers), future)
+        self.release.set()
+        thread.join(5)
+
+        self.assertEqual(future.result(5)["data"]["animal"], "星光雪豹")
+        self.assertEqual(results[0]["data"]["animal"], "星光雪豹")
+        self.generate.assert_called_once()
+        self.assertEqual(self.stats.summary()["adopted"], 1)
+
+    def test_finished_prefetch_is_served_from_cache(self):
+        self.release.set()
+        answers = self.candidates()[1]
+        prefetcher = SpeculativePrefetcher(executor=self.executor, stats=self.stats)
+        prefetcher.prefetch(self.service, answers, "openai_gpt_5_5", prompt_version="ethereal-compact-v1").result(5)
+
+        result = self.service.generate_profile(answers, "openai_gpt_5_5", prompt_version="ethereal-compact-v1")
+        self.assertEqual(result["source"], "cache")
+        self.generate.assert_called_once()
+
+    def test_budget_caps_speculation_and_cancelled_jobs_are_refunded(self):
+        first, second, third = self.candidates()
+        prefetcher = SpeculativePrefetcher(budget=2, executor=self.executor, stats=self.stats)
+        self.assertIsNotNone(prefetcher.prefetch(self.service, first, "openai_gpt_5_5"))
+        self.assertIs(prefetcher.prefetch(self.service, first, "openai_gpt_5_5"), prefetcher.prefetch(self.service, first, "openai_gpt_5_5"))
+        queued = prefetcher.prefetch(self.service, second, "openai_gpt_5_5")
+        self.assertIsNone(prefetcher.prefetch(self.service, third, "openai_gpt_5_5"))
+
+        # 单线程池：first 正在运行，second 还在排队，可以取消并退回额度
+        prefetcher.cancel_others(first)
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(prefetcher.used, 1)
+        self.assertIsNotNone(prefetcher.prefetch(self.service, third, "openai_gpt_5_5"))
+
+        self.assertIsNone(prefetcher.adopt(dict(first, q1=2)))
+        summary = self.stats.summary()
+        self.assertEqual(summary["submitted"], 3)
+        self.assertEqual(summary["cancelled"], 1)
+        self.assertEqual(summary["over_budget"], 1)
+        self.assertEqual(summary["unused"], 2)
+        self.assertEqual(summary["adoption_rate"], 0.0)
+
+
+    def test_registry_keeps_one_prefetcher_per_session_and_evicts_idle(self):
+        clock = FakeClock()
+        registry = PrefetcherRegistry(max_sessions=2, idle_seconds=60, clock=clock)
+        first = registry.get("s1", SpeculativePrefetcher)
+        self.assertIs(registry.get("s1", SpeculativePrefetcher), first)
+        registry.get("s2", SpeculativePrefetcher)
+        registry.get("s1", SpeculativePrefetcher)
+        registry.get("s3", SpeculativePrefetcher)
+
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.get("s1", SpeculativePrefetcher), first)
+        clock.now += 61
+        self.assertIsNot(registry.get("s1", SpeculativePrefetcher), first)
+        self.assertEqual(len(registry), 1)
+
+
+class ProviderSchedulerTest(unittest.TestCase):
+    def test_token_bucket_reports_delay_after_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock=clock)
+        for _ in range(60):
+            bucket.reserve(1)
+
+        self.assertAlmostEqual(bucket.delay_for(1), 1.0)
+        clock.now = 0.5
+        self.assertAlmostEqual(bucket.delay_for(1), 0.5)
+
+    def test_acquire_waits_for_rate_limit(self):
+        clock = FakeClock()
+        delays = []
+        scheduler = ProviderScheduler(limits={"p": {"rpm": 60}}, clock=clock, sleep=delays.append)
+        scheduler._state("p").request_bucket.tokens = 0
+
+        with scheduler.acquire("p"):
+            pass
+
+        self.assertEqual(delays, [1.0])
+
+    def test_acquire_sheds_when_rate_wait_exceeds_deadline(self):
+        clock = FakeClock()
+        scheduler = ProviderScheduler(limits={"p": {"rpm": 1}}, deadline_seconds=5, clock=clock, sleep=lambda _: None)
+        with scheduler.acquire("p"):
+            pass
+
+        with self.assertRaisesRegex(ProviderOverloadedError, "排队过长"):
+            with scheduler.acquire("p"):
+                pass
+
+    def test_acquire_bounds_in_flight_and_reports_queue(self):
+        scheduler = ProviderScheduler(limits={}, max_in_flight=1, deadline_seconds=0.2)
+        entered = threading.Event()
+        release = threading.Event()
+
+        def hold_slot():
+            with scheduler.acquire("p"):
+                entered.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold_slot)
+        holder.start()
+        entered.wait(5)
+        self.assertEqual(scheduler.queue_status("p")["in_flight"], 1)
+
+        with self.assertRaises(ProviderOverloadedError):
+            with scheduler.acquire("p"):
+                pass
+
+        release.set()
+        holder.join(5)
+        with scheduler.acquire("p"):
+            self.assertEqual(scheduler.queue_status("p")["in_flight"], 1)
+        self.assertEqual(scheduler.queue_status("p")["waiting"], 0)
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeProviderServer(seed=7).start()
+        self.addCleanup(self.server.stop)
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([3.0], 0.95), 3.0)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_sample_latency_seconds_supports_distributions(self):
+        rng = random.Random(1)
+
+        self.assertEqual(sample_latency_seconds({"kind": "fixed", "seconds": 0.2}, rng), 0.2)
+        self.assertTrue(0.1 <= sample_latency_seconds({"kind": "uniform", "low": 0.1, "high": 0.3}, rng) <= 0.3)
+        self.assertGreater(sample_latency_seconds({"kind": "lognormal", "median": 0.5, "sigma": 0.5}, rng), 0)
+        with self.assertRaisesRegex(ValueError, "未知延迟分布"):
+            sample_latency_seconds({"kind": "pareto"}, rng)
+
+    def test_fake_provider_returns_429_over_rate_limit(self):
+        self.server.rate_limit_rpm = 1
+        url = f"{self.server.base_url}/chat/completions"
+
+        self.assertEqual(requests.post(url, json={"messages": []}).status_code, 200)
+        self.assertEqual(requests.post(url, json={"messages": []}).status_code, 429)
+        self.assertEqual(self.server.call_counts()["/v1/chat/completions 429"], 1)
+
+    def test_run_bench_reports_latency_and_provider_calls(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report = run_bench(self.server, sessions=12, concurrency=4, distinct_answers=3, image_dir=directory, seed=1)
+
+        self.assertEqual(report["succeeded"], 12)
+        self.assertEqual(report["failed"], 0)
+        self.assertLessEqual(report["provider_calls"]["/v1/chat/completions 200"], 3)
+        self.assertLessEqual(report["latency_seconds"]["p50"], report["latency_seconds"]["p99"])
+        self.assertGreater(report["memory"]["tracemalloc_peak_bytes"], 0)
+        json.dumps(report)
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = get_metrics_registry()
+        self.registry.reset()
+        self.addCleanup(self.registry.reset)
+
+    def test_span_records_histogram_and_trace(self):
+        with collect_spans() as spans:
+            with span("parse", model="m") as record:
+                record.set(raw_bytes=12)
+            with self.assertRaises(ValueError):
+                with span("parse", model="m"):
+                    raise ValueError("bad")
+
+        self.assertEqual([item.status for item in spans], ["ok", "error"])
+        self.assertEqual(spans[0].attributes["raw_bytes"], 12)
+        self.assertEqual(spans[1].attributes["error_type"], "ValueError")
+        self.assertEqual(self.registry.summary()["parse"]["count"], 2)
+        self.assertEqual(self.registry.summary()["parse"]["errors"], 1)
+
+    def test_render_prometheus_escapes_labels(self):
+        with span("provider_call", provider='a"b', model="m", retries=2, request_bytes=10):
+            pass
+
+        text = self.registry.render_prometheus()
+
+        self.assertIn('soul_animal_stage_seconds_count{stage="provider_call",provider="a\\"b",model="m",status="ok"} 1', text)
+        self.assertIn('le="+Inf"', text)
+        self.assertIn('soul_animal_stage_retries_total{stage="provider_call",provider="a\\"b",model="m"} 2', text)
+        self.assertIn('direction="request"} 10', text)
+
+    def test_provider_call_span_carries_retries_and_payload_sizes(self):
+        server = FakeProviderServer(profile=VALID_PROFILE).start()
+        self.addCleanup(server.stop)
+        server.fail_next = 1
+        configure_http_session(retry_backoff_seconds=0)
+        self.addCleanup(configure_http_session)
+
+        with collect_spans() as spans:
+            generate_openai_compatible_chat_text(server.base_url, "gpt-5.4-mini", "secret", "prompt")
+
+        call = next(item for item in spans if item.stage == "provider_call")
+        self.assertEqual(call.provider, "127.0.0.1")
+        self.assertEqual(call.attributes["retries"], 1)
+        self.assertEqual(call.attributes["http_status"], 200)
+        self.assertGreater(call.attributes["request_bytes"], 0)
+        self.assertGreater(call.attributes["response_bytes"], 0)
+        self.assertIn("admission_wait", [item.stage for item in spans])
+
+    def test_service_exposes_metrics_endpoint(self):
+        with span("chart"):
+            pass
+        with tempfile.TemporaryDirectory() as directory:
+            server = create_service_server(SoulResultService({}, image_store=ImageStore(directory)), port=0, workers=1)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                response = requests.get(f"http://127.0.0.1:{server.server_port}/metrics")
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('soul_animal_stage_seconds_count{stage="chart"', response.text)
+
+    def test_write_prometheus_file(self):
+        with span("chart"):
+            pass
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "soul_animal.prom")
+            self.registry.write_prometheus(path)
+            with open(path, encoding="utf-8") as metrics_file:
+                self.assertIn("soul_animal_stage_seconds_bucket", metrics_file.read())
+
+
+class PromptTemplateTest(unittest.TestCase):
+    def setUp(self):
+        get_prompt_stats().reset()
+        self.addCleanup(get_prompt_stats().reset)
+
+    def test_templates_are_compacted_and_render_profile(self):
+        template = get_prompt_template("ethereal-v1")
+        prompt = template.render(user_profile="选项A\n选项B")
+
+        self.assertEqual(template.fields, ["user_profile"])
+        self.assertFalse(any(line != line.strip() or not line for line in template.text.splitlines()))
+        self.assertIn("选项A\n选项B", prompt)
+        self.assertIn('{"独立性": int', prompt)
+        self.assertLess(len(get_prompt_template("ethereal-compact-v1").text), len(template.text))
+        with self.assertRaisesRegex(ValueError, "user_profile"):
+            template.render()
+        with self.assertRaisesRegex(ValueError, "未知 Prompt 版本"):
+            get_prompt_template("missing")
+
+    def test_choose_prompt_version_is_stable_and_weighted(self):
+        weights = {"ethereal-v1": 1.0, "ethereal-compact-v1": 1.0}
+        versions = [choose_prompt_version(f"session-{index}", weights) for index in range(200)]
+
+        self.assertEqual(choose_prompt_version("session-1", weights), versions[1])
+        self.assertGreater(versions.count("ethereal-compact-v1"), 60)
+        self.assertGreater(versions.count("ethereal-v1"), 60)
+        self.assertEqual(choose_prompt_version("session-1", {"ethereal-v1": 1.0, "ethereal-compact-v1": 0}), "ethereal-v1")
+        self.assertEqual(choose_prompt_version("session-1", {}), "ethereal-v1")
+
+    def test_output_budget_is_sent_to_both_providers(self):
+        payload = build_openai_compatible_chat_payload(
+            "gpt-5.5", "prompt", stream=True, max_output_tokens=2048, max_tokens_param="max_completion_tokens"
+        )
+
+        self.assertEqual(payload["max_completion_tokens"], 2048)
+        self.assertEqual(payload["stream_options"], {"include_usage": True})
+        self.assertEqual(build_gemini_generation_config(max_output_tokens=2048), {"max_output_tokens": 2048})
+        self.assertIsNone(build_gemini_generation_config())
+        for option in TEXT_MODEL_OPTIONS.values():
+            self.assertGreater(option["max_output_tokens"], 0)
+
+    def test_generate_soul_profile_records_usage_per_prompt_version(self):
+        server = FakeProviderServer(profile=VALID_PROFILE).start()
+        self.addCleanup(server.stop)
+        text_model = dict(TEXT_MODEL_OPTIONS["openai_gpt_5_4_mini"], base_url=server.base_url)
+
+        with collect_spans() as spans:
+            generate_soul_profile(text_model, "secret", ("A", "B"), "ethereal-compact-v1")
+            stream_soul_profile(text_model, "secret", ("A", "B"), lambda key, value: None, "ethereal-v1")
+
+        stats = get_prompt_stats().summary()
+        self.assertEqual(stats["ethereal-compact-v1"]["requests"], 1)
+        self.assertEqual(stats["ethereal-compact-v1"]["strict_pass_rate"], 1.0)
+        self.assertGreater(stats["ethereal-v1"]["mean_input_tokens"], stats["ethereal-compact-v1"]["mean_input_tokens"])
+        calls = [item for item in spans if item.stage == "provider_call"]
+        self.assertEqual(calls[0].attributes["finish_reason"], "stop")
+        self.assertTrue(all(call.attributes["output_tokens"] > 0 for call in calls))
+
+    def test_parse_gemini_usage_counts_thoughts_as_output(self):
+        metadata = Mock(prompt_token_count=100, candidates_token_count=40, thoughts_token_count=60)
+
+        self.assertEqual(parse_gemini_usage(metadata), {"input_tokens": 100, "output_tokens": 100})
+        self.assertEqual(parse_gemini_usage(None), {})
+
+
+class StartupTest(unittest.TestCase):
+    def test_cold_import_does_not_load_heavy_modules(self):
+        report = run_startup_bench(runs=1, mode="imports")
+
+        self.assertEqual(report["mode"], "imports")
+        self.assertEqual(report["heavy_modules_loaded"], [])
+        self.assertGreater(report["median_seconds"], 0)
+
+    def test_prewarm_imports_each_module_once_and_skips_missing(self):
+        thread = prewarm_modules(["colorsys", "soul_animal_missing_module"])
+        thread.join(5)
+
+        self.assertIn("colorsys", sys.modules)
+        self.assertIsNone(prewarm_modules(["colorsys"]))
+        self.assertFalse(import_optional("soul_animal_missing_module"))
+
+
+class RadarChartTest(unittest.TestCase):
+    def test_svg_draws_one_vertex_per_axis_in_plotly_order(self):
+        svg = render_radar_svg({"独立性": 100, "洞察力": 0, "边界感": 50, "精神力": 100})
+        self.assertTrue(svg.startswith("<svg") and svg.endswith("</svg>"))
+        self.assertNotIn("\n", svg)
+        self.assertIn(RADAR_STYLES["ethereal"]["line"], svg)
+        self.assertIn(RADAR_STYLES["ethereal"]["fill"], svg)
+        for label in ("独立性", "洞察力", "边界感", "精神力"):
+            self.assertIn(f">{label}</text>", svg)
+
+        # 第一个维度在正右方、逆时针排列；0 在圆心，100 在外圈
+        points = svg.split("<polygon points='")[1].split("'")[0].split(" ")
+        self.assertEqual(points, ["320,140", "200,140", "140,140", "200,260"])
+
+    def test_values_are_clamped_and_labels_escaped(self):
+        svg = render_radar_svg({"<b>": 150, "洞察力": -10, "边界感": 100})
+        self.assertIn("&lt;b&gt;", svg)
+        self.assertNotIn("<b>", svg)
+        points = svg.split("<polygon points='")[1].split("'")[0].split(" ")
+        self.assertEqual(points[0], "320,140")
+        self.assertEqual(points[1], "200,140")
+
+    def test_svg_is_memoized_per_stats_and_style(self):
+        stats = {"独立性": 81, "洞察力": 72, "边界感": 63}
+        first = render_radar_svg(stats)
+        self.assertIs(render_radar_svg(dict(stats)), first)
+        self.assertIsNot(render_radar_svg(stats, style="dark"), first)
+        self.assertNotEqual(render_radar_svg(dict(stats, 独立性=82)), first)
+
+    def test_dark_style_draws_radial_axis_ticks(self):
+        svg = render_radar_svg({"独立性": 50, "洞察力": 50, "边界感": 50}, style="dark")
+        self.assertIn("viewBox='0 0 400 300'", svg)
+        self.assertIn(">100</text>", svg)
+        self.assertIn("font-family='serif'", svg)
+        self.assertNotIn(">100</text>", render_radar_svg({"独立性": 50, "洞察力": 50, "边界感": 50}))
+
+    def test_empty_stats_and_unknown_options(self):
+        self.assertEqual(render_radar_svg({}), "")
+        with self.assertRaises(ValueError):
+            render_radar_svg({"独立性": 1}, style="neon")
+        with self.assertRaises(ValueError):
+            render_radar_chart({"独立性": 1}, renderer="canvas")
+
+
+class ThemePackTest(unittest.TestCase):
+    answers = [0, 1, 2, 0, 1]
+
+    def setUp(self):
+        self.service = SoulResultService({"OPENAI_API_KEY": "secret"})
+        patcher = patch("soul_animal_service.generate_soul_profile", return_value=validate_soul_profile(VALID_PROFILE))
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_prompt_version_belongs_to_one_theme(self):
+        versions = [version for theme in THEME_PACKS.values() for version in theme.prompt_versions]
+        self.assertEqual(len(versions), len(set(versions)))
+        for theme in THEME_PACKS.values():
+            self.assertEqual(sorted(index for _, indexes in theme.pages for index in indexes), list(range(len(theme.questions))))
+
+    def test_dark_theme_uses_its_questions_prompt_and_axes(self):
+        dark = get_theme_pack("dark")
+        result = self.service.generate_profile(self.answers, "openai_gpt_5_5", theme_id="dark")
+
+        self.assertEqual(result["key"], normalize_answers(self.answers, dark.questions))
+        self.assertEqual(result["prompt_version"], "dark-v1")
+        self.assertEqual(self.generate.call_args.kwargs["stats_axes"], dark.stats_axes)
+
+        self.service.generate_profile(self.answers, "openai_gpt_5_5")
+        self.assertEqual(self.generate.call_count, 2)
+
+    def test_prompt_version_must_match_theme(self):
+        with self.assertRaisesRegex(ValueError, "不属于主题"):
+            self.service.generate_profile(self.answers, "openai_gpt_5_5", prompt_version="ethereal-v1", theme_id="dark")
+        with self.assertRaisesRegex(ValueError, "未知主题"):
+            get_theme_pack("neon")
+
+    def test_image_key_depends_on_theme_style_prefix(self):
+        profile = validate_soul_profile(VALID_PROFILE)
+        ethereal_key = build_siliconflow_image_key(profile["image_prompt"])
+        dark_key = build_siliconflow_image_key(profile["image_prompt"], get_theme_pack("dark").image_style_prefix)
+
+        self.assertEqual(ethereal_key, build_siliconflow_image_key(profile["image_prompt"], get_theme_pack().image_style_prefix))
+        self.assertNotEqual(ethereal_key, dark_key)
+
+
 if __name__ == "__main__":
     unittest.main()